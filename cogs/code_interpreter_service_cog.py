@@ -34,8 +34,9 @@ from langchain.utilities import GoogleSearchAPIWrapper
 from models.embed_statics_model import EmbedStatics
 from services.deletion_service import Deletion
 from services.environment_service import EnvService
+from services.lock_service import KeyedLockManager
 from services.moderations_service import Moderation
-from utils.safe_ctx_respond import safe_ctx_respond, safe_remove_list
+from utils.safe_ctx_respond import safe_ctx_respond
 
 
 class CaptureStdout:
@@ -88,7 +89,7 @@ class CodeInterpreterService(discord.Cog, name="CodeInterpreterService"):
         self.EMBED_CUTOFF = 2000
         self.redo_users = {}
         self.chat_agents = {}
-        self.thread_awaiting_responses = []
+        self.thread_awaiting_responses = KeyedLockManager()
         self.converser_cog = converser_cog
         self.executor = ThreadPoolExecutor(max_workers=10)
         self.initial_messages = {}
@@ -210,7 +211,8 @@ class CodeInterpreterService(discord.Cog, name="CodeInterpreterService"):
                             traceback.print_exc()
                             pass
 
-            self.thread_awaiting_responses.append(message.channel.id)
+            if not self.thread_awaiting_responses.try_acquire(message.channel.id):
+                return
 
             try:
                 await message.channel.trigger_typing()
@@ -240,7 +242,7 @@ class CodeInterpreterService(discord.Cog, name="CodeInterpreterService"):
                 await message.reply(
                     embed=EmbedStatics.get_code_chat_failure_embed(response)
                 )
-                safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+                self.thread_awaiting_responses.release(message.channel.id)
                 return
 
             # Parse the artifact names. After Artifacts: there should be a list in form [] where the artifact names are inside, comma separated inside stdout_output
@@ -297,7 +299,7 @@ class CodeInterpreterService(discord.Cog, name="CodeInterpreterService"):
                     ),
                 )
 
-            safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+            self.thread_awaiting_responses.release(message.channel.id)
 
     class SessionedCodeExecutor:
         def __init__(self):
@@ -11,6 +11,22 @@ from models.autocomplete_model import (
 
 ALLOWED_GUILDS = EnvService.get_allowed_guilds()
 
+# Discord's limits on an embed field value, the fields of an embed, and all the text of an embed
+EMBED_FIELD_LIMIT = 1024
+EMBED_MAX_FIELDS = 25
+EMBED_TEXT_LIMIT = 6000
+
+
+def format_stats(stats):
+    """The lines of a statistics section, as many as fit in an embed field"""
+    value = ""
+    for key, item in stats.items():
+        line = f"*{key}*: {item}"
+        if len(value) + len(line) + 1 > EMBED_FIELD_LIMIT - 2:
+            return value + "\n…" if value else line[: EMBED_FIELD_LIMIT - 1] + "…"
+        value = f"{value}\n{line}" if value else line
+    return value or "No data"
+
 
 class Commands(discord.Cog, name="Commands"):
     """Cog containing all slash and context commands as one-liners"""
@@ -1083,6 +1099,42 @@ class Commands(discord.Cog, name="Commands"):
             for embed in embed_list:
                 await ctx.channel.send(embed=embed)
 
+    @add_to_group("system")
+    @discord.slash_command(
+        name="performance",
+        description="Connection, cache and queue statistics for the current uptime",
+        guild_ids=ALLOWED_GUILDS,
+    )
+    @discord.guild_only()
+    async def performance(self, ctx: discord.ApplicationContext):
+        def new_embed():
+            return discord.Embed(
+                title="GPT3Bot Performance",
+                description="Statistics for the current uptime",
+                color=0x311432,
+            )
+
+        sections = {
+            **self.model.get_performance_stats(),
+            **self.converser_cog.get_performance_stats(),
+            "Scheduled deletions": self.deletion_queue.get_stats(),
+            "Debug messages": self.message_queue.get_stats(),
+        }
+        # Sections that don't fit in one embed go on to the next
+        embeds = [new_embed()]
+        for section, stats in sections.items():
+            value = format_stats(stats)
+            embed = embeds[-1]
+            if (
+                len(embed.fields) >= EMBED_MAX_FIELDS
+                or len(embed) + len(section) + len(value) > EMBED_TEXT_LIMIT
+            ):
+                embed = new_embed()
+                embeds.append(embed)
+            embed.add_field(name=section, value=value, inline=False)
+        for embed in embeds:
+            await ctx.respond(embed=embed, ephemeral=True)
+
     @discord.slash_command(
         name="setup",
         description="Setup your API key for use with GPT3Discord",
@@ -11,10 +11,10 @@ from discord.ext import pages
 from models.embed_statics_model import EmbedStatics
 from services.deletion_service import Deletion
 from services.environment_service import EnvService
+from services.lock_service import KeyedLockManager
 from services.moderations_service import Moderation
 from services.text_service import TextService
 from models.index_model import Index_handler
-from utils.safe_ctx_respond import safe_remove_list
 
 from llama_index.core.indices.vector_store.base import VectorStoreIndex
 from llama_index.vector_stores.qdrant import QdrantVectorStore
@@ -76,7 +76,7 @@ class IndexService(discord.Cog, name="IndexService"):
         super().__init__()
         self.bot = bot
         self.index_handler = Index_handler(bot, usage_service)
-        self.thread_awaiting_responses = []
+        self.thread_awaiting_responses = KeyedLockManager()
         self.deletion_queue = deletion_queue
 
     async def process_indexing(self, message, index_type, content=None, link=None):
@@ -120,7 +120,7 @@ class IndexService(discord.Cog, name="IndexService"):
             )
             failure_embed.set_thumbnail(url="https://i.imgur.com/hbdBZfG.png")
             await message.reply(embed=failure_embed)
-            safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+            self.thread_awaiting_responses.release(message.channel.id)
             return False
 
         success_embed = discord.Embed(
@@ -170,7 +170,8 @@ class IndexService(discord.Cog, name="IndexService"):
         prompt = message.content.strip()
 
         if await self.index_handler.get_is_in_index_chat(message):
-            self.thread_awaiting_responses.append(message.channel.id)
+            if not self.thread_awaiting_responses.try_acquire(message.channel.id):
+                return
 
             try:
                 await message.channel.trigger_typing()
@@ -187,7 +188,7 @@ class IndexService(discord.Cog, name="IndexService"):
                 )
 
                 if not indexing_result:
-                    safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+                    self.thread_awaiting_responses.release(message.channel.id)
                     return
 
                 prompt += (
@@ -206,7 +207,7 @@ class IndexService(discord.Cog, name="IndexService"):
                 )
 
                 if not indexing_result:
-                    safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+                    self.thread_awaiting_responses.release(message.channel.id)
                     return
 
                 prompt += (
@@ -220,7 +221,7 @@ class IndexService(discord.Cog, name="IndexService"):
                 )
             except openai.BadRequestError as e:
                 traceback.print_exc()
-                safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+                self.thread_awaiting_responses.release(message.channel.id)
                 await message.reply(
                     "This model is not supported with connected conversations."
                 )
@@ -247,7 +248,7 @@ class IndexService(discord.Cog, name="IndexService"):
                     await message.reply(
                         embed=response_embed,
                     )
-                safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+                self.thread_awaiting_responses.release(message.channel.id)
 
     async def index_chat_command(self, ctx, model, temperature, top_p):
         await self.index_handler.start_index_chat(ctx, model, temperature, top_p)
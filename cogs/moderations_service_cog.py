@@ -32,6 +32,8 @@ class ModerationsService(discord.Cog, name="ModerationsService"):
         self.bot = bot
         self.usage_service = usage_service
         self.model = model
+        # The moderation of conversations, searches and indexes goes through the bot's model too
+        Moderation.model = model
 
         # Moderation service data
         self.moderation_queues = {}
@@ -43,16 +43,17 @@ from llama_index.retrievers import VectorIndexRetriever
 from llama_index.query_engine import RetrieverQueryEngine
 from llama_index.prompts.chat_prompts import CHAT_REFINE_PROMPT
 from pydantic import Extra, BaseModel
-import tiktoken
 
 from models.embed_statics_model import EmbedStatics
 from models.search_model import Search
 from services.deletion_service import Deletion
 from services.environment_service import EnvService
+from services.lock_service import KeyedLockManager
 from services.moderations_service import Moderation
 from services.text_service import TextService
+from services.tokenizer_service import TOKENIZERS
 from models.openai_model import Models
-from utils.safe_ctx_respond import safe_ctx_respond, safe_remove_list
+from utils.safe_ctx_respond import safe_ctx_respond
 
 from contextlib import redirect_stdout
 
@@ -202,8 +203,7 @@ class CustomTextRequestWrapper(BaseModel):
         text = re.sub(r"\s+", " ", text).strip()
 
         # If not using GPT-4 and the text token amount is over 3500, truncate it to 3500 tokens
-        enc = tiktoken.encoding_for_model(model)
-        tokens = len(enc.encode(text))
+        tokens = TOKENIZERS.count(text, model)
         if len(text) < 5:
             return "This website could not be scraped. I cannot answer this question."
         if (
@@ -257,7 +257,7 @@ class SearchService(discord.Cog, name="SearchService"):
         self.EMBED_CUTOFF = 2000
         self.redo_users = {}
         self.chat_agents = {}
-        self.thread_awaiting_responses = []
+        self.thread_awaiting_responses = KeyedLockManager()
         self.converser_cog = converser_cog
         # Make a mapping of all the country codes and their full country names:
 
@@ -352,7 +352,8 @@ class SearchService(discord.Cog, name="SearchService"):
                 await thread.edit(archived=True)
                 return
 
-            self.thread_awaiting_responses.append(message.channel.id)
+            if not self.thread_awaiting_responses.try_acquire(message.channel.id):
+                return
 
             try:
                 await message.channel.trigger_typing()
@@ -390,7 +391,7 @@ class SearchService(discord.Cog, name="SearchService"):
                 await message.reply(
                     embed=EmbedStatics.get_internet_chat_failure_embed(response)
                 )
-                safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+                self.thread_awaiting_responses.release(message.channel.id)
                 return
 
             if len(response) > 2000:
@@ -416,7 +417,7 @@ class SearchService(discord.Cog, name="SearchService"):
                     )
                 await message.reply(embed=response_embed)
 
-            safe_remove_list(self.thread_awaiting_responses, message.channel.id)
+            self.thread_awaiting_responses.release(message.channel.id)
 
     async def search_chat_command(
         self,
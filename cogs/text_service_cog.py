@@ -18,16 +18,29 @@ from models.embed_statics_model import EmbedStatics
 from models.image_understanding_model import ImageUnderstandingModel
 from models.openai_model import Override
 from services.environment_service import EnvService
+from services.inbox_service import ConversationInbox
+from services.lock_service import KeyedLockManager
 from services.message_queue_service import Message
 from services.moderations_service import Moderation
-from models.user_model import Thread, EmbeddedConversationItem, Instruction
+from models.user_model import (
+    Thread,
+    EmbeddedConversationItem,
+    Instruction,
+    render_prompt,
+)
 from collections import defaultdict
 from sqlitedict import SqliteDict
 
+from services.archive_service import ConversationArchive
+from services.conversation_store_service import ConversationStore
+from services.journal_service import ConversationJournal
+from services.ownership_service import OwnershipIndex
 from services.pickle_service import Pickler
+from services.scheduler_service import SCHEDULER, Priority
+from services.sweeper_service import ConversationSweeper
 from services.sharegpt_service import ShareGPTService
 from services.text_service import SetupModal, TextService
-from utils.safe_ctx_respond import safe_ctx_respond, safe_remove_list
+from utils.safe_ctx_respond import safe_ctx_respond
 
 original_message = {}
 ALLOWED_GUILDS = EnvService.get_allowed_guilds()
@@ -43,6 +56,7 @@ USER_INPUT_API_KEYS = EnvService.get_user_input_api_keys()
 USER_KEY_DB = EnvService.get_api_db()
 CHAT_BYPASS_ROLES = EnvService.get_bypass_roles()
 PRE_MODERATE = EnvService.get_premoderate()
+JOURNAL_FLUSH_INTERVAL = EnvService.get_journal_flush_interval()
 FORCE_ENGLISH = EnvService.get_force_english()
 BOT_TAGGABLE = EnvService.get_bot_is_taggable()
 CHANNEL_CHAT_ROLES = EnvService.get_channel_chat_roles()
@@ -88,7 +102,6 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         DEBUG_CHANNEL,
         data_path: Path,
         qdrant_service,
-        pickle_queue,
     ):
         super().__init__()
         self.GLOBAL_COOLDOWN_TIME = 0.25
@@ -108,9 +121,6 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         self.users_to_interactions = defaultdict(list)
         self.redo_users = {}
 
-        # Pickle queue
-        self.pickle_queue = pickle_queue
-
         # Conversations-specific data
         self.END_PROMPTS = [
             "end",
@@ -119,11 +129,18 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
             "that's all",
             "that'll be all",
         ]
-        self.awaiting_responses = []
-        self.awaiting_thread_responses = []
-        self.conversation_threads = {}
-        self.full_conversation_history = defaultdict(list)
+        # The users and the threads a response is being generated for
+        self.awaiting_responses = KeyedLockManager()
+        self.awaiting_thread_responses = KeyedLockManager()
+        # Messages sent to busy threads, held to be answered afterwards (with queue_follow_ups on)
+        self.conversation_inbox = ConversationInbox()
+        # The task answering the held messages of each thread, while there is one
+        self.follow_up_tasks = {}
+        self.conversation_threads = ConversationStore()
+        self.full_conversation_history = ConversationArchive()
         self.instructions = defaultdict(list)
+        self.journal = ConversationJournal()
+        self.sweeper = ConversationSweeper()
         self.summarize = self.model.summarize_conversations
 
         # Qdrant data
@@ -215,7 +232,7 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         self.TEXT_CUTOFF = 1900
         self.EMBED_CUTOFF = 3900
         self.message_queue = message_queue
-        self.conversation_thread_owners = defaultdict(list)
+        self.conversation_thread_owners = OwnershipIndex()
 
     async def load_file(self, file, ctx):
         """Take filepath, return content or respond if not found"""
@@ -267,50 +284,53 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         )
         print("The debug channel was acquired")
 
+        # The conversation threads are kept in the conversation store, the pickled threads of earlier versions are
+        # moved into it once
+        try:
+            imported = await self.conversation_threads.import_pickle(
+                EnvService.save_path() / "pickles" / "conversation_threads.pickle"
+            )
+            if imported:
+                print(f"Imported {imported} conversation threads into the store")
+        except Exception:
+            traceback.print_exc()
+            print("Failed to import the pickled conversation threads")
+        print(f"{len(self.conversation_threads)} conversation threads in the store")
+        try:
+            imported = await self.full_conversation_history.import_pickle(
+                EnvService.save_path() / "pickles" / "full_conversation_history.pickle"
+            )
+            if imported:
+                print(f"Imported {imported} conversation texts into the archive")
+        except Exception:
+            traceback.print_exc()
+            print("Failed to import the pickled full conversation history")
+
         print("Attempting to load from pickles")
-        # Try to load self.full_conversation_history, self.conversation_threads, and self.conversation_thread_owners from the `pickles` folder
+        # Try to load self.conversation_thread_owners and self.instructions from the `pickles` folder, off the event
+        # loop
         try:
-            with open(
-                EnvService.save_path() / "pickles" / "full_conversation_history.pickle",
-                "rb",
-            ) as f:
-                self.full_conversation_history = pickle.load(f)
-                print("Loaded full_conversation_history")
-
-            with open(
-                EnvService.save_path() / "pickles" / "conversation_threads.pickle", "rb"
-            ) as f:
-                self.conversation_threads = pickle.load(f)
-                print("Loaded conversation_threads")
-
-            with open(
-                EnvService.save_path()
-                / "pickles"
-                / "conversation_thread_owners.pickle",
-                "rb",
-            ) as f:
-                self.conversation_thread_owners = pickle.load(f)
-                print("Loaded conversation_thread_owners")
-
-            with open(
-                EnvService.save_path() / "pickles" / "instructions.pickle",
-                "rb",
-            ) as f:
-                self.instructions = pickle.load(f)
-                print("Loaded instructions")
-
-            # Fail if all three weren't loaded
-            assert self.full_conversation_history is not {}
-            assert self.conversation_threads is not {}
-            assert self.conversation_thread_owners is not defaultdict(list)
+            self.conversation_thread_owners = OwnershipIndex(
+                await asyncio.to_thread(Pickler.load, "conversation_thread_owners")
+            )
+            print("Loaded conversation_thread_owners")
+
+            self.instructions = await asyncio.to_thread(Pickler.load, "instructions")
+            print("Loaded instructions")
 
         except Exception:
             print("Failed to load existing pickles")
-            self.full_conversation_history = defaultdict(list)
-            self.conversation_threads = {}
-            self.conversation_thread_owners = defaultdict(list)
+            self.conversation_thread_owners = OwnershipIndex()
             print("Set empty dictionaries, pickles will be saved in the future")
 
+        # Bring the conversations up to date with the changes journaled since the pickles were last written
+        try:
+            replayed = self.journal.replay(self)
+            print(f"Replayed {replayed} conversation journal records")
+        except Exception:
+            traceback.print_exc()
+            print("Failed to replay the conversation journal")
+
         print("Syncing commands...")
 
         try:
@@ -330,18 +350,21 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
             )
         print("Commands synced")
 
-        # Start an inline async loop that runs every 10 seconds to save the conversation history to a pickle file
-        print("Starting pickle loop")
+        # Start an inline async loop that saves the changes to the conversations every few hundred milliseconds,
+        # starting from fresh pickles that include the replayed journal
+        print("Starting conversation journal loop")
+        await self.conversation_threads.flush()
+        await self.full_conversation_history.flush()
+        await self.journal.compact(self)
+        asyncio.ensure_future(self.sweeper.run(self))
         while True:
-            await asyncio.sleep(15)
-            await self.pickle_queue.put(
-                Pickler(
-                    self.full_conversation_history,
-                    self.conversation_threads,
-                    self.conversation_thread_owners,
-                    self.instructions,
-                )
-            )
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+            try:
+                await self.conversation_threads.flush()
+                await self.full_conversation_history.flush()
+                await self.journal.flush(self)
+            except Exception:
+                traceback.print_exc()
 
     def check_conversing(self, channel_id, message_content):
         '''given channel id and a message, return true if it's a conversation thread, false if not, or if the message starts with "~"'''
@@ -355,6 +378,17 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
 
         return (cond1) and cond2
 
+    def get_performance_stats(self):
+        """Runtime statistics for the conversations, grouped by subsystem"""
+        return {
+            "Conversation store": self.conversation_threads.get_stats(),
+            "Conversation archive": self.full_conversation_history.get_stats(),
+            "Follow-up inbox": self.conversation_inbox.get_stats(),
+            "Conversation sweeper": self.sweeper.get_stats(),
+            "User locks": self.awaiting_responses.get_stats(),
+            "Thread locks": self.awaiting_thread_responses.get_stats(),
+        }
+
     async def end_conversation(
         self, ctx, opener_user_id=None, conversation_limit=False
     ):
@@ -371,8 +405,9 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
             channel_id = ctx.channel.id
         else:
             try:
-                channel_ids = self.conversation_thread_owners[normalized_user_id]
-                if ctx.channel.id not in channel_ids:
+                if not self.conversation_thread_owners.owns(
+                    normalized_user_id, ctx.channel.id
+                ):
                     await ctx.reply(
                         "This is not a conversation thread that you own!",
                         delete_after=5,
@@ -398,7 +433,10 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
 
         # TODO Possible bug here, if both users have a conversation active and one user tries to end the other, it may
         # allow them to click the end button on the other person's thread and it will end their own convo.
+        await self.conversation_threads.ensure_loaded(ctx.channel.id)
         self.conversation_threads.pop(ctx.channel.id)
+        self.conversation_inbox.discard(ctx.channel.id)
+        self.full_conversation_history.spill(ctx.channel.id)
 
         if isinstance(
             ctx, discord.ApplicationContext
@@ -431,14 +469,9 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         # If at conversation limit then fetch the owner and close the thread for them
         if conversation_limit:
             try:
-                owner_id = [
-                    owner
-                    for owner, threads in self.conversation_thread_owners.items()
-                    if channel_id in threads
-                ][0]
-                self.conversation_thread_owners[owner_id].remove(ctx.channel.id)
+                owner_id = self.conversation_thread_owners.remove(channel_id)
                 # Attempt to close and lock the thread.
-                if thread:
+                if thread and owner_id is not None:
                     try:
                         thread = await self.bot.fetch_channel(channel_id)
                         await thread.edit(name="Closed-GPT")
@@ -448,11 +481,8 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
             except Exception:
                 traceback.print_exc()
         else:
-            if normalized_user_id in self.conversation_thread_owners:
+            if self.conversation_thread_owners.remove(ctx.channel.id) is not None:
                 thread_id = ctx.channel.id
-                self.conversation_thread_owners[normalized_user_id].remove(
-                    ctx.channel.id
-                )
 
                 # Attempt to close and lock the thread.
                 if thread:
@@ -583,41 +613,11 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         """Put a message into the debug queue"""
         await self.message_queue.put(Message(debug_message, debug_channel))
 
-    async def queue_debug_chunks(self, debug_message, debug_channel):
-        """Put a message as chunks into the debug queue"""
-        debug_message_chunks = [
-            debug_message[i : i + self.TEXT_CUTOFF]
-            for i in range(0, len(debug_message), self.TEXT_CUTOFF)
-        ]
-
-        backticks_encountered = 0
-
-        for i, chunk in enumerate(debug_message_chunks):
-            # Count the number of backticks in the chunk
-            backticks_encountered += chunk.count("```")
-
-            # If it's the first chunk, append a "\n```\n" to the end
-            if i == 0:
-                chunk += "\n```\n"
-
-            # If it's an interior chunk, append a "```\n" to the end, and a "\n```\n" to the beginning
-            elif i < len(debug_message_chunks) - 1:
-                chunk = "\n```\n" + chunk + "```\n"
-
-            # If it's the last chunk, append a "```\n" to the beginning
-            else:
-                chunk = "```\n" + chunk
-
-            await self.message_queue.put(Message(chunk, debug_channel))
-
     async def send_debug_message(self, debug_message, debug_channel):
-        """process a debug message and put directly into queue or chunk it"""
+        """put a debug message into the queue, which sends a message too long for discord as a file"""
         # Send the debug message
         try:
-            if len(debug_message) > self.TEXT_CUTOFF:
-                await self.queue_debug_chunks(debug_message, debug_channel)
-            else:
-                await self.queue_debug_message(debug_message, debug_channel)
+            await self.queue_debug_message(debug_message, debug_channel)
         except Exception as e:
             traceback.print_exc()
             await self.message_queue.put(
@@ -642,7 +642,8 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
 
     async def summarize_conversation(self, message, prompt):
         """Takes a conversation history filled prompt and summarizes it to then start a new history with it as the base"""
-        response = await self.model.send_summary_request(prompt)
+        with SCHEDULER.priority(Priority.SUMMARIZATION):
+            response = await self.model.send_summary_request(prompt)
         summarized_text = response["choices"][0]["message"]["content"]
 
         new_conversation_history = []
@@ -688,6 +689,28 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
 
         await TextService.process_conversation_edit(self, after, original_message)
 
+    @discord.Cog.listener()
+    async def on_thread_update(self, before, after):
+        """Expire the conversation of a thread that was locked, give one that was archived some time to be resumed"""
+        if after.id not in self.conversation_threads:
+            return
+        if after.locked:
+            await self.sweeper.expire(self, after.id, "locked")
+        elif after.archived:
+            self.sweeper.thread_archived(after.id)
+        else:
+            self.sweeper.thread_unarchived(after.id)
+
+    @discord.Cog.listener()
+    async def on_raw_thread_delete(self, payload):
+        """Expire the conversation of a thread that was deleted, whether or not the thread was cached"""
+        await self.sweeper.expire(self, payload.thread_id, "deleted")
+
+    @discord.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        """A message deleted by someone else no longer needs deleting later"""
+        self.deletion_queue.cancel(payload.message_id)
+
     @discord.Cog.listener()
     async def on_message(self, message: discord.Message):
         """On a new message check if it should be moderated then process it for conversation"""
@@ -806,9 +829,60 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         self, author_id, channel_id, from_ask_command, from_edit_command
     ):
         """Remove user from ask/edit command response wait, if not any of those then process the id to remove user from thread response wait"""
-        safe_remove_list(self.awaiting_responses, author_id)
+        self.awaiting_responses.release(author_id)
         if not from_ask_command and not from_edit_command:
-            safe_remove_list(self.awaiting_thread_responses, channel_id)
+            self.release_thread(channel_id)
+
+    def release_thread(self, channel_id):
+        """Let the thread take messages again, and answer the messages held while it was busy"""
+        self.awaiting_thread_responses.release(channel_id)
+        if (
+            channel_id in self.conversation_inbox
+            and channel_id not in self.follow_up_tasks
+        ):
+            task = asyncio.get_running_loop().create_task(
+                self.answer_follow_ups(channel_id)
+            )
+            self.follow_up_tasks[channel_id] = task
+            task.add_done_callback(
+                lambda task: self.follow_ups_answered(channel_id, task)
+            )
+
+    async def answer_follow_ups(self, channel_id):
+        """
+        Answer the messages held for a thread that has freed up, one author's messages at a time, until there are
+        none left or the thread is busy with another message
+        """
+        while channel_id not in self.awaiting_thread_responses:
+            follow_up = self.conversation_inbox.take(channel_id)
+            if not follow_up:
+                return
+            # A message that is turned away or fails must not keep the others held
+            try:
+                await TextService.process_conversation_message(
+                    self,
+                    follow_up.message,
+                    USER_INPUT_API_KEYS,
+                    USER_KEY_DB,
+                    files=follow_up.files,
+                    amended_message=follow_up.content,
+                )
+            except Exception:
+                traceback.print_exc()
+
+    def follow_ups_answered(self, channel_id, task):
+        if self.follow_up_tasks.get(channel_id) is task:
+            del self.follow_up_tasks[channel_id]
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            print(f"Failed to answer the held messages of thread {channel_id}")
+            traceback.print_exception(type(error), error, error.__traceback__)
+        # The thread may have freed up again after the task stopped looking
+        if (
+            channel_id in self.conversation_inbox
+            and channel_id not in self.awaiting_thread_responses
+        ):
+            self.release_thread(channel_id)
 
     async def mention_to_username(self, ctx, message):
         """replaces discord mentions with their server nickname in text, if the user is not found keep the mention as is"""
@@ -932,9 +1006,14 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
 
         for thread in ctx.guild.threads:
             thread_name = thread.name.lower()
-            if "with gpt" in thread_name or "closed-gpt" in thread_name:
+            if (
+                thread.id in self.conversation_thread_owners
+                or "with gpt" in thread_name
+                or "closed-gpt" in thread_name
+            ):
                 try:
                     await thread.delete()
+                    await self.sweeper.expire(self, thread.id, "deleted")
                 except Exception:
                     pass
         await ctx.respond("All conversation threads in this server have been deleted.")
@@ -1355,7 +1434,7 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
         )
 
         # Set user as thread owner before sending anything that can error and leave the thread unowned
-        self.conversation_thread_owners[user_id_normalized].append(target.id)
+        self.conversation_thread_owners.add(user_id_normalized, target.id)
         overrides = self.conversation_threads[target.id].get_overrides()
 
         await target.send(f"<@{str(ctx.user.id)}> is the thread owner.")
@@ -1378,16 +1457,19 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
                 target_message = await target.send(
                     embed=EmbedStatics.generate_opener_embed(opener[:1900] + " [...]")
                 )
+            claimed_user = claimed_thread = False
             if target.id in self.conversation_threads:
-                self.awaiting_responses.append(user_id_normalized)
+                claimed_user = self.awaiting_responses.try_acquire(user_id_normalized)
                 if not self.qdrant_service:
                     self.conversation_threads[target.id].history.append(
-                        EmbeddedConversationItem(
-                            f"\n{ctx.author.display_name}: {opener} <|endofstatement|>\n",
+                        EmbeddedConversationItem.from_message(
+                            ctx.author.display_name,
+                            opener,
                             0,
+                            author_id=ctx.author.id,
                         )
                     )
-                self.awaiting_thread_responses.append(target.id)
+                claimed_thread = self.awaiting_thread_responses.try_acquire(target.id)
 
                 # ... (no other changes in the middle part of the function)
 
@@ -1403,14 +1485,8 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
                 target.id,
                 (
                     opener
-                    if target.id not in self.conversation_threads
-                    or self.qdrant_service
-                    else "".join(
-                        [
-                            item.text
-                            for item in self.conversation_threads[target.id].history
-                        ]
-                    )
+                    if target.id not in self.conversation_threads or self.qdrant_service
+                    else render_prompt(self.conversation_threads[target.id].history)
                 ),
                 target_message,
                 overrides=overrides,
@@ -1419,8 +1495,10 @@ class GPT3ComCon(discord.Cog, name="GPT3ComCon"):
                 custom_api_key=user_api_key,
                 is_drawable=draw,
             )
-            safe_remove_list(self.awaiting_responses, user_id_normalized)
-            safe_remove_list(self.awaiting_thread_responses, target.id)
+            if claimed_user:
+                self.awaiting_responses.release(user_id_normalized)
+            if claimed_thread:
+                self.release_thread(target.id)
 
     async def end_command(self, ctx: discord.ApplicationContext):
         """Command handler. Gets the user's thread and ends it"""
@@ -1598,6 +1676,9 @@ class ShareButton(discord.ui.Button["ShareView"]):
     async def callback(self, interaction: discord.Interaction):
         # Get the user
         try:
+            await self.converser_cog.full_conversation_history.ensure_loaded(
+                self.conversation_id
+            )
             id = await self.converser_cog.sharegpt_service.format_and_share(
                 self.converser_cog.full_conversation_history[self.conversation_id],
                 (
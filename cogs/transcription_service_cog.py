@@ -12,11 +12,13 @@ from discord.ext import pages
 from models.embed_statics_model import EmbedStatics
 from models.check_model import UrlCheck
 from services.environment_service import EnvService
+from services.logging_service import PayloadLogger
 from services.text_service import TextService
 
 ALLOWED_GUILDS = EnvService.get_allowed_guilds()
 USER_INPUT_API_KEYS = EnvService.get_user_input_api_keys()
 USER_KEY_DB = EnvService.get_api_db()
+logger = PayloadLogger("transcription")
 
 
 class TranscribeService(discord.Cog, name="TranscribeService"):
@@ -110,7 +112,7 @@ class TranscribeService(discord.Cog, name="TranscribeService"):
             response = await self.model.send_transcription_request(
                 file, temperature, user_api_key
             )
-            print(response)
+            logger.payload("Transcription", response)
 
             if len(response) > 4080:
                 # Chunk the response into 2048 character chunks, each an embed page
@@ -25,13 +25,12 @@ from cogs.commands import Commands
 from cogs.transcription_service_cog import TranscribeService
 from cogs.translation_service_cog import TranslationService
 from cogs.index_service_cog import IndexService
-from models.deepl_model import TranslationModel
 from services.health_service import HealthService
-from services.pickle_service import Pickler
 
 from services.qdrant_service import QdrantService
-from services.deletion_service import Deletion
-from services.message_queue_service import Message
+from services.deletion_service import DeletionScheduler
+from services.embedding_cache_service import EMBEDDING_CACHE
+from services.message_queue_service import MessageDispatcher
 from services.usage_service import UsageService
 from services.environment_service import EnvService
 
@@ -90,10 +89,10 @@ if QDRANT_API_KEY and QDRANT_HOST and QDRANT_PORT and QDRANT_INDEX_NAME:
 #
 # Message queueing for the debug service, defer debug messages to be sent later so we don't hit rate limits.
 #
-message_queue = asyncio.Queue()
-deletion_queue = asyncio.Queue()
-asyncio.ensure_future(Message.process_message_queue(message_queue, 1.5, 5))
-asyncio.ensure_future(Deletion.process_deletion_queue(deletion_queue, 1, 1))
+message_queue = MessageDispatcher()
+deletion_queue = DeletionScheduler()
+asyncio.ensure_future(message_queue.run())
+asyncio.ensure_future(deletion_queue.run())
 
 # Pickling service for conversation persistence
 try:
@@ -103,8 +102,6 @@ except Exception:
     print(
         "Could not start pickle service. Conversation history will not be persistent across restarts."
     )
-pickle_queue = asyncio.Queue()
-asyncio.ensure_future(Pickler.process_pickle_queue(pickle_queue, 5, 1))
 
 
 #
@@ -126,6 +123,9 @@ model = Model(usage_service)
 @bot.event  # Using self gives u
 async def on_ready():  # I can make self optional by
     print("We have logged in as {0.user}".format(bot))
+    restored = await deletion_queue.restore(bot)
+    if restored:
+        print(f"Rescheduled {restored} pending message deletions")
 
 
 @bot.event
@@ -161,7 +161,6 @@ async def main():
             debug_channel,
             data_path,
             qdrant_service=qdrant_service,
-            pickle_queue=pickle_queue,
         )
     )
 
@@ -197,7 +196,9 @@ async def main():
     )
 
     if EnvService.get_deepl_token():
-        bot.add_cog(TranslationService(bot, TranslationModel()))
+        bot.add_cog(
+            TranslationService(bot, bot.get_cog("GPT3ComCon").translation_model)
+        )
         print("The translation service is enabled.")
 
     if (
@@ -248,7 +249,14 @@ async def main():
 
     apply_multicog(bot)
 
-    await bot.start(os.getenv("DISCORD_TOKEN"))
+    try:
+        await bot.start(os.getenv("DISCORD_TOKEN"))
+    finally:
+        # Release the pooled HTTP connections on shutdown
+        await model.close()
+        await bot.get_cog("GPT3ComCon").translation_model.close()
+        await deletion_queue.save()
+        await asyncio.to_thread(EMBEDDING_CACHE.flush)
 
 
 def check_process_file(pid_file: Path) -> bool:
@@ -55,6 +55,10 @@ class Settings_autocompleter:
             "image_size": ImageSize.ALL_SIZES,
             "summarize_conversation": ["True", "False"],
             "welcome_message_enabled": ["True", "False"],
+            "stream_responses": ["True", "False"],
+            "cache_responses": ["True", "False"],
+            "trim_conversations": ["True", "False"],
+            "queue_follow_ups": ["True", "False"],
             "num_static_conversation_items": [
                 str(num)
                 for num in range(
@@ -4,6 +4,11 @@ import traceback
 import aiohttp
 import backoff
 
+from services.connection_pool_service import ConnectionPool
+from services.logging_service import PayloadLogger
+
+logger = PayloadLogger("translation")
+
 COUNTRY_CODES = {
     "EN": "English",
     "ES": "Spanish",
@@ -34,8 +39,18 @@ COUNTRY_CODES = {
 
 
 class TranslationModel:
-    def __init__(self):
+    def __init__(self, connection_pool=None):
         self.deepl_token = os.getenv("DEEPL_TOKEN")
+        # DeepL gets a pool of its own, its requests don't count against the OpenAI rate limits and scheduler
+        self.connection_pool = (
+            connection_pool
+            if connection_pool is not None
+            else ConnectionPool(rate_limiter=None)
+        )
+
+    async def close(self):
+        """Release the pooled connections, called when the bot shuts down"""
+        await self.connection_pool.close()
 
     def backoff_handler(details):
         print(
@@ -52,7 +67,7 @@ class TranslationModel:
         on_backoff=backoff_handler,
     )
     async def send_translate_request(self, text, translate_language, formality):
-        async with aiohttp.ClientSession(raise_for_status=True) as session:
+        async with self.connection_pool.session(raise_for_status=True) as session:
             payload = {
                 "text": text,
                 "target_lang": translate_language,
@@ -68,7 +83,7 @@ class TranslationModel:
                 headers=headers,
             ) as resp:
                 response = await resp.json()
-                print(response)
+                logger.payload("Response", response)
 
                 try:
                     return (
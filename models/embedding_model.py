@@ -0,0 +1,64 @@
+import asyncio
+from typing import List
+
+from llama_index import OpenAIEmbedding
+
+from services.embedding_cache_service import EMBEDDING_CACHE
+
+
+class CachedOpenAIEmbedding(OpenAIEmbedding):
+    """
+    The llama_index OpenAI embedding model, but consulting the shared embedding cache before calling the API,
+    re-indexing the same documents or asking the same query twice then doesn't need any embedding requests.
+    The ada-002 model embeds queries and documents the same way, so both share the cache entries.
+    """
+
+    def _get_cached(self, texts):
+        return [EMBEDDING_CACHE.get(self.model_name, text) for text in texts]
+
+    def _store(self, texts, embeddings):
+        for text, embedding in zip(texts, embeddings):
+            EMBEDDING_CACHE.put(self.model_name, text, embedding)
+
+    async def _aget_cached(self, texts):
+        return list(
+            await asyncio.gather(
+                *[EMBEDDING_CACHE.aget(self.model_name, text) for text in texts]
+            )
+        )
+
+    async def _astore(self, texts, embeddings):
+        for text, embedding in zip(texts, embeddings):
+            await EMBEDDING_CACHE.aput(self.model_name, text, embedding)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._get_text_embeddings([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return (await self._aget_text_embeddings([query]))[0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self._get_cached(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fetched = super()._get_text_embeddings([texts[i] for i in missing])
+            self._store([texts[i] for i in missing], fetched)
+            for i, embedding in zip(missing, fetched):
+                embeddings[i] = embedding
+        return embeddings
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        embeddings = await self._aget_cached(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fetched = await super()._aget_text_embeddings([texts[i] for i in missing])
+            await self._astore([texts[i] for i in missing], fetched)
+            for i, embedding in zip(missing, fetched):
+                embeddings[i] = embedding
+        return embeddings
@@ -11,7 +11,6 @@ import discord
 import aiofiles
 import httpx
 import openai
-import tiktoken
 from functools import partial
 from typing import List, Optional, cast
 from pathlib import Path
@@ -62,7 +61,6 @@ from llama_index import (
     GPTTreeIndex,
     GoogleDocsReader,
     MockLLMPredictor,
-    OpenAIEmbedding,
     GithubRepositoryReader,
     MockEmbedding,
     download_loader,
@@ -82,9 +80,13 @@ from llama_index.composability import ComposableGraph
 from llama_index.vector_stores import DocArrayInMemoryVectorStore
 
 from models.embed_statics_model import EmbedStatics
+from models.embedding_model import CachedOpenAIEmbedding
 from models.openai_model import Models
 from models.check_model import UrlCheck
 from services.environment_service import EnvService
+from services.rate_limit_service import RATE_LIMITER
+from services.scheduler_service import SCHEDULER, Priority, scheduled
+from services.tokenizer_service import TOKENIZERS
 from utils.safe_ctx_respond import safe_ctx_respond
 
 SHORT_TO_LONG_CACHE = {}
@@ -94,9 +96,9 @@ MarkdownReader = download_loader("MarkdownReader")
 RemoteReader = download_loader("RemoteReader")
 RemoteDepthReader = download_loader("RemoteDepthReader")
 
-embedding_model = OpenAIEmbedding()
+embedding_model = CachedOpenAIEmbedding()
 token_counter = TokenCountingHandler(
-    tokenizer=tiktoken.encoding_for_model("text-davinci-003").encode,
+    tokenizer=TOKENIZERS.for_model("text-davinci-003").encode,
     verbose=False,
 )
 node_parser = SimpleNodeParser.from_defaults(
@@ -270,9 +272,9 @@ class IndexData:
 
 
 class Index_handler:
-    embedding_model = OpenAIEmbedding()
+    embedding_model = CachedOpenAIEmbedding()
     token_counter = TokenCountingHandler(
-        tokenizer=tiktoken.encoding_for_model("text-davinci-003").encode,
+        tokenizer=TOKENIZERS.for_model("text-davinci-003").encode,
         verbose=False,
     )
     node_parser = SimpleNodeParser.from_defaults(
@@ -387,6 +389,13 @@ class Index_handler:
 
         self.usage_service.update_usage_memory(ctx.guild.name, "index_chat_message", 1)
 
+        # The agent talks to the API through langchain, so we can only hold it back until the budget allows
+        await RATE_LIMITER.acquire(
+            os.environ["OPENAI_API_KEY"],
+            self.index_chat_chains[ctx.channel.id].llm.model_name,
+            self.usage_service.count_tokens(message),
+        )
+
         agent_output = await self.loop.run_in_executor(
             None,
             partial(self.index_chat_chains[ctx.channel.id].agent_chain.run, message),
@@ -986,14 +995,15 @@ class Index_handler:
                 self.usage_service.update_usage_memory(
                     index_chat_ctx.guild.name, "index_chat_link", 1
                 )
-                summary = await index.as_query_engine(
-                    response_mode="tree_summarize",
-                    service_context=get_service_context_with_llm(
-                        self.index_chat_chains[index_chat_ctx.channel.id].llm
-                    ),
-                ).aquery(
-                    "What is a summary or general idea of this document? Be detailed in your summary but not too verbose. Your summary should be under 50 words. This summary will be used in a vector index to retrieve information about certain data. So, at a high level, the summary should describe the document in such a way that a retriever would know to select it when asked questions about it. The link was {link}. Include the an easy identifier derived from the link at the end of the summary."
-                )
+                async with SCHEDULER.slot(Priority.SUMMARIZATION):
+                    summary = await index.as_query_engine(
+                        response_mode="tree_summarize",
+                        service_context=get_service_context_with_llm(
+                            self.index_chat_chains[index_chat_ctx.channel.id].llm
+                        ),
+                    ).aquery(
+                        "What is a summary or general idea of this document? Be detailed in your summary but not too verbose. Your summary should be under 50 words. This summary will be used in a vector index to retrieve information about certain data. So, at a high level, the summary should describe the document in such a way that a retriever would know to select it when asked questions about it. The link was {link}. Include the an easy identifier derived from the link at the end of the summary."
+                    )
                 print("Got transcript summary")
 
                 engine = self.get_query_engine(
@@ -1198,6 +1208,7 @@ class Index_handler:
 
         return documents
 
+    @scheduled(Priority.BULK)
     async def compose_indexes(self, user_id, indexes, name, deep_compose):
         # Load all the indexes first
         index_objects = []
@@ -1224,13 +1235,13 @@ class Index_handler:
             for _index in index_objects:
                 documents.extend(await self.index_to_docs(_index, 256, 20))
 
-            embedding_model = OpenAIEmbedding()
+            embedding_model = CachedOpenAIEmbedding()
 
             llm_predictor_mock = MockLLMPredictor()
             embedding_model_mock = MockEmbedding(1536)
 
             token_counter_mock = TokenCountingHandler(
-                tokenizer=tiktoken.encoding_for_model("text-davinci-003").encode,
+                tokenizer=TOKENIZERS.for_model("text-davinci-003").encode,
                 verbose=False,
             )
 
@@ -1398,6 +1409,11 @@ class Index_handler:
         )
 
         try:
+            await RATE_LIMITER.acquire(
+                os.environ["OPENAI_API_KEY"],
+                model,
+                self.usage_service.count_tokens(query),
+            )
             token_counter.reset_counts()
             response = await self.loop.run_in_executor(
                 None,
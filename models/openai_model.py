@@ -15,7 +15,16 @@ import discord
 
 # An enum of two modes, TOP_P or TEMPERATURE
 import requests
+from models.user_model import END_OF_STATEMENT, cleanse_username
+from services.connection_pool_service import ConnectionPool
+from services.embedding_batch_service import EmbeddingBatcher
+from services.embedding_cache_service import EMBEDDING_CACHE
+from services.response_cache_service import ResponseCache
+from services.scheduler_service import SCHEDULER
+from services.single_flight_service import SingleFlight, single_flight
+from services.tokenizer_service import TOKENIZERS
 from services.environment_service import EnvService
+from services.logging_service import PayloadLogger
 from PIL import Image
 from discord import File
 from sqlitedict import SqliteDict
@@ -32,6 +41,9 @@ except Exception as e:
     print("Failed to retrieve the settings DB. The bot is terminating.")
     raise e
 
+logger = PayloadLogger("openai")
+image_logger = PayloadLogger("images")
+
 
 class Mode:
     TEMPERATURE = "temperature"
@@ -182,6 +194,75 @@ class ModelLimits:
     MAX_PROMPT_MIN_LENGTH = 4000
 
 
+class ChatCompletionStream:
+    """
+    A streamed chat completion. Iterating over it yields the content deltas as they arrive, once it is exhausted
+    `response` holds a regular (non-streamed) shaped response so that downstream code can treat both the same.
+    """
+
+    def __init__(self, model, resp, model_selection, prompt_tokens):
+        self.model = model
+        self.model_selection = model_selection
+        self.prompt_tokens = prompt_tokens
+        self.text = ""
+        self.finish_reason = None
+        self.response = None
+        self._resp = resp
+
+    async def __aiter__(self):
+        usage = None
+        response_model = self.model_selection
+        try:
+            async for raw_line in self._resp.content:
+                line = raw_line.decode("utf-8").strip()
+                # Server sent events, every payload line is prefixed by "data:"
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                response_model = chunk.get("model", response_model)
+                if chunk.get("usage"):
+                    usage = chunk["usage"]
+                if not chunk.get("choices"):
+                    continue
+
+                choice = chunk["choices"][0]
+                if choice.get("finish_reason"):
+                    self.finish_reason = choice["finish_reason"]
+                delta = choice.get("delta", {}).get("content")
+                if delta:
+                    self.text += delta
+                    yield delta
+        finally:
+            self._resp.release()
+
+        # Streamed responses don't report usage, so count the tokens ourselves to keep the accounting right
+        if not usage:
+            completion_tokens = self.model.usage_service.count_tokens(self.text)
+            usage = {
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": self.prompt_tokens + completion_tokens,
+            }
+
+        self.response = {
+            "object": "chat.completion",
+            "model": response_model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": self.text},
+                    "finish_reason": self.finish_reason,
+                }
+            ],
+            "usage": usage,
+        }
+        await self.model.valid_text_request(self.response, model=self.model_selection)
+
+
 class Model:
     def set_initial_state(self, usage_service):
         self.mode = Mode.TEMPERATURE
@@ -263,6 +344,26 @@ class Model:
         self.use_org = (
             bool(SETTINGS_DB["use_org"]) if "use_org" in SETTINGS_DB else False
         )
+        self.stream_responses = (
+            bool(SETTINGS_DB["stream_responses"])
+            if "stream_responses" in SETTINGS_DB
+            else False
+        )
+        self.cache_responses = (
+            bool(SETTINGS_DB["cache_responses"])
+            if "cache_responses" in SETTINGS_DB
+            else False
+        )
+        self.trim_conversations = (
+            bool(SETTINGS_DB["trim_conversations"])
+            if "trim_conversations" in SETTINGS_DB
+            else True
+        )
+        self.queue_follow_ups = (
+            bool(SETTINGS_DB["queue_follow_ups"])
+            if "queue_follow_ups" in SETTINGS_DB
+            else False
+        )
 
     def reset_settings(self):
         keys = [
@@ -283,6 +384,10 @@ class Model:
             "num_static_conversation_items",
             "num_conversation_lookback",
             "use_org",
+            "stream_responses",
+            "cache_responses",
+            "trim_conversations",
+            "queue_follow_ups",
         ]
         for key in keys:
             try:
@@ -314,6 +419,10 @@ class Model:
         self._temp = None
         self._mode = None
         self._use_org = None
+        self._stream_responses = None
+        self._cache_responses = None
+        self._trim_conversations = None
+        self._queue_follow_ups = None
         self.set_initial_state(usage_service)
 
         try:
@@ -336,10 +445,63 @@ class Model:
             "openai_key",
             "openai_organization",
             "IMAGE_SAVE_PATH",
+            "connection_pool",
+            "embedding_batcher",
+            "response_cache",
+            "single_flight",
+            "api_base",
         ]
 
         self.openai_key = EnvService.get_openai_token()
         self.openai_organization = EnvService.get_openai_organization()
+        # Can be pointed at any OpenAI compatible server, e.g. the mock server in tests/mock_openai_server.py
+        self.api_base = EnvService.get_openai_api_base()
+
+        # A single keep-alive connection pool shared by every request this model sends
+        self.connection_pool = ConnectionPool()
+        # Concurrent embedding requests are coalesced into batched API calls
+        self.embedding_batcher = EmbeddingBatcher(
+            self.send_embedding_batch_request, self.usage_service.count_tokens
+        )
+        # Responses to /gpt ask style requests that will come out the same when asked again
+        self.response_cache = ResponseCache()
+        # Identical requests that are in flight at the same time are only sent once
+        self.single_flight = SingleFlight()
+
+    def get_performance_stats(self):
+        """Runtime statistics for the request path, grouped by subsystem"""
+        return {
+            "HTTP connection pool": self.connection_pool.get_stats(),
+            "Rate limits": self.connection_pool.rate_limiter.get_stats(),
+            "Embedding batches": self.embedding_batcher.get_stats(),
+            "Embedding cache": EMBEDDING_CACHE.get_stats(),
+            "Response cache": self.response_cache.get_stats(),
+            "Coalesced requests": self.single_flight.get_stats(),
+            "Scheduler": SCHEDULER.get_stats(),
+            "Tokenizers": TOKENIZERS.get_stats(),
+        }
+
+    def get_response_cache_key(self, payload, use_cache):
+        """The response cache key of a request, or None if its response shouldn't be cached"""
+        if not use_cache:
+            return None
+        # Sampled responses are only cached if explicitly asked for
+        if payload["temperature"] != 0 and not self.cache_responses:
+            return None
+        return self.response_cache.fingerprint(payload)
+
+    def get_cached_response(self, cache_key, refresh_cache=False):
+        """The cached response to a request, or None if it has to be sent. Hits count in the cache's stats"""
+        if not cache_key or refresh_cache:
+            return None
+        response = self.response_cache.get(cache_key)
+        if response is not None:
+            logger.debug("Serving the response from the response cache")
+        return response
+
+    async def close(self):
+        """Release the pooled connections, called when the bot shuts down"""
+        await self.connection_pool.close()
 
     # Use the @property and @setter decorators for all the self fields to provide value checking
 
@@ -352,6 +514,70 @@ class Model:
         self._use_org = value
         SETTINGS_DB["use_org"] = value
 
+    @property
+    def stream_responses(self):
+        return self._stream_responses
+
+    @stream_responses.setter
+    def stream_responses(self, value):
+        if not isinstance(value, bool):
+            if value.lower() == "true":
+                value = True
+            elif value.lower() == "false":
+                value = False
+            else:
+                raise ValueError("Value must be either `true` or `false`!")
+        self._stream_responses = value
+        SETTINGS_DB["stream_responses"] = value
+
+    @property
+    def cache_responses(self):
+        return self._cache_responses
+
+    @cache_responses.setter
+    def cache_responses(self, value):
+        if not isinstance(value, bool):
+            if value.lower() == "true":
+                value = True
+            elif value.lower() == "false":
+                value = False
+            else:
+                raise ValueError("Value must be either `true` or `false`!")
+        self._cache_responses = value
+        SETTINGS_DB["cache_responses"] = value
+
+    @property
+    def trim_conversations(self):
+        return self._trim_conversations
+
+    @trim_conversations.setter
+    def trim_conversations(self, value):
+        if not isinstance(value, bool):
+            if value.lower() == "true":
+                value = True
+            elif value.lower() == "false":
+                value = False
+            else:
+                raise ValueError("Value must be either `true` or `false`!")
+        self._trim_conversations = value
+        SETTINGS_DB["trim_conversations"] = value
+
+    @property
+    def queue_follow_ups(self):
+        return self._queue_follow_ups
+
+    @queue_follow_ups.setter
+    def queue_follow_ups(self, value):
+        if not isinstance(value, bool):
+            if value.lower() == "true":
+                value = True
+            elif value.lower() == "false":
+                value = False
+            else:
+                raise ValueError("Value must be either `true` or `false`!")
+        self._queue_follow_ups = value
+        SETTINGS_DB["queue_follow_ups"] = value
+
     @property
     def num_static_conversation_items(self):
         return self._num_static_conversation_items
@@ -697,13 +923,15 @@ class Model:
         max_tries=4,
         on_backoff=backoff_handler_http,
     )
-    async def send_embedding_request(self, text, custom_api_key=None):
-        async with aiohttp.ClientSession(
+    async def send_embedding_batch_request(
+        self, texts, custom_api_key=None, estimated_tokens=None
+    ):
+        async with self.connection_pool.session(
             raise_for_status=True, timeout=aiohttp.ClientTimeout(total=300)
         ) as session:
             payload = {
                 "model": Models.EMBEDDINGS,
-                "input": text,
+                "input": texts,
             }
             headers = {
                 "Content-Type": "application/json",
@@ -714,16 +942,36 @@ class Model:
                 if self.openai_organization:
                     headers["OpenAI-Organization"] = self.openai_organization
             async with session.post(
-                "https://api.openai.com/v1/embeddings", json=payload, headers=headers
+                f"{self.api_base}/embeddings",
+                json=payload,
+                headers=headers,
+                estimated_tokens=estimated_tokens,
             ) as resp:
                 response = await resp.json()
 
                 try:
-                    return response["data"][0]["embedding"]
+                    # The embeddings are not guaranteed to come back in the order of the inputs
+                    data = sorted(response["data"], key=lambda item: item["index"])
+                    return [item["embedding"] for item in data]
                 except Exception:
                     print(response)
                     traceback.print_exc()
-                    return
+                    return [None] * len(texts)
+
+    @single_flight
+    async def send_embedding_request(self, text, custom_api_key=None):
+        embedding = await EMBEDDING_CACHE.aget(Models.EMBEDDINGS, text)
+        if embedding is not None:
+            return embedding
+
+        embedding = await self.embedding_batcher.embed(text, custom_api_key)
+        await EMBEDDING_CACHE.aput(Models.EMBEDDINGS, text, embedding)
+        return embedding
+
+    async def send_embedding_requests(self, texts, custom_api_key=None):
+        return await asyncio.gather(
+            *[self.send_embedding_request(text, custom_api_key) for text in texts]
+        )
 
     @backoff.on_exception(
         backoff.expo,
@@ -741,12 +989,11 @@ class Model:
         top_p_override=None,
         custom_api_key=None,
     ):
-        print(
-            f"The text about to be edited is [{text}] with instructions [{instruction}]"
-        )
-        print(f"Overrides -> temp:{temp_override}, top_p:{top_p_override}")
+        logger.payload("Text to edit", text)
+        logger.payload("Edit instruction", instruction)
+        logger.debug("Overrides -> temp:%s, top_p:%s", temp_override, top_p_override)
 
-        async with aiohttp.ClientSession(
+        async with self.connection_pool.session(
             raise_for_status=False, timeout=aiohttp.ClientTimeout(total=300)
         ) as session:
             payload = {
@@ -765,12 +1012,13 @@ class Model:
                 if self.openai_organization:
                     headers["OpenAI-Organization"] = self.openai_organization
             async with session.post(
-                "https://api.openai.com/v1/edits", json=payload, headers=headers
+                f"{self.api_base}/edits", json=payload, headers=headers
             ) as resp:
                 response = await resp.json()
                 await self.valid_text_request(response, model=Models.EDIT)
                 return response
 
+    @single_flight
     @backoff.on_exception(
         backoff.expo,
         aiohttp.ClientResponseError,
@@ -781,14 +1029,14 @@ class Model:
     )
     async def send_moderations_request(self, text):
         # Use aiohttp to send the above request:
-        async with aiohttp.ClientSession(raise_for_status=True) as session:
+        async with self.connection_pool.session(raise_for_status=True) as session:
             headers = {
                 "Content-Type": "application/json",
                 "Authorization": f"Bearer {self.openai_key}",
             }
             payload = {"input": text}
             async with session.post(
-                "https://api.openai.com/v1/moderations",
+                f"{self.api_base}/moderations",
                 headers=headers,
                 json=payload,
             ) as response:
@@ -825,7 +1073,7 @@ class Model:
             }
         )
 
-        async with aiohttp.ClientSession(
+        async with self.connection_pool.session(
             raise_for_status=False, timeout=aiohttp.ClientTimeout(total=300)
         ) as session:
             payload = {
@@ -845,7 +1093,7 @@ class Model:
                     headers["OpenAI-Organization"] = self.openai_organization
 
             async with session.post(
-                "https://api.openai.com/v1/chat/completions",
+                f"{self.api_base}/chat/completions",
                 json=payload,
                 headers=headers,
             ) as resp:
@@ -860,6 +1108,7 @@ class Model:
 
                 return response
 
+    @single_flight
     @backoff.on_exception(
         backoff.expo,
         ValueError,
@@ -885,7 +1134,7 @@ class Model:
 
         print(f"Language detection request for {text}")
 
-        async with aiohttp.ClientSession(raise_for_status=False) as session:
+        async with self.connection_pool.session(raise_for_status=False) as session:
             payload = {
                 "model": Models.DAVINCI,
                 "prompt": prompt,
@@ -899,22 +1148,95 @@ class Model:
                 if self.openai_organization:
                     headers["OpenAI-Organization"] = self.openai_organization
             async with session.post(
-                "https://api.openai.com/v1/completions", json=payload, headers=headers
+                f"{self.api_base}/completions", json=payload, headers=headers
             ) as resp:
                 response = await resp.json()
 
                 await self.valid_text_request(response)
-                print(f"Response -> {response}")
+                logger.payload("Response", response)
 
                 return response
 
     def cleanse_username(self, text):
-        text = text.strip()
-        text = text.replace(":", "")
-        text = text.replace(" ", "")
-        # Replace any character that's not a letter or number with an underscore
-        text = re.sub(r"[^a-zA-Z0-9]", "_", text)
-        return text
+        return cleanse_username(text)
+
+    @staticmethod
+    def format_history_item(item, bot_name, vision):
+        """The chat message of a single (non-pretext) conversation history item"""
+        role, name, text = item.parse(bot_name)
+        if role == "system":
+            return {"role": "system", "content": text}
+
+        if not vision:
+            return {"role": role, "name": name, "content": text}
+
+        if item.image_urls is None:
+            # Items without an image list can't be sent to vision models as a user message
+            return {
+                "role": "system",
+                "content": item.text.replace(END_OF_STATEMENT, ""),
+            }
+        content = [{"type": "text", "text": text}]
+        for image_url in item.image_urls:
+            content.append(
+                {
+                    "type": "image_url",
+                    "image_url": {"url": image_url, "detail": "high"},
+                }
+            )
+        return {"role": role, "name": name, "content": content}
+
+    def format_chat_messages(
+        self,
+        prompt_history,
+        model_selection,
+        bot_name,
+        user_displayname,
+        system_prompt_override=None,
+        message_cache=None,
+    ) -> List[dict]:
+        """
+        Convert the conversation history items into the chat completions messages format. When the history is that
+        of a thread, pass its ChatMessageList as message_cache so only the messages of new items are built.
+        """
+        # Format the request body into the messages format that the API is expecting
+        #   "messages": [{"role": "user", "content": "Hello!"}]
+        messages = []
+        if prompt_history:
+            if not system_prompt_override:
+                # The first message is the context prompt.
+                messages.append({"role": "system", "content": prompt_history[0].text})
+            else:
+                # When we have a system prompt override, we're trying to do a one-off chatcompletion WITH VISION. So we use the override
+                # param as the new system prompt and the first message as the user message. This is messy, and I'll clean it up soon
+                messages.append({"role": "system", "content": system_prompt_override})
+                messages.append(
+                    {
+                        "role": "user",
+                        "name": user_displayname,
+                        "content": prompt_history[0].text,
+                    }
+                )
+
+        vision = "-vision" in model_selection
+        format_item = functools.partial(
+            self.format_history_item, bot_name=bot_name, vision=vision
+        )
+        if message_cache is not None:
+            messages.extend(
+                message_cache.build(prompt_history[1:], (bot_name, vision), format_item)
+            )
+        else:
+            messages.extend(format_item(item) for item in prompt_history[1:])
+
+        return messages
+
+    def count_history_tokens(self, prompt_history, system_prompt_override=None):
+        """The prompt tokens of a chat request, from the token counts cached on the history items"""
+        tokens = sum(item.token_count() for item in prompt_history)
+        if system_prompt_override:
+            tokens += self.usage_service.count_tokens(system_prompt_override)
+        return tokens
 
     @backoff.on_exception(
         backoff.expo,
@@ -940,6 +1262,7 @@ class Model:
         custom_api_key=None,
         system_prompt_override=None,
         respond_json=None,
+        message_cache=None,
     ) -> Tuple[
         dict, bool
     ]:  # The response, and a boolean indicating whether or not the context limit was reached.
@@ -947,110 +1270,17 @@ class Model:
         model_selection = self.model if not model else model
         print("The model selection is " + model_selection)
 
-        # Clean up the bot name
-        bot_name_clean = self.cleanse_username(bot_name)
-
-        # Format the request body into the messages format that the API is expecting
-        #   "messages": [{"role": "user", "content": "Hello!"}]
-        messages = []
-        for number, message in enumerate(prompt_history):
-            if number == 0:
-                if not system_prompt_override:
-                    # If this is the first message, it is the context prompt.
-                    messages.append(
-                        {
-                            "role": "system",
-                            "content": message.text,
-                        }
-                    )
-                    continue
-                else:
-                    # When we have a system prompt override, we're trying to do a one-off chatcompletion WITH VISION. So we use the override
-                    # param as the new system prompt and the first message as the user message. This is messy, and I'll clean it up soon
-                    messages.append(
-                        {
-                            "role": "system",
-                            "content": system_prompt_override,
-                        }
-                    )
-                    messages.append(
-                        {
-                            "role": "user",
-                            "name": user_displayname,
-                            "content": message.text,
-                        }
-                    )
-                    continue
-
-            try:
-                if (
-                    message.text.strip()
-                    .lower()
-                    .startswith("this conversation has some context from earlier")
-                ):
-                    raise Exception("This is a context message")
-
-                if message.text.startswith(f"\n{bot_name}"):
-                    role = "assistant"
-                    text = message.text.replace(bot_name, "")
-                    text = text.replace("<|endofstatement|>", "")
-                else:
-                    role = "user"
-                    username = re.search(r"(?<=\n)(.*?)(?=:)", message.text).group()
-                    username_clean = self.cleanse_username(username)
-                    text = message.text.replace(f"{username}:", "")
-                    # Strip whitespace just from the right side of the string
-                    text = text.rstrip()
-                    text = text.replace("<|endofstatement|>", "")
-
-                if "-vision" not in model_selection:
-                    messages.append(
-                        {
-                            "role": role,
-                            "name": (
-                                username_clean if role == "user" else bot_name_clean
-                            ),
-                            "content": text,
-                        }
-                    )
+        messages = self.format_chat_messages(
+            prompt_history,
+            model_selection,
+            bot_name,
+            user_displayname,
+            system_prompt_override=system_prompt_override,
+            message_cache=message_cache,
+        )
 
-                else:
-                    if len(message.image_urls) > 0:
-                        messages.append(
-                            {
-                                "role": role,
-                                "name": (
-                                    username_clean if role == "user" else bot_name_clean
-                                ),
-                                "content": [
-                                    {"type": "text", "text": text},
-                                ],
-                            }
-                        )
-                        for image_url in message.image_urls:
-                            image_info = {
-                                "type": "image_url",
-                                "image_url": {"url": image_url, "detail": "high"},
-                            }
-                            messages[-1]["content"].append(image_info)
-                    else:
-                        messages.append(
-                            {
-                                "role": role,
-                                "name": (
-                                    username_clean if role == "user" else bot_name_clean
-                                ),
-                                "content": [
-                                    {"type": "text", "text": text},
-                                ],
-                            }
-                        )
-            except Exception:
-                text = message.text.replace("<|endofstatement|>", "")
-                messages.append({"role": "system", "content": text})
-
-        print(f"Messages -> {messages}")
-        async with aiohttp.ClientSession(
+        logger.payload("Messages", messages)
+        async with self.connection_pool.session(
             raise_for_status=False, timeout=aiohttp.ClientTimeout(total=300)
         ) as session:
             payload = {
@@ -1088,9 +1318,13 @@ class Model:
                     headers["OpenAI-Organization"] = self.openai_organization
 
             async with session.post(
-                "https://api.openai.com/v1/chat/completions",
+                f"{self.api_base}/chat/completions",
                 json=payload,
                 headers=headers,
+                estimated_tokens=self.count_history_tokens(
+                    prompt_history, system_prompt_override
+                )
+                + payload.get("max_tokens", 0),
             ) as resp:
                 response = await resp.json()
                 # print(f"Payload -> {payload}")
@@ -1098,7 +1332,7 @@ class Model:
                 await self.valid_text_request(
                     response, model=self.model if model is None else model
                 )
-                print(f"Response -> {response}")
+                logger.payload("Response", response)
 
                 # Temporary until we can ensure json response via the API, for some reason upstream pydantic complains when
                 # we pass response_format in the request..
@@ -1114,6 +1348,109 @@ class Model:
 
                 return response
 
+    @backoff.on_exception(
+        backoff.expo,
+        ValueError,
+        factor=3,
+        base=5,
+        max_tries=4,
+        on_backoff=backoff_handler_request,
+    )
+    async def send_chatgpt_chat_request_stream(
+        self,
+        prompt_history,
+        model,
+        bot_name,
+        user_displayname,
+        temp_override=None,
+        top_p_override=None,
+        frequency_penalty_override=None,
+        presence_penalty_override=None,
+        stop=None,
+        custom_api_key=None,
+        message_cache=None,
+    ) -> ChatCompletionStream:
+        """
+        Same as send_chatgpt_chat_request, but with `stream: true`. Returns once the API has accepted the request,
+        the returned ChatCompletionStream yields the tokens as they are generated.
+        """
+        model_selection = self.model if not model else model
+        print("The model selection is " + model_selection + " (streaming)")
+
+        messages = self.format_chat_messages(
+            prompt_history,
+            model_selection,
+            bot_name,
+            user_displayname,
+            message_cache=message_cache,
+        )
+
+        payload = {
+            "model": model_selection,
+            "messages": messages,
+            "stop": "" if stop is None else stop,
+            "temperature": self.temp if temp_override is None else temp_override,
+            "top_p": self.top_p if top_p_override is None else top_p_override,
+            "presence_penalty": (
+                self.presence_penalty
+                if presence_penalty_override is None
+                else presence_penalty_override
+            ),
+            "frequency_penalty": (
+                self.frequency_penalty
+                if frequency_penalty_override is None
+                else frequency_penalty_override
+            ),
+            "stream": True,
+        }
+        if "-preview" in model_selection:
+            payload["max_tokens"] = 4096
+
+        headers = {
+            "Authorization": f"Bearer {self.openai_key if not custom_api_key else custom_api_key}"
+        }
+        self.use_org = True if "true" in str(self.use_org).lower() else False
+        if self.use_org:
+            if self.openai_organization:
+                headers["OpenAI-Organization"] = self.openai_organization
+
+        prompt_tokens = self.count_history_tokens(prompt_history)
+
+        # The stream outlives a request context, so the scheduling and rate limit are applied here instead of by the
+        # pool, the slot is held until the response has started
+        api_key = headers["Authorization"].removeprefix("Bearer ")
+        rate_limiter = self.connection_pool.rate_limiter
+        slot = await SCHEDULER.acquire()
+        try:
+            await rate_limiter.acquire(
+                api_key, model_selection, prompt_tokens + payload.get("max_tokens", 0)
+            )
+
+            session = await self.connection_pool.get_session()
+            resp = await session.post(
+                f"{self.api_base}/chat/completions",
+                json=payload,
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=300),
+            )
+        finally:
+            SCHEDULER.release(slot)
+        rate_limiter.update_from_headers(api_key, model_selection, resp.headers)
+        if resp.status != 200:
+            # Errors are not streamed, they come back as a regular json body
+            try:
+                response = await resp.json()
+            finally:
+                resp.release()
+            message = (
+                response["error"]["message"]
+                if isinstance(response, dict) and "error" in response
+                else resp.status
+            )
+            raise ValueError(f"The API returned an invalid response: {message}")
+
+        return ChatCompletionStream(self, resp, model_selection, prompt_tokens)
+
     @backoff.on_exception(
         backoff.expo,
         ValueError,
@@ -1128,7 +1465,7 @@ class Model:
         temperature_override=None,
         custom_api_key=None,
     ):
-        async with aiohttp.ClientSession(raise_for_status=True) as session:
+        async with self.connection_pool.session(raise_for_status=True) as session:
             data = aiohttp.FormData()
             data.add_field("model", "whisper-1")
             print("audio." + file.filename.split(".")[-1])
@@ -1152,7 +1489,7 @@ class Model:
                 data.add_field("temperature", temperature_override)
 
             async with session.post(
-                "https://api.openai.com/v1/audio/transcriptions",
+                f"{self.api_base}/audio/transcriptions",
                 headers={
                     "Authorization": f"Bearer {self.openai_key if not custom_api_key else custom_api_key}",
                 },
@@ -1161,6 +1498,7 @@ class Model:
                 response = await resp.json()
                 return response["text"]
 
+    @single_flight
     @backoff.on_exception(
         backoff.expo,
         ValueError,
@@ -1184,6 +1522,8 @@ class Model:
         custom_api_key=None,
         is_chatgpt_request=False,
         system_instruction=None,
+        use_cache=False,
+        refresh_cache=False,
     ):  # The response, and a boolean indicating whether or not the context limit was reached.
         # Validate that  all the parameters are in a good state before we send the request
 
@@ -1206,15 +1546,21 @@ class Model:
             prompt = f"{system_instruction} {prompt}"
 
         if system_instruction:
-            print(f"The instruction added to the prompt will be {system_instruction}")
-        print(f"The prompt about to be sent is {prompt}")
-        print(
-            f"Overrides -> temp:{temp_override}, top_p:{top_p_override} frequency:{frequency_penalty_override}, presence:{presence_penalty_override}, model:{model if model else 'none'}, stop:{stop}"
+            logger.payload("Instruction added to the prompt", system_instruction)
+        logger.payload("Prompt", prompt)
+        logger.debug(
+            "Overrides -> temp:%s, top_p:%s frequency:%s, presence:%s, model:%s, stop:%s",
+            temp_override,
+            top_p_override,
+            frequency_penalty_override,
+            presence_penalty_override,
+            model if model else "none",
+            stop,
         )
 
         # Non-ChatGPT simple completion models.
         if not is_chatgpt_request:
-            async with aiohttp.ClientSession(
+            async with self.connection_pool.session(
                 raise_for_status=False, timeout=aiohttp.ClientTimeout(total=300)
             ) as session:
                 payload = {
@@ -1244,6 +1590,11 @@ class Model:
                         self.best_of if not best_of_override else best_of_override
                     ),
                 }
+                cache_key = self.get_response_cache_key(payload, use_cache)
+                cached_response = self.get_cached_response(cache_key, refresh_cache)
+                if cached_response is not None:
+                    return cached_response
+
                 headers = {
                     "Authorization": f"Bearer {self.openai_key if not custom_api_key else custom_api_key}"
                 }
@@ -1253,9 +1604,10 @@ class Model:
                         headers["OpenAI-Organization"] = self.openai_organization
 
                 async with session.post(
-                    "https://api.openai.com/v1/completions",
+                    f"{self.api_base}/completions",
                     json=payload,
                     headers=headers,
+                    estimated_tokens=tokens + payload["max_tokens"],
                 ) as resp:
                     response = await resp.json()
                     # print(f"Payload -> {payload}")
@@ -1263,11 +1615,13 @@ class Model:
                     await self.valid_text_request(
                         response, model=self.model if model is None else model
                     )
-                    print(f"Response -> {response}")
+                    logger.payload("Response", response)
+                    if cache_key:
+                        self.response_cache.put(cache_key, response)
 
                     return response
         else:  # ChatGPT/GPT4 Simple completion
-            async with aiohttp.ClientSession(
+            async with self.connection_pool.session(
                 raise_for_status=False, timeout=aiohttp.ClientTimeout(total=300)
             ) as session:
                 model_selection = self.model if not model else model
@@ -1294,6 +1648,10 @@ class Model:
                     payload["max_tokens"] = (
                         4096  # Temporary workaround while 4-turbo and vision are in preview.
                     )
+                cache_key = self.get_response_cache_key(payload, use_cache)
+                cached_response = self.get_cached_response(cache_key, refresh_cache)
+                if cached_response is not None:
+                    return cached_response
 
                 headers = {
                     "Authorization": f"Bearer {self.openai_key if not custom_api_key else custom_api_key}"
@@ -1303,9 +1661,10 @@ class Model:
                     if self.openai_organization:
                         headers["OpenAI-Organization"] = self.openai_organization
                 async with session.post(
-                    "https://api.openai.com/v1/chat/completions",
+                    f"{self.api_base}/chat/completions",
                     json=payload,
                     headers=headers,
+                    estimated_tokens=tokens + payload.get("max_tokens", 0),
                 ) as resp:
                     response = await resp.json()
                     # print(f"Payload -> {payload}")
@@ -1313,7 +1672,9 @@ class Model:
                     await self.valid_text_request(
                         response, model=self.model if model is None else model
                     )
-                    print(f"Response -> {response}")
+                    logger.payload("Response", response)
+                    if cache_key:
+                        self.response_cache.put(cache_key, response)
 
                     return response
 
@@ -1329,7 +1690,9 @@ class Model:
             }
             headers = {"Authorization": f"Bearer {api_key}"}
             async with session.post(
-                "https://api.openai.com/v1/completions", json=payload, headers=headers
+                f"{EnvService.get_openai_api_base()}/completions",
+                json=payload,
+                headers=headers,
             ) as resp:
                 response = await resp.json()
                 try:
@@ -1491,14 +1854,14 @@ class Model:
             headers["OpenAI-Organization"] = self.openai_organization
 
         # Setup the client session outside of the loop
-        async with aiohttp.ClientSession(
+        async with self.connection_pool.session(
             raise_for_status=True, timeout=aiohttp.ClientTimeout(total=300)
         ) as session:
             # Create a coroutine for each image request and store it in the tasks list
             for _ in range(self.num_images):
                 task = self.make_image_request_individual(
                     session,
-                    "https://api.openai.com/v1/images/generations",
+                    f"{self.api_base}/images/generations",
                     payload,
                     headers,
                 )
@@ -1509,7 +1872,7 @@ class Model:
 
             # Process the results
             for response in responses:
-                print(response)
+                image_logger.payload("Response", response)
                 for result in response["data"]:
                     image_urls.append(result["url"])
 
@@ -1549,14 +1912,14 @@ class Model:
             headers["OpenAI-Organization"] = self.openai_organization
 
         # Setup the client session outside of the loop
-        async with aiohttp.ClientSession(
+        async with self.connection_pool.session(
             raise_for_status=True, timeout=aiohttp.ClientTimeout(total=300)
         ) as session:
             # Create a coroutine for each image request and store it in the tasks list
             for _ in range(num_images):
                 task = self.make_image_request_individual(
                     session,
-                    "https://api.openai.com/v1/images/generations",
+                    f"{self.api_base}/images/generations",
                     payload,
                     headers,
                 )
@@ -1567,7 +1930,7 @@ class Model:
 
             # Process the results
             for response in responses:
-                print(response)
+                image_logger.payload("Response", response)
                 for result in response["data"]:
                     image_urls.append(result["url"])
 
@@ -1609,18 +1972,18 @@ class Model:
                 if self.openai_organization:
                     headers["OpenAI-Organization"] = self.openai_organization
 
-            async with aiohttp.ClientSession(
+            async with self.connection_pool.session(
                 raise_for_status=True, timeout=aiohttp.ClientTimeout(total=300)
             ) as session:
                 async with session.post(
-                    "https://api.openai.com/v1/images/generations",
+                    f"{self.api_base}/images/generations",
                     json=payload,
                     headers=headers,
                 ) as resp:
                     response = await resp.json()
 
         else:
-            async with aiohttp.ClientSession(
+            async with self.connection_pool.session(
                 raise_for_status=True, timeout=aiohttp.ClientTimeout(total=300)
             ) as session:
                 data = aiohttp.FormData()
@@ -1632,7 +1995,7 @@ class Model:
                     )
 
                     async with session.post(
-                        "https://api.openai.com/v1/images/variations",
+                        f"{self.api_base}/images/variations",
                         headers={
                             "Authorization": f"Bearer {self.openai_key if not custom_api_key else custom_api_key}",
                         },
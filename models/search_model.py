@@ -10,7 +10,6 @@ from pathlib import Path
 import discord
 import aiohttp
 import openai
-import tiktoken
 from langchain.chat_models import ChatOpenAI
 from llama_index import (
     QuestionAnswerPrompt,
@@ -18,7 +17,6 @@ from llama_index import (
     BeautifulSoupWebReader,
     Document,
     LLMPredictor,
-    OpenAIEmbedding,
     SimpleDirectoryReader,
     MockEmbedding,
     ServiceContext,
@@ -33,8 +31,12 @@ from llama_index.prompts.chat_prompts import CHAT_REFINE_PROMPT
 from llama_index.readers.web import DEFAULT_WEBSITE_EXTRACTOR
 from langchain.llms import OpenAI
 
+from models.embedding_model import CachedOpenAIEmbedding
 from models.openai_model import Models
 from services.environment_service import EnvService
+from services.rate_limit_service import RATE_LIMITER
+from services.scheduler_service import SCHEDULER, Priority
+from services.tokenizer_service import TOKENIZERS
 
 MAX_SEARCH_PRICE = EnvService.get_max_search_price()
 
@@ -336,7 +338,7 @@ class Search:
                 self.build_search_webpages_retrieved_embed(query_refined_text),
             )
 
-        embedding_model = OpenAIEmbedding()
+        embedding_model = CachedOpenAIEmbedding()
 
         if "vision" in model:
             llm_predictor = LLMPredictor(
@@ -346,7 +348,7 @@ class Search:
             llm_predictor = LLMPredictor(llm=ChatOpenAI(temperature=0, model=model))
 
         token_counter = TokenCountingHandler(
-            tokenizer=tiktoken.encoding_for_model(model).encode, verbose=False
+            tokenizer=TOKENIZERS.for_model(model).encode, verbose=False
         )
 
         callback_manager = CallbackManager([token_counter])
@@ -359,7 +361,7 @@ class Search:
 
         # Check price
         token_counter_mock = TokenCountingHandler(
-            tokenizer=tiktoken.encoding_for_model(model).encode, verbose=False
+            tokenizer=TOKENIZERS.for_model(model).encode, verbose=False
         )
         callback_manager_mock = CallbackManager([token_counter_mock])
         embed_model_mock = MockEmbedding(embed_dim=1536)
@@ -383,15 +385,17 @@ class Search:
             )
 
         if not deep:
-            index = await self.loop.run_in_executor(
-                None,
-                partial(
-                    GPTVectorStoreIndex.from_documents,
-                    documents,
-                    service_context=service_context,
-                    use_async=True,
-                ),
-            )
+            # Embedding the crawled pages is bulk work, it shouldn't hold up replies to other users
+            async with SCHEDULER.slot(Priority.BULK):
+                index = await self.loop.run_in_executor(
+                    None,
+                    partial(
+                        GPTVectorStoreIndex.from_documents,
+                        documents,
+                        service_context=service_context,
+                        use_async=True,
+                    ),
+                )
             # save the index to disk if not a redo
             if not redo:
                 self.add_search_index(
@@ -413,13 +417,14 @@ class Search:
 
             graph_builder = QASummaryQueryEngineBuilder(service_context=service_context)
 
-            index = await self.loop.run_in_executor(
-                None,
-                partial(
-                    graph_builder.build_from_documents,
-                    documents,
-                ),
-            )
+            async with SCHEDULER.slot(Priority.BULK):
+                index = await self.loop.run_in_executor(
+                    None,
+                    partial(
+                        graph_builder.build_from_documents,
+                        documents,
+                    ),
+                )
 
         if ctx:
             await self.try_edit(
@@ -428,6 +433,13 @@ class Search:
 
         ########################################
 
+        # llama_index makes the requests itself, so queue here until the budget for this key and model allows it
+        await RATE_LIMITER.acquire(
+            os.environ["OPENAI_API_KEY"],
+            model,
+            self.usage_service.count_tokens(query),
+        )
+
         if not deep:
             step_decompose_transform = StepDecomposeQueryTransform(
                 service_context.llm_predictor
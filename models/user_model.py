@@ -3,8 +3,50 @@ Store information about a discord user, for the purposes of enabling conversatio
 history, message count, and the id of the user in order to track them.
 """
 
+import re
+
+from services.environment_service import EnvService
+from services.usage_service import UsageService
+
+END_OF_STATEMENT = "<|endofstatement|>"
+CONTEXT_PREFIX = "this conversation has some context from earlier"
+BOT_NAME = EnvService.get_custom_bot_name()
+
+# How the prompt text of a conversation item is laid out around its author and content
+RAW = 0  # The content is the text, e.g. a pretext
+SPACED = 1  # "\n{author}: {content} <|endofstatement|>\n", a message
+TIGHT = 2  # "\n{author}: {content}<|endofstatement|>\n", a response or edited message
+LAYOUT_PATTERNS = {
+    SPACED: re.compile(r"\n([^\n:]*): (.*) <\|endofstatement\|>\n", re.DOTALL),
+    TIGHT: re.compile(r"\n([^\n:]*): (.*)<\|endofstatement\|>\n", re.DOTALL),
+}
+USERNAME_PATTERN = re.compile(r"(?<=\n)(.*?)(?=:)")
+
+
+def cleanse_username(text):
+    text = text.strip()
+    text = text.replace(":", "")
+    text = text.replace(" ", "")
+    # Replace any character that's not a letter or number with an underscore
+    text = re.sub(r"[^a-zA-Z0-9]", "_", text)
+    return text
+
 
 class RedoUser:
+    __slots__ = (
+        "prompt",
+        "instruction",
+        "message",
+        "ctx",
+        "response",
+        "paginator",
+        "interactions",
+        "dalle_3",
+        "quality",
+        "image_size",
+        "style",
+    )
+
     def __init__(
         self,
         prompt,
@@ -71,9 +113,25 @@ class User:
 
 
 class Instruction:
+    __slots__ = ("id", "prompt", "_tokens")
+
     def __init__(self, id, prompt):
         self.id = id
         self.prompt = prompt
+        self._tokens = None
+
+    def token_count(self):
+        """The tokens of the instruction prompt, counted once"""
+        if self._tokens is None:
+            self._tokens = count_tokens(self.prompt)
+        return self._tokens
+
+    def __getstate__(self):
+        return {"id": self.id, "prompt": self.prompt}
+
+    def __setstate__(self, state):
+        # Also takes the __dict__ of instructions pickled before they had slots
+        self.__init__(state["id"], state["prompt"])
 
     def __eq__(self, other):
         return self.id == other.id
@@ -89,9 +147,23 @@ class Instruction:
 
 
 class Thread:
+    __slots__ = (
+        "thread_id",
+        "_history",
+        "count",
+        "has_opener",
+        "model",
+        "temperature",
+        "top_p",
+        "frequency_penalty",
+        "presence_penalty",
+        "drawable",
+        "chat_messages",
+    )
+
     def __init__(self, thread_id):
         self.thread_id = thread_id
-        self.history = []
+        self.history = ConversationHistory()
         self.count = 0
         self.has_opener = False
         self.model = None
@@ -100,6 +172,7 @@ class Thread:
         self.frequency_penalty = None
         self.presence_penalty = None
         self.drawable = False
+        self.chat_messages = ChatMessageList()
 
     def set_overrides(
         self,
@@ -136,27 +209,364 @@ class Thread:
     def __str__(self):
         return self.__repr__()
 
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, items):
+        # The history is often replaced wholesale (summaries, redos), keep it a counted list
+        self._history = (
+            items
+            if isinstance(items, ConversationHistory)
+            else ConversationHistory(items)
+        )
+
+    @property
+    def token_count(self):
+        """The tokens of the whole history, kept up to date as items are added and removed"""
+        return self._history.tokens
+
+    def get_prompt_tokens(self, prompt, suffix=""):
+        """
+        The tokens of a prompt, from the running total when the prompt is the thread's history followed by
+        suffix, otherwise by counting it.
+        """
+        history = self._history
+        if history.rendered == (
+            history.version,
+            history.length,
+            suffix,
+            hash(prompt),
+        ):
+            return history.tokens + count_tokens(suffix)
+        return count_tokens(prompt)
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        # Also takes the __dict__ of threads pickled before they had slots, where the history was a plain list
+        # stored as "history" and later attributes may be missing
+        self.__init__(state["thread_id"])
+        history = state.get("_history", state.get("history", []))
+        for name, value in state.items():
+            if name in self.__slots__:
+                setattr(self, name, value)
+        self.history = history
+
+    def get_chat_messages(self):
+        return self.chat_messages
+
+
+class ChatMessageList:
+    """
+    The chat messages built for the items of a conversation history. As long as the history only grows, only
+    the messages of the new items at the tail are built, the ones for the items already sent are reused.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.messages = []
+        self.key = None
+
+    def build(self, items, key, format_item):
+        """The messages for the items, format_item(item) builds the message of a single item"""
+        if key != self.key:
+            self.items, self.messages, self.key = [], [], key
+
+        # Keep the messages of the leading items that are still the same, the history may have been rewritten
+        common = 0
+        for cached_item, item in zip(self.items, items):
+            if cached_item is not item:
+                break
+            common += 1
+        del self.items[common:]
+        del self.messages[common:]
+
+        for item in items[common:]:
+            self.items.append(item)
+            self.messages.append(format_item(item))
+        return list(self.messages)
+
+    # The built messages are a cache, there's no need to persist them
+    def __getstate__(self):
+        return {"items": [], "messages": [], "key": None}
+
+
+class ConversationHistory(list):
+    """
+    The items of a conversation, with a running total of their tokens and characters so the size of a
+    conversation is known without re-encoding it every turn. Each item's token count is worked out once.
+    The total is the sum of the items, which can be off by a token or so at the item boundaries compared to
+    encoding the concatenated text.
+
+    version changes with every change to the items, rewrites with every change other than items added at the
+    end, so the conversation journal can tell which items are new without comparing them. rendered identifies
+    the prompt last rendered from the items, so a prompt can be recognized as the history without rendering it.
+    """
+
+    __slots__ = ("tokens", "length", "version", "rewrites", "rendered")
+
+    def __init__(self, items=()):
+        super().__init__(items)
+        self.tokens = sum(item.token_count() for item in self)
+        self.length = sum(len(item.text) for item in self)
+        self.version = 0
+        self.rewrites = 0
+        # (version, length, suffix, hash of the prompt), only the hash is kept, not the prompt
+        self.rendered = None
+
+    def _added(self, items):
+        self.version += 1
+        for item in items:
+            self.tokens += item.token_count()
+            self.length += len(item.text)
+
+    def _removed(self, items):
+        self.version += 1
+        self.rewrites += 1
+        for item in items:
+            self.tokens -= item.token_count()
+            self.length -= len(item.text)
+
+    def append(self, item):
+        super().append(item)
+        self._added((item,))
+
+    def extend(self, items):
+        items = list(items)
+        super().extend(items)
+        self._added(items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self.rewrites += 1
+        self._added((item,))
+
+    def pop(self, index=-1):
+        item = super().pop(index)
+        self._removed((item,))
+        return item
+
+    def remove(self, item):
+        self.pop(self.index(item))
+
+    def clear(self):
+        super().clear()
+        self.tokens = 0
+        self.length = 0
+        self.version += 1
+        self.rewrites += 1
+
+    def __setitem__(self, index, value):
+        old = self[index] if isinstance(index, slice) else (self[index],)
+        value = list(value) if isinstance(index, slice) else value
+        super().__setitem__(index, value)
+        self._removed(old)
+        self._added(value if isinstance(index, slice) else (value,))
+
+    def __delitem__(self, index):
+        old = self[index] if isinstance(index, slice) else (self[index],)
+        super().__delitem__(index)
+        self._removed(old)
+
+    def __reduce__(self):
+        # Pickled as its items, the totals are recomputed from the items' cached counts
+        return ConversationHistory, (list(self),)
+
+
+def count_tokens(text):
+    return UsageService.count_tokens_static(text) if text else 0
+
+
+def render_prompt(items, suffix=""):
+    """The legacy prompt string of a list of conversation items, the texts of the items one after the other"""
+    prompt = "".join([item.text for item in items]) + suffix
+    if isinstance(items, ConversationHistory):
+        items.rendered = (items.version, items.length, suffix, hash(prompt))
+    return prompt
+
 
 class EmbeddedConversationItem:
-    def __init__(self, text, timestamp, image_urls=None):
-        self.text = text
+    """
+    One item of a conversation: who said what, when. The prompt text the rest of the bot works with
+    ("\n{author}: {content} <|endofstatement|>\n") is rendered from the fields on demand, items are built from
+    such a text and split back up into their fields, in a way that always renders back to the exact same text.
+    The text is rendered once and kept until one of the fields it is rendered from is set.
+    """
+
+    __slots__ = (
+        "role",
+        "author_id",
+        "author_name",
+        "content",
+        "timestamp",
+        "image_urls",
+        "layout",
+        "_text",
+        "_tokens",
+        "_parsed",
+    )
+
+    # The fields the text is rendered from, setting one drops what was worked out from the previous text
+    RENDERED_FIELDS = frozenset(("layout", "author_name", "content"))
+
+    def __init__(
+        self, text, timestamp, image_urls=None, author_id=None, bot_name=BOT_NAME
+    ):
+        self.layout, self.author_name, self.content = RAW, None, text
+        for layout, pattern in LAYOUT_PATTERNS.items():
+            match = pattern.fullmatch(text)
+            if match:
+                self.layout = layout
+                self.author_name, self.content = match.groups()
+                break
+        self._text = text
+
+        # The role parse() gives the item for the bot name it was made with
+        self.role = self._role(bot_name)
+        self.author_id = author_id
         self.timestamp = int(timestamp)
         self.image_urls = image_urls
 
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in EmbeddedConversationItem.RENDERED_FIELDS:
+            object.__setattr__(self, "_text", None)
+            object.__setattr__(self, "_tokens", None)
+            object.__setattr__(self, "_parsed", None)
+
+    @classmethod
+    def from_message(
+        cls, author_name, content, timestamp, author_id=None, image_urls=None
+    ):
+        """The item of a message a user sent in a conversation"""
+        return cls(
+            f"\n{author_name}: {content} {END_OF_STATEMENT}\n",
+            timestamp,
+            image_urls=image_urls,
+            author_id=author_id,
+        )
+
+    @classmethod
+    def from_response(cls, bot_name, content, timestamp):
+        """The item of a response of the bot, bot_name is the "<name>: " prefix of its messages"""
+        return cls(
+            f"\n{bot_name}{content}{END_OF_STATEMENT}\n",
+            timestamp,
+            bot_name=bot_name,
+        )
+
+    @property
+    def text(self):
+        text = self._text
+        if text is None:
+            if self.layout == SPACED:
+                text = f"\n{self.author_name}: {self.content} {END_OF_STATEMENT}\n"
+            elif self.layout == TIGHT:
+                text = f"\n{self.author_name}: {self.content}{END_OF_STATEMENT}\n"
+            else:
+                text = self.content
+            self._text = text
+        return text
+
     def has_image(self):
         return self.image_urls is not None
 
+    def token_count(self):
+        """The tokens of the item's text, counted once per text"""
+        if self._tokens is None:
+            self._tokens = count_tokens(self.text)
+        return self._tokens
+
+    def parse(self, bot_name):
+        """
+        The role, name and content of this item as a chat message. Worked out once per text and bot name.
+        """
+        parsed = self._parsed
+        if parsed is None or parsed[0] != bot_name:
+            parsed = (bot_name, *self._parse(bot_name))
+            self._parsed = parsed
+        return parsed[1:]
+
+    def __getstate__(self):
+        return (
+            self.role,
+            self.author_id,
+            self.author_name,
+            self.content,
+            self.timestamp,
+            self.image_urls,
+            self.layout,
+            self._tokens,
+        )
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Items pickled before they had slots only had their text, timestamp and image urls
+            self.__init__(state["text"], state["timestamp"], state.get("image_urls"))
+            return
+        (
+            self.role,
+            self.author_id,
+            self.author_name,
+            self.content,
+            self.timestamp,
+            self.image_urls,
+            self.layout,
+            tokens,
+        ) = state
+        # Set after the fields the text is rendered from, which drop it
+        self._tokens = tokens
+
+    def _role(self, bot_name):
+        if self.text.strip().lower().startswith(CONTEXT_PREFIX):
+            return "system"
+        if self.text.startswith(f"\n{bot_name}"):
+            return "assistant"
+        if USERNAME_PATTERN.search(self.text) is None:
+            return "system"
+        return "user"
+
+    def _parse(self, bot_name):
+        role = self._role(bot_name)
+        if role == "system":
+            return "system", None, self.text.replace(END_OF_STATEMENT, "")
+
+        if role == "assistant":
+            text = self.text.replace(bot_name, "")
+            text = text.replace(END_OF_STATEMENT, "")
+            return "assistant", cleanse_username(bot_name), text
+
+        username = USERNAME_PATTERN.search(self.text).group()
+        text = self.text.replace(f"{username}:", "")
+        # Strip whitespace just from the right side of the string
+        text = text.rstrip()
+        text = text.replace(END_OF_STATEMENT, "")
+        return "user", cleanse_username(username), text
+
     def __repr__(self):
         return self.text
 
     def __str__(self):
         return self.__repr__()
 
+    # Items built from the same text always have the same fields, so comparing the fields compares the texts
     def __eq__(self, other):
-        return self.text == other.text and self.timestamp == other.timestamp
+        return (
+            self.content == other.content
+            and self.author_name == other.author_name
+            and self.layout == other.layout
+            and self.timestamp == other.timestamp
+        )
 
     def __hash__(self):
-        return hash(self.text) + hash(self.timestamp)
+        return hash(self.content) + hash(self.timestamp)
 
     def __lt__(self, other):
         return self.timestamp < other.timestamp
@@ -0,0 +1,323 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from services.environment_service import EnvService
+from services.pickle_service import Pickler
+
+
+class ConversationArchive:
+    """
+    The full text of every conversation (each prompt and response as it was sent), which is only needed to export
+    a conversation, e.g. to ShareGPT. Everything is kept in SQLite, one row per text. In memory there are only
+    the texts not written yet and the conversations that were recently used, within a byte budget per
+    conversation and in total: a conversation is dropped from memory when it ends, goes idle, grows past the
+    per-conversation budget, or is the least recently used one when the total budget is exceeded. The async
+    handlers read the DB in a worker thread, by ensure_length() before they append to a conversation and
+    ensure_loaded() before they get its texts.
+    """
+
+    def __init__(
+        self, path=None, thread_bytes=None, total_bytes=None, idle_seconds=None
+    ):
+        self.path = (
+            EnvService.save_path() / "pickles" / "conversations.sqlite"
+            if path is None
+            else path
+        )
+        self.thread_bytes = (
+            EnvService.get_full_history_thread_bytes()
+            if thread_bytes is None
+            else thread_bytes
+        )
+        self.total_bytes = (
+            EnvService.get_full_history_memory_bytes()
+            if total_bytes is None
+            else total_bytes
+        )
+        self.idle_seconds = (
+            EnvService.get_conversation_idle_seconds()
+            if idle_seconds is None
+            else idle_seconds
+        )
+        # Reads and writes happen in worker threads
+        self.lock = threading.Lock()
+
+        try:
+            self.db = self.connect(str(self.path))
+        except Exception:
+            print(
+                "Failed to open the conversation archive DB, conversation texts will only be kept in memory"
+            )
+            traceback.print_exc()
+            self.db = self.connect(":memory:")
+
+        # All the texts of the conversations in memory, least recently used first
+        self.resident = OrderedDict()
+        self.sizes = {}
+        self.resident_bytes = 0
+        self.last_used = {}
+        # The number of texts of each conversation seen so far, and the texts not written yet
+        self.lengths = {}
+        self.pending = {}
+        self.writing = {}
+        # The conversations to delete from the DB by the next flush
+        self.discarded = set()
+        # The conversations read in a worker thread right now, and whether they were changed meanwhile
+        self.reading = {}
+
+        # Statistics
+        self.loads = 0
+        self.spills = 0
+
+    @staticmethod
+    def connect(path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS full_history (channel_id INTEGER NOT NULL, position INTEGER NOT NULL, "
+            "text TEXT NOT NULL, PRIMARY KEY (channel_id, position))"
+        )
+        db.commit()
+        return db
+
+    @staticmethod
+    def size(text):
+        return len(text.encode("utf-8"))
+
+    def unwritten(self, channel_id):
+        """The (position, text) of the texts of a conversation that aren't in the DB yet"""
+        return self.writing.get(channel_id, []) + self.pending.get(channel_id, [])
+
+    def read_last(self, channel_id):
+        """The last position of a conversation in the DB, None if it has no texts there"""
+        with self.lock:
+            (last,) = self.db.execute(
+                "SELECT MAX(position) FROM full_history WHERE channel_id = ?",
+                (channel_id,),
+            ).fetchone()
+        return last
+
+    def counted(self, channel_id, last, unwritten):
+        positions = [position for position, _ in unwritten]
+        length = self.lengths[channel_id] = (
+            max(positions + [-1 if last is None else last]) + 1
+        )
+        return length
+
+    def length(self, channel_id):
+        """The number of texts of a conversation"""
+        length = self.lengths.get(channel_id)
+        if length is None:
+            # Only when ensure_length() wasn't awaited first
+            length = self.counted(
+                channel_id, self.read_last(channel_id), self.unwritten(channel_id)
+            )
+        return length
+
+    async def read_in_thread(self, channel_id, read):
+        """
+        Read a conversation from the DB in a worker thread, returns what was read and the texts that weren't written
+        before, or None if the conversation was changed meanwhile (texts added then could be missed) or is read
+        already
+        """
+        if channel_id in self.reading:
+            return None
+        self.reading[channel_id] = False
+        # Texts written while the DB is read may be in neither what is read nor the texts unwritten after
+        unwritten = self.unwritten(channel_id)
+        try:
+            result = await asyncio.to_thread(read, channel_id)
+        finally:
+            changed = self.reading.pop(channel_id)
+        return None if changed else (result, unwritten)
+
+    async def ensure_length(self, channel_id):
+        """Count the texts of a conversation in a worker thread, so that appending to it doesn't block the event loop"""
+        if channel_id in self.lengths:
+            return
+        read = await self.read_in_thread(channel_id, self.read_last)
+        if read is not None and channel_id not in self.lengths:
+            last, unwritten = read
+            self.counted(channel_id, last, unwritten + self.unwritten(channel_id))
+
+    def __contains__(self, channel_id):
+        return self.length(channel_id) > 0
+
+    def append(self, channel_id, text):
+        position = self.length(channel_id)
+        if channel_id in self.reading:
+            self.reading[channel_id] = True
+        self.pending.setdefault(channel_id, []).append((position, text))
+        self.lengths[channel_id] = position + 1
+
+        # A new conversation starts out in memory, any other is only added to if it is already there
+        if position == 0 and channel_id not in self.resident:
+            self.resident[channel_id] = []
+            self.sizes[channel_id] = 0
+        if channel_id in self.resident:
+            self.resident[channel_id].append(text)
+            self.sizes[channel_id] += self.size(text)
+            self.resident_bytes += self.size(text)
+            self.touch(channel_id)
+            self.enforce_limits()
+
+    def read(self, channel_id):
+        """The texts of a conversation in the DB, by position"""
+        with self.lock:
+            return dict(
+                self.db.execute(
+                    "SELECT position, text FROM full_history WHERE channel_id = ?",
+                    (channel_id,),
+                )
+            )
+
+    def loaded(self, channel_id, texts):
+        """Keep the texts of a conversation that were read in memory, along with those not written yet"""
+        # Texts being written right now may or may not be in what was read
+        texts.update(self.unwritten(channel_id))
+        texts = [texts[position] for position in sorted(texts)]
+        self.loads += 1
+        self.resident[channel_id] = texts
+        self.sizes[channel_id] = sum(self.size(text) for text in texts)
+        self.resident_bytes += self.sizes[channel_id]
+        return texts
+
+    async def ensure_loaded(self, channel_id):
+        """Load the texts of a conversation that isn't in memory in a worker thread, so that get() doesn't block the event loop"""
+        if channel_id in self.resident:
+            return
+        read = await self.read_in_thread(channel_id, self.read)
+        if read is not None and channel_id not in self.resident:
+            texts, unwritten = read
+            texts.update(unwritten)
+            self.loaded(channel_id, texts)
+            self.touch(channel_id)
+            self.enforce_limits()
+
+    def get(self, channel_id):
+        """All the texts of a conversation"""
+        texts = self.resident.get(channel_id)
+        if texts is None:
+            # Only when ensure_loaded() wasn't awaited first
+            texts = self.loaded(channel_id, self.read(channel_id))
+        self.touch(channel_id)
+        texts = list(texts)
+        self.enforce_limits()
+        return texts
+
+    def __getitem__(self, channel_id):
+        return self.get(channel_id)
+
+    def touch(self, channel_id):
+        self.resident.move_to_end(channel_id)
+        self.last_used[channel_id] = time.monotonic()
+
+    def spill(self, channel_id):
+        """Drop a conversation from memory, its texts are (or will be) in the DB"""
+        if self.resident.pop(channel_id, None) is not None:
+            self.resident_bytes -= self.sizes.pop(channel_id)
+            self.last_used.pop(channel_id, None)
+            self.spills += 1
+
+    def enforce_limits(self):
+        for channel_id, size in list(self.sizes.items()):
+            if size > self.thread_bytes:
+                self.spill(channel_id)
+        while self.resident_bytes > self.total_bytes and self.resident:
+            self.spill(next(iter(self.resident)))
+
+    def discard(self, channel_id):
+        """Delete all the texts of a conversation"""
+        self.spill(channel_id)
+        self.pending.pop(channel_id, None)
+        if channel_id in self.reading:
+            self.reading[channel_id] = True
+        # Anything added from now on starts a conversation anew, written after the old one is deleted
+        self.lengths[channel_id] = 0
+        self.discarded.add(channel_id)
+
+    def stored_bytes(self, channel_id):
+        """The size of the texts of a conversation in the DB"""
+        with self.lock:
+            (size,) = self.db.execute(
+                "SELECT COALESCE(SUM(LENGTH(CAST(text AS BLOB))), 0) FROM full_history WHERE channel_id = ?",
+                (channel_id,),
+            ).fetchone()
+        return size
+
+    def write(self, rows, discarded=()):
+        with self.lock, self.db:
+            self.db.executemany(
+                "DELETE FROM full_history WHERE channel_id = ?",
+                [(channel_id,) for channel_id in discarded],
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO full_history VALUES (?, ?, ?)", rows
+            )
+
+    async def flush(self):
+        """Write the texts added since the last flush, then drop the conversations that have gone idle"""
+        self.writing, self.pending = self.pending, {}
+        discarded, self.discarded = self.discarded, set()
+        rows = [
+            (channel_id, position, text)
+            for channel_id, texts in self.writing.items()
+            for position, text in texts
+        ]
+        if rows or discarded:
+            try:
+                await asyncio.to_thread(self.write, rows, discarded)
+            except Exception:
+                traceback.print_exc()
+                # Keep them for the next flush, ahead of anything added since
+                for channel_id, texts in self.writing.items():
+                    self.pending[channel_id] = texts + self.pending.get(channel_id, [])
+                self.discarded |= discarded
+                return
+            finally:
+                self.writing = {}
+
+        cutoff = time.monotonic() - self.idle_seconds
+        for channel_id, last_used in list(self.last_used.items()):
+            if last_used < cutoff:
+                self.spill(channel_id)
+        # Only the conversations in memory or with texts pending need their length at hand
+        for channel_id in list(self.lengths):
+            if (
+                channel_id not in self.resident
+                and channel_id not in self.pending
+                and channel_id not in self.discarded
+            ):
+                del self.lengths[channel_id]
+
+    async def import_pickle(self, path):
+        """Move the texts of a full_conversation_history pickle into the archive, once, returns how many there were"""
+        if not os.path.exists(path):
+            return 0
+
+        # Written by the Pickler, which may have compressed it
+        full_conversation_history = await asyncio.to_thread(Pickler.read, path)
+        rows = [
+            (channel_id, position, text)
+            for channel_id, texts in full_conversation_history.items()
+            for position, text in enumerate(texts)
+        ]
+        await asyncio.to_thread(self.write, rows)
+        self.lengths.clear()
+        os.replace(path, f"{path}.imported")
+        return len(rows)
+
+    def get_stats(self):
+        return {
+            "resident_bytes": self.resident_bytes,
+            "resident_conversations": len(self.resident),
+            "pending_texts": sum(len(texts) for texts in self.pending.values()),
+            "loads": self.loads,
+            "spills": self.spills,
+        }
@@ -0,0 +1,231 @@
+import asyncio
+import traceback
+
+import aiohttp
+
+from services.environment_service import EnvService
+from services.rate_limit_service import RATE_LIMITER
+from services.scheduler_service import SCHEDULER
+
+
+class RateLimitedRequest:
+    """
+    Wraps a JSON API request so it waits for a scheduler slot and its rate limit budget before being sent,
+    and feeds the x-ratelimit-* headers of the response back into the limiter.
+    """
+
+    def __init__(self, rate_limiter, method, url, kwargs):
+        self.rate_limiter = rate_limiter
+        self.method = method
+        self.url = url
+        self.estimated_tokens = kwargs.pop("estimated_tokens", None)
+        self.kwargs = kwargs
+        self._request = None
+        self._slot = None
+        self.api_key, self.model = self._get_limit_key()
+
+    def _get_limit_key(self):
+        payload = self.kwargs.get("json")
+        authorization = (self.kwargs.get("headers") or {}).get("Authorization", "")
+        if (
+            self.rate_limiter is None
+            or not isinstance(payload, dict)
+            or "model" not in payload
+        ):
+            return None, None
+        return authorization.removeprefix("Bearer "), payload["model"]
+
+    async def __aenter__(self):
+        # More important work gets to the rate limit budget first
+        self._slot = await SCHEDULER.acquire()
+        try:
+            if self.model is not None and self.rate_limiter.is_limited(
+                self.api_key, self.model
+            ):
+                tokens = self.estimated_tokens
+                if tokens is None:
+                    tokens = self.rate_limiter.estimate_tokens(self.kwargs["json"])
+                await self.rate_limiter.acquire(self.api_key, self.model, tokens)
+
+            self._request = self.method(self.url, **self.kwargs)
+            response = await self._request.__aenter__()
+        except BaseException:
+            SCHEDULER.release(self._slot)
+            raise
+        if self.model is not None:
+            self.rate_limiter.update_from_headers(
+                self.api_key, self.model, response.headers
+            )
+        return response
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            return await self._request.__aexit__(exc_type, exc, tb)
+        finally:
+            SCHEDULER.release(self._slot)
+
+
+class PooledSession:
+    """A thin view over the shared aiohttp session that applies per-call defaults.
+
+    The shared session is never closed by callers, so this can be used as a drop-in
+    replacement for `async with aiohttp.ClientSession(...) as session:` blocks.
+    """
+
+    def __init__(self, pool, raise_for_status=False, timeout=None):
+        self._pool = pool
+        self._session = None
+        self.raise_for_status = raise_for_status
+        self.timeout = timeout
+
+    def _apply_defaults(self, kwargs):
+        kwargs.setdefault("raise_for_status", self.raise_for_status)
+        if self.timeout is not None:
+            kwargs.setdefault("timeout", self.timeout)
+        return kwargs
+
+    def post(self, url, **kwargs):
+        if self._pool.rate_limiter is None:
+            # Not an API that shares the OpenAI rate limits and scheduler
+            return self._session.post(url, **self._apply_defaults(kwargs))
+        return RateLimitedRequest(
+            self._pool.rate_limiter,
+            self._session.post,
+            url,
+            self._apply_defaults(kwargs),
+        )
+
+    def get(self, url, **kwargs):
+        return self._session.get(url, **self._apply_defaults(kwargs))
+
+    async def __aenter__(self):
+        self._session = await self._pool.get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        # The underlying session is long-lived, nothing to clean up per request.
+        return False
+
+
+class ConnectionPool:
+    """
+    A long-lived, keep-alive HTTP connection pool shared by every outbound API call of a model. The requests of a
+    pool without a rate limiter are sent right away, without waiting for a scheduler slot.
+    """
+
+    def __init__(
+        self,
+        limit=None,
+        limit_per_host=None,
+        dns_cache_ttl=None,
+        keepalive_timeout=None,
+        rate_limiter=RATE_LIMITER,
+    ):
+        self.limit = EnvService.get_http_pool_limit() if limit is None else limit
+        self.limit_per_host = (
+            EnvService.get_http_pool_limit_per_host()
+            if limit_per_host is None
+            else limit_per_host
+        )
+        self.dns_cache_ttl = (
+            EnvService.get_http_dns_cache_ttl()
+            if dns_cache_ttl is None
+            else dns_cache_ttl
+        )
+        self.keepalive_timeout = (
+            EnvService.get_http_keepalive_timeout()
+            if keepalive_timeout is None
+            else keepalive_timeout
+        )
+
+        self.rate_limiter = rate_limiter
+
+        self._session = None
+        self._connector = None
+        self._lock = None
+
+        # Statistics
+        self.requests_sent = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+
+    async def _on_connection_create_end(self, session, context, params):
+        self.connections_created += 1
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.connections_reused += 1
+
+    async def _on_request_start(self, session, context, params):
+        self.requests_sent += 1
+
+    def _create_session(self):
+        self._connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True,
+            keepalive_timeout=self.keepalive_timeout,
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_request_start.append(self._on_request_start)
+
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            raise_for_status=False,
+            timeout=aiohttp.ClientTimeout(total=300),
+            trace_configs=[trace_config],
+        )
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Get the shared session, creating it on first use inside the running loop"""
+        if self._session is not None and not self._session.closed:
+            return self._session
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                self._create_session()
+        return self._session
+
+    def session(self, raise_for_status=False, timeout=None) -> PooledSession:
+        """Get a view over the shared session with the given per-request defaults"""
+        return PooledSession(self, raise_for_status=raise_for_status, timeout=timeout)
+
+    def get_stats(self):
+        """Return a snapshot of the pool usage, open/idle connections and the reuse ratio"""
+        idle = 0
+        acquired = 0
+        if self._connector is not None and not self._connector.closed:
+            try:
+                idle = sum(len(conns) for conns in self._connector._conns.values())
+                acquired = len(self._connector._acquired)
+            except Exception:
+                traceback.print_exc()
+
+        total_connections = self.connections_created + self.connections_reused
+        return {
+            "requests_sent": self.requests_sent,
+            "open_connections": idle + acquired,
+            "idle_connections": idle,
+            "active_connections": acquired,
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": (
+                round(self.connections_reused / total_connections, 3)
+                if total_connections
+                else 0.0
+            ),
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+        }
+
+    async def close(self):
+        """Close the shared session and all of its pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._connector = None
@@ -0,0 +1,163 @@
+from models.openai_model import Models
+from models.user_model import (
+    CONTEXT_PREFIX,
+    END_OF_STATEMENT,
+    ConversationHistory,
+    EmbeddedConversationItem,
+)
+from services.environment_service import EnvService
+from services.tokenizer_service import TOKENIZERS
+
+# What a compressed item ends with in place of the rest of its text
+COMPRESSION_MARKER = f" [...] {END_OF_STATEMENT}\n"
+
+
+class ContextSelection:
+    """
+    The conversation items chosen to fit a token budget, and what had to go to get there. The dropped and
+    compressed items are the original ones, as they were in the history.
+    """
+
+    def __init__(self, items, tokens, budget, dropped, compressed):
+        self.items = items
+        self.tokens = tokens
+        self.budget = budget
+        self.dropped = dropped
+        self.compressed = compressed
+
+    @property
+    def fits(self):
+        return self.tokens <= self.budget
+
+    @property
+    def changed(self):
+        return bool(self.dropped or self.compressed)
+
+    def describe(self):
+        return (
+            f"{len(self.items)} items, {self.tokens}/{self.budget} tokens, "
+            f"dropped {len(self.dropped)} items "
+            f"({sum(item.token_count() for item in self.dropped)} tokens), "
+            f"compressed {len(self.compressed)} items"
+        )
+
+
+class ContextBuilder:
+    """
+    Fits a conversation into a token budget without another request to the model. The pretext, the opener (or
+    the summary of an earlier part of the conversation) and the most recent turns are always kept. Of the turns
+    in between, the oldest are dropped until shortening the long ones left would make the conversation fit, and
+    then those are shortened, oldest first, until it does. Only the turns that are kept are ever shortened, and
+    everything is sized with the token counts cached on the items, so this is cheap enough to do every turn.
+    """
+
+    def __init__(self, recent_items=None, compressed_tokens=None):
+        self.recent_items = (
+            EnvService.get_context_recent_items()
+            if recent_items is None
+            else recent_items
+        )
+        # Older turns longer than this are cut down to this many tokens before any turn is dropped
+        self.compressed_tokens = (
+            EnvService.get_context_compressed_tokens()
+            if compressed_tokens is None
+            else compressed_tokens
+        )
+
+    @staticmethod
+    def get_budget(model, reserved_tokens=None, limit=None):
+        """The tokens the prompt may use, the model's context window less what is reserved for the completion"""
+        if reserved_tokens is None:
+            reserved_tokens = EnvService.get_context_reserved_tokens()
+            # The preview models are always asked for up to 4096 completion tokens
+            if "-preview" in model:
+                reserved_tokens = max(reserved_tokens, 4096)
+        budget = Models.get_max_tokens(model) - reserved_tokens
+        return budget if limit is None else min(budget, limit)
+
+    @staticmethod
+    def pinned_count(thread):
+        history = thread.history
+        if len(history) > 1 and (
+            thread.has_opener
+            or history[1].text.strip().lower().startswith(CONTEXT_PREFIX)
+        ):
+            return 2
+        return min(1, len(history))
+
+    def compress(self, item):
+        """A copy of the item, cut down to the compressed length"""
+        encoding = TOKENIZERS.for_model()
+        text = item.text.replace(END_OF_STATEMENT, "").rstrip()
+        text = encoding.decode(encoding.encode(text)[: self.compressed_tokens])
+        return EmbeddedConversationItem(
+            f"{text}{COMPRESSION_MARKER}",
+            item.timestamp,
+            image_urls=item.image_urls,
+            author_id=item.author_id,
+        )
+
+    def build(self, thread, budget, extra_tokens=0):
+        """
+        Choose the items of the thread's history to send, within budget tokens. extra_tokens are the tokens the
+        prompt uses besides the history, e.g. a system instruction.
+        """
+        history = list(thread.history)
+        pinned = self.pinned_count(thread)
+        recent_start = max(pinned, len(history) - self.recent_items)
+        middle = history[pinned:recent_start]
+
+        # What shortening each turn would save, roughly: the compressed text may re-encode slightly differently
+        compressed_length = self.compressed_tokens + TOKENIZERS.count(
+            COMPRESSION_MARKER
+        )
+        savings = [
+            (
+                max(0, item.token_count() - compressed_length)
+                if item.token_count() > self.compressed_tokens
+                else 0
+            )
+            for item in middle
+        ]
+
+        tokens = thread.token_count + extra_tokens
+        potential_savings = sum(savings)
+        start = 0
+        while start < len(middle) and tokens - potential_savings > budget:
+            tokens -= middle[start].token_count()
+            potential_savings -= savings[start]
+            start += 1
+        dropped = middle[:start]
+        originals = middle[start:]
+        middle = list(originals)
+
+        compressed = []
+        for index, item in enumerate(originals):
+            if tokens <= budget:
+                break
+            if item.token_count() > self.compressed_tokens:
+                shorter = self.compress(item)
+                tokens -= item.token_count() - shorter.token_count()
+                middle[index] = shorter
+                compressed.append(item)
+
+        # In case the savings were overestimated
+        while middle and tokens > budget:
+            tokens -= middle.pop(0).token_count()
+            original = originals.pop(0)
+            if compressed and compressed[0] is original:
+                compressed.pop(0)
+            dropped.append(original)
+
+        items = history[:pinned] + middle + history[recent_start:]
+        return ContextSelection(items, tokens, budget, dropped, compressed)
+
+    def trim(self, thread, budget, extra_tokens=0):
+        """Trim the thread's history to fit the budget if possible, returns the selection that was made"""
+        selection = self.build(thread, budget, extra_tokens)
+        if selection.fits and selection.changed:
+            thread.history = ConversationHistory(selection.items)
+        return selection
+
+
+CONTEXT_BUILDER = ContextBuilder()
@@ -0,0 +1,331 @@
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import traceback
+from collections.abc import MutableMapping
+
+from models.user_model import ConversationHistory, Thread
+from services.environment_service import EnvService
+from services.pickle_service import Pickler
+
+# Everything about a thread besides its history is stored in the thread's row, the history one row per item
+THREAD_FIELDS = tuple(
+    name for name in Thread.__slots__ if name not in ("_history", "chat_messages")
+)
+
+
+class ConversationStore(MutableMapping):
+    """
+    The conversation threads of the text cog, by thread id, kept in SQLite (in WAL mode) with one row per
+    conversation item. It is used like the dict of threads it replaces.
+
+    Only the ids of the threads are read on startup, a thread's history is loaded the first time the thread is
+    used (in a worker thread by ensure_loaded(), which the async handlers call before they use a thread) and
+    dropped from memory again once the thread hasn't been used for a while. The changes to the threads
+    in memory are written by flush(): the items added to a history are inserted, a history that was rewritten
+    (summarized, trimmed, redone) is replaced, a thread that was ended is deleted. Finding the changes needs no
+    serialization, the histories count their changes. When each thread was last used is kept too, for the
+    conversation sweeper to tell the abandoned ones.
+    """
+
+    def __init__(self, path=None, idle_seconds=None):
+        self.path = (
+            EnvService.save_path() / "pickles" / "conversations.sqlite"
+            if path is None
+            else path
+        )
+        self.idle_seconds = (
+            EnvService.get_conversation_idle_seconds()
+            if idle_seconds is None
+            else idle_seconds
+        )
+        # Reads and writes happen in worker threads
+        self.lock = threading.Lock()
+
+        try:
+            self.db = self.connect(str(self.path))
+        except Exception:
+            print(
+                "Failed to open the conversation store DB, conversations will only be kept in memory"
+            )
+            traceback.print_exc()
+            self.db = self.connect(":memory:")
+
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT threads.thread_id, activity.last_active FROM threads "
+                "LEFT JOIN activity ON activity.thread_id = threads.thread_id"
+            ).fetchall()
+        self.ids = {thread_id for thread_id, _ in rows}
+        # When each thread was last used (wall clock, it outlives restarts), threads from before this was kept
+        # count as used now
+        now = time.time()
+        self.last_active = {
+            thread_id: now if last_active is None else last_active
+            for thread_id, last_active in rows
+        }
+        self.active = set()
+        self.resident = {}
+        self.last_used = {}
+        # The state of each thread in memory as it was last written, to tell what changed since
+        self.saved = {}
+        self.ended = set()
+
+        # Statistics
+        self.loads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def connect(path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS threads (thread_id INTEGER PRIMARY KEY, fields BLOB NOT NULL)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS items (thread_id INTEGER NOT NULL, position INTEGER NOT NULL, "
+            "item BLOB NOT NULL, PRIMARY KEY (thread_id, position))"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS activity (thread_id INTEGER PRIMARY KEY, last_active REAL NOT NULL)"
+        )
+        db.commit()
+        return db
+
+    def __contains__(self, thread_id):
+        return thread_id in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(list(self.ids))
+
+    def __getitem__(self, thread_id):
+        thread = self.resident.get(thread_id)
+        if thread is None:
+            if thread_id not in self.ids:
+                raise KeyError(thread_id)
+            # Only when ensure_loaded() wasn't awaited first
+            thread = self.loaded(thread_id, self.read(thread_id))
+            if thread is None:
+                raise KeyError(thread_id)
+        self.last_used[thread_id] = time.monotonic()
+        self.mark_active(thread_id)
+        return thread
+
+    def __setitem__(self, thread_id, thread):
+        self.ids.add(thread_id)
+        self.ended.discard(thread_id)
+        self.resident[thread_id] = thread
+        self.last_used[thread_id] = time.monotonic()
+        self.mark_active(thread_id)
+
+    def __delitem__(self, thread_id):
+        if thread_id not in self.ids:
+            raise KeyError(thread_id)
+        self.ids.discard(thread_id)
+        self.resident.pop(thread_id, None)
+        self.last_used.pop(thread_id, None)
+        self.saved.pop(thread_id, None)
+        self.last_active.pop(thread_id, None)
+        self.active.discard(thread_id)
+        self.ended.add(thread_id)
+
+    def mark_active(self, thread_id):
+        self.last_active[thread_id] = time.time()
+        self.active.add(thread_id)
+
+    @staticmethod
+    def saved_state(thread):
+        history = thread.history
+        fields = tuple(getattr(thread, name) for name in THREAD_FIELDS)
+        return thread, history, history.rewrites, history.version, len(history), fields
+
+    def read(self, thread_id):
+        """A thread as it is in the DB, None if it isn't there"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT fields FROM threads WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            items = [
+                pickle.loads(item)
+                for (item,) in self.db.execute(
+                    "SELECT item FROM items WHERE thread_id = ? ORDER BY position",
+                    (thread_id,),
+                )
+            ]
+        if row is None:
+            return None
+
+        state = pickle.loads(row[0])
+        state["_history"] = ConversationHistory(items)
+        thread = Thread.__new__(Thread)
+        thread.__setstate__(state)
+        return thread
+
+    def loaded(self, thread_id, thread):
+        """Keep a thread that was read in memory, a thread that wasn't in the DB is forgotten"""
+        if thread is None:
+            self.ids.discard(thread_id)
+            return None
+        self.resident[thread_id] = thread
+        self.saved[thread_id] = self.saved_state(thread)
+        self.loads += 1
+        return thread
+
+    async def ensure_loaded(self, thread_id):
+        """Load a thread that isn't in memory yet in a worker thread, so that using it doesn't block the event loop"""
+        if thread_id in self.resident or thread_id not in self.ids:
+            return
+        thread = await asyncio.to_thread(self.read, thread_id)
+        # It may have been loaded, replaced or ended while it was read
+        if thread_id not in self.resident and thread_id in self.ids:
+            self.loaded(thread_id, thread)
+
+    @staticmethod
+    def changes(saved, state):
+        """
+        The position to write the thread's history from (0 if it was rewritten, None if nothing was added) and
+        whether its fields changed, since it was saved
+        """
+        thread, history, rewrites, version, length, fields = state
+        if (
+            saved is None
+            or saved[0] is not thread
+            or saved[1] is not history
+            or saved[2] != rewrites
+        ):
+            return 0, True
+        return saved[4] if saved[3] != version else None, saved[5] != fields
+
+    def collect(self):
+        """
+        The writes for the changes to the threads in memory since the last call, which are from then on taken as
+        written, as (thread id, pickled fields or None, first position written or None, pickled items), the
+        ended threads and the (thread id, last active) of the threads used
+        """
+        writes = []
+        for thread_id, thread in self.resident.items():
+            state = self.saved_state(thread)
+            start, fields_changed = self.changes(self.saved.get(thread_id), state)
+            if start is None and not fields_changed:
+                continue
+            history, fields = state[1], state[5]
+            writes.append(
+                (
+                    thread_id,
+                    (
+                        pickle.dumps(dict(zip(THREAD_FIELDS, fields)))
+                        if fields_changed
+                        else None
+                    ),
+                    start,
+                    (
+                        [pickle.dumps(item) for item in history[start:]]
+                        if start is not None
+                        else []
+                    ),
+                )
+            )
+            self.saved[thread_id] = state
+        ended, self.ended = self.ended, set()
+        active = [(thread_id, self.last_active[thread_id]) for thread_id in self.active]
+        self.active = set()
+        return writes, ended, active
+
+    def write(self, writes, ended, active=()):
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO activity VALUES (?, ?)", active)
+            for thread_id, fields, start, items in writes:
+                if fields is not None:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO threads VALUES (?, ?)",
+                        (thread_id, fields),
+                    )
+                if start is not None:
+                    self.db.execute(
+                        "DELETE FROM items WHERE thread_id = ? AND position >= ?",
+                        (thread_id, start),
+                    )
+                    self.db.executemany(
+                        "INSERT INTO items VALUES (?, ?, ?)",
+                        [
+                            (thread_id, start + offset, item)
+                            for offset, item in enumerate(items)
+                        ],
+                    )
+            for thread_id in ended:
+                self.db.execute("DELETE FROM items WHERE thread_id = ?", (thread_id,))
+                self.db.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+                self.db.execute(
+                    "DELETE FROM activity WHERE thread_id = ?", (thread_id,)
+                )
+
+    def stored_bytes(self, thread_id):
+        """The size of a thread in the DB"""
+        with self.lock:
+            (fields,) = self.db.execute(
+                "SELECT COALESCE(SUM(LENGTH(fields)), 0) FROM threads WHERE thread_id = ?",
+                (thread_id,),
+            ).fetchone()
+            (items,) = self.db.execute(
+                "SELECT COALESCE(SUM(LENGTH(item)), 0) FROM items WHERE thread_id = ?",
+                (thread_id,),
+            ).fetchone()
+        return fields + items
+
+    async def flush(self):
+        """Write the changes to the threads since the last flush, then drop the threads that have gone idle"""
+        writes, ended, active = self.collect()
+        if writes or ended or active:
+            try:
+                await asyncio.to_thread(self.write, writes, ended, active)
+            except Exception:
+                traceback.print_exc()
+                # Have the next flush write these threads again, in full
+                for thread_id, *_ in writes:
+                    self.saved.pop(thread_id, None)
+                self.ended |= ended - self.ids
+                self.active |= {thread_id for thread_id, _ in active} & self.ids
+                return
+        self.evict_idle()
+
+    def evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for thread_id, last_used in list(self.last_used.items()):
+            # Only threads whose changes are all written, anything else waits for the next flush
+            if last_used < cutoff and thread_id in self.saved:
+                start, fields_changed = self.changes(
+                    self.saved[thread_id], self.saved_state(self.resident[thread_id])
+                )
+                if start is not None or fields_changed:
+                    continue
+                del self.resident[thread_id], self.last_used[thread_id]
+                del self.saved[thread_id]
+                self.evictions += 1
+
+    async def import_pickle(self, path):
+        """Move the threads of a conversation_threads pickle into the store, once, returns how many there were"""
+        if not os.path.exists(path):
+            return 0
+
+        # Written by the Pickler, which may have compressed it
+        threads = await asyncio.to_thread(Pickler.read, path)
+        for thread_id, thread in threads.items():
+            self[thread_id] = thread
+        await asyncio.to_thread(self.write, *self.collect())
+        os.replace(path, f"{path}.imported")
+        return len(threads)
+
+    def get_stats(self):
+        return {
+            "threads": len(self.ids),
+            "in_memory": len(self.resident),
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -1,43 +1,240 @@
 import asyncio
+import heapq
+import itertools
+import time
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 import discord
 
+from services.pickle_service import Pickler
+
+# Discord only bulk deletes messages younger than two weeks, and at most 100 at a time
+BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+BULK_DELETE_MAX_MESSAGES = 100
+
 
 class Deletion:
     def __init__(self, message, timestamp):
         self.message = message
         self.timestamp = timestamp
 
-    # This function will be called by the bot to process the message queue
-    @staticmethod
-    async def process_deletion_queue(
-        deletion_queue, PROCESS_WAIT_TIME, EMPTY_WAIT_TIME
-    ):
+    @property
+    def key(self):
+        """What identifies the message, interaction responses by the interaction"""
+        if isinstance(self.message, (discord.Message, discord.PartialMessage)):
+            return self.message.id
+        return "interaction", id(self.message)
+
+
+class DeletionScheduler:
+    """
+    The messages to delete later, kept in a min-heap by when they are due. It is used like the deletion queue it
+    replaces (await put(Deletion(...))), the scheduler sleeps until the next deletion is due, or until an earlier
+    one is put, and deletes all the messages that are due in a channel at once where the channel supports it.
+
+    A deletion is cancelled when its message is deleted by someone else first, and a message that turns out to be
+    gone already is skipped. The pending deletions of messages are saved with the pickles and scheduled again
+    after a restart, interaction responses can only be deleted within the lifetime of the interaction and aren't.
+    """
+
+    def __init__(self, save_interval=5):
+        self.save_interval = save_interval
+        # [timestamp, sequence number, deletion], the deletion is set to None when it is cancelled
+        self.heap = []
+        self.sequence = itertools.count()
+        self.entries = {}
+        self.wakeup = asyncio.Event()
+        self.dirty = False
+        self.saved_at = 0
+        self.restored = False
+
+        # Statistics
+        self.deleted = 0
+        self.bulk_deletes = 0
+        self.cancelled = 0
+        self.already_gone = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def empty(self):
+        return not self.entries
+
+    def qsize(self):
+        return len(self.entries)
+
+    async def put(self, deletion):
+        self.put_nowait(deletion)
+
+    def put_nowait(self, deletion):
+        """Schedule a deletion, in place of any deletion already scheduled for the message"""
+        self.cancel(deletion.key, count=False)
+        entry = [deletion.timestamp, next(self.sequence), deletion]
+        self.entries[deletion.key] = entry
+        heapq.heappush(self.heap, entry)
+        self.dirty = True
+        if self.heap[0] is entry:
+            self.wakeup.set()
+
+    def cancel(self, key, count=True):
+        """Cancel the deletion of a message, by its id, returns whether one was scheduled"""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        self.dirty = True
+        if count:
+            self.cancelled += 1
+        return True
+
+    def take_due(self):
+        now = datetime.now().timestamp()
+        due = []
+        while self.heap and (self.heap[0][2] is None or self.heap[0][0] <= now):
+            deletion = heapq.heappop(self.heap)[2]
+            if deletion is not None:
+                del self.entries[deletion.key]
+                due.append(deletion)
+        return due
+
+    async def wait(self):
+        """Sleep until the next deletion is due, an earlier one is put, or the pending deletions need saving"""
+        while self.heap and self.heap[0][2] is None:
+            heapq.heappop(self.heap)
+        timeout = (
+            max(0, self.heap[0][0] - datetime.now().timestamp()) if self.heap else None
+        )
+        if self.dirty and self.restored:
+            save_in = max(0, self.saved_at + self.save_interval - time.monotonic())
+            timeout = save_in if timeout is None else min(timeout, save_in)
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def delete_one(self, message):
+        try:
+            if isinstance(message, (discord.Message, discord.PartialMessage)):
+                await message.delete()
+            else:
+                await message.delete_original_response()
+            self.deleted += 1
+        except discord.NotFound:
+            self.already_gone += 1
+        except Exception:
+            self.failed += 1
+            traceback.print_exc()
+
+    async def delete_bulk(self, channel, messages):
+        """Delete messages of one channel in as few requests as the channel allows"""
+        cutoff = datetime.now(timezone.utc) - BULK_DELETE_MAX_AGE
+        bulk = [
+            message
+            for message in messages
+            if discord.utils.snowflake_time(message.id) > cutoff
+        ]
+        if len(bulk) >= 2 and hasattr(channel, "delete_messages"):
+            for start in range(0, len(bulk), BULK_DELETE_MAX_MESSAGES):
+                chunk = bulk[start : start + BULK_DELETE_MAX_MESSAGES]
+                try:
+                    await channel.delete_messages(chunk)
+                    self.deleted += len(chunk)
+                    self.bulk_deletes += 1
+                except Exception:
+                    # No permission to manage messages, or a message is gone already, one by one then
+                    for message in chunk:
+                        await self.delete_one(message)
+            messages = [message for message in messages if message not in bulk]
+        for message in messages:
+            await self.delete_one(message)
+
+    async def delete(self, deletions):
+        by_channel = {}
+        for deletion in deletions:
+            message = deletion.message
+            if isinstance(message, (discord.Message, discord.PartialMessage)):
+                channel = message.channel
+                by_channel.setdefault(channel.id, (channel, []))[1].append(message)
+            else:
+                await self.delete_one(message)
+        for channel, messages in by_channel.values():
+            await self.delete_bulk(channel, messages)
+
+    def snapshot(self):
+        """The pending deletions of messages, as (channel id, message id, timestamp)"""
+        return [
+            (entry[2].message.channel.id, entry[2].message.id, entry[0])
+            for entry in self.entries.values()
+            if isinstance(entry[2].message, (discord.Message, discord.PartialMessage))
+        ]
+
+    async def save(self):
+        # The saved deletions would be lost if they were overwritten before being restored
+        if not self.restored:
+            return
+        self.dirty = False
+        self.saved_at = time.monotonic()
+        try:
+            await Pickler.write("pending_deletions", self.snapshot())
+        except Exception:
+            self.dirty = True
+            traceback.print_exc()
+
+    async def restore(self, bot):
+        """Schedule the deletions that were pending when the bot last stopped, once the bot is ready"""
+        if self.restored:
+            return 0
+        self.restored = True
+        try:
+            pending = await asyncio.to_thread(Pickler.load, "pending_deletions")
+        except FileNotFoundError:
+            return 0
+        except Exception:
+            traceback.print_exc()
+            return 0
+
+        restored = 0
+        for channel_id, message_id, timestamp in pending:
+            try:
+                channel = bot.get_channel(channel_id) or await bot.fetch_channel(
+                    channel_id
+                )
+                message = channel.get_partial_message(message_id)
+            except Exception:
+                # The channel is gone, and the message with it
+                self.already_gone += 1
+                continue
+            if message_id not in self.entries:
+                self.put_nowait(Deletion(message, timestamp))
+                restored += 1
+        return restored
+
+    # This function will be called by the bot to process the deletions
+    async def run(self):
         while True:
             try:
-                # If the queue is empty, sleep for a short time before checking again
-                if deletion_queue.empty():
-                    await asyncio.sleep(EMPTY_WAIT_TIME)
-                    continue
-
-                # Get the next message from the queue
-                deletion = await deletion_queue.get()
-
-                # Check if the current timestamp is greater than the deletion timestamp
-                if datetime.now().timestamp() > deletion.timestamp:
-                    # If the deletion timestamp has passed, delete the message
-                    # check if deletion.message is of type discord.Message
-                    if isinstance(deletion.message, discord.Message):
-                        await deletion.message.delete()
-                    else:
-                        await deletion.message.delete_original_response()
-                else:
-                    await deletion_queue.put(deletion)
-
-                # Sleep for a short time before processing the next message
-                # This will prevent the bot from spamming messages too quickly
-                await asyncio.sleep(PROCESS_WAIT_TIME)
+                await self.wait()
+                due = self.take_due()
+                if due:
+                    await self.delete(due)
+                # At most every few seconds
+                if (
+                    self.dirty
+                    and time.monotonic() - self.saved_at >= self.save_interval
+                ):
+                    await self.save()
             except Exception:
                 traceback.print_exc()
+
+    def get_stats(self):
+        return {
+            "pending": len(self.entries),
+            "deleted": self.deleted,
+            "bulk_deletes": self.bulk_deletes,
+            "cancelled": self.cancelled,
+            "already_gone": self.already_gone,
+            "failed": self.failed,
+        }
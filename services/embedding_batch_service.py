@@ -0,0 +1,126 @@
+import asyncio
+import traceback
+
+from services.environment_service import EnvService
+
+
+class PendingBatch:
+    def __init__(self):
+        self.texts = []
+        self.futures = []
+        self.tokens = 0
+        self.timer = None
+
+    def add(self, text, tokens, future):
+        self.texts.append(text)
+        self.futures.append(future)
+        self.tokens += tokens
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces concurrent embedding requests into a single API call.
+
+    Texts that arrive within a few milliseconds of each other are sent together as one `input: [...]` array,
+    the batch is sent early if it reaches the size or token cap. Each caller gets back only its own vector.
+    Batches are kept per API key, since a batch is billed to the key it is sent with.
+    """
+
+    def __init__(
+        self,
+        send_batch,
+        token_counter,
+        window=None,
+        max_batch_size=None,
+        max_batch_tokens=None,
+    ):
+        # send_batch(texts, api_key, estimated_tokens) -> list of embeddings, in the order of texts
+        self.send_batch = send_batch
+        self.token_counter = token_counter
+        self.window = (
+            EnvService.get_embedding_batch_window() if window is None else window
+        )
+        self.max_batch_size = (
+            EnvService.get_embedding_batch_size()
+            if max_batch_size is None
+            else max_batch_size
+        )
+        self.max_batch_tokens = (
+            EnvService.get_embedding_batch_tokens()
+            if max_batch_tokens is None
+            else max_batch_tokens
+        )
+
+        self.pending = {}
+        self.in_flight = set()
+
+        # Statistics
+        self.texts_embedded = 0
+        self.batches_sent = 0
+        self.largest_batch = 0
+
+    async def embed(self, text, api_key=None):
+        """Get the embedding of a single text, sent along with whatever else is requested at the same time"""
+        loop = asyncio.get_running_loop()
+        tokens = self.token_counter(text)
+
+        batch = self.pending.get(api_key)
+        if batch is not None and batch.tokens + tokens > self.max_batch_tokens:
+            self._flush(api_key, batch)
+            batch = None
+        if batch is None:
+            batch = PendingBatch()
+            batch.timer = loop.call_later(self.window, self._flush, api_key, batch)
+            self.pending[api_key] = batch
+
+        future = loop.create_future()
+        batch.add(text, tokens, future)
+        if len(batch.texts) >= self.max_batch_size:
+            self._flush(api_key, batch)
+
+        return await future
+
+    async def embed_many(self, texts, api_key=None):
+        """Get the embeddings of several texts, they will all end up in the same batch where possible"""
+        return await asyncio.gather(*[self.embed(text, api_key) for text in texts])
+
+    def _flush(self, api_key, batch):
+        # The timer of a batch that was already sent early may still fire, only send the batch once
+        if self.pending.get(api_key) is not batch:
+            return
+        self.pending.pop(api_key)
+        batch.timer.cancel()
+
+        task = asyncio.create_task(self._send(api_key, batch))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    async def _send(self, api_key, batch):
+        self.batches_sent += 1
+        self.texts_embedded += len(batch.texts)
+        self.largest_batch = max(self.largest_batch, len(batch.texts))
+        try:
+            embeddings = await self.send_batch(batch.texts, api_key, batch.tokens)
+        except Exception as e:
+            traceback.print_exc()
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for future, embedding in zip(batch.futures, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    def get_stats(self):
+        return {
+            "texts_embedded": self.texts_embedded,
+            "batches_sent": self.batches_sent,
+            "average_batch_size": (
+                round(self.texts_embedded / self.batches_sent, 2)
+                if self.batches_sent
+                else 0.0
+            ),
+            "largest_batch": self.largest_batch,
+            "pending_batches": len(self.pending),
+        }
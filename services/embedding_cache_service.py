@@ -0,0 +1,170 @@
+import asyncio
+import hashlib
+import threading
+import traceback
+from array import array
+from collections import OrderedDict
+
+from sqlitedict import SqliteDict
+
+from services.environment_service import EnvService
+
+
+class EmbeddingCache:
+    """
+    A content-addressed cache of embeddings, keyed by the embedding model and the sha256 of the text.
+
+    Recently used vectors are kept in an in-memory LRU, everything is persisted to SQLite as compact float32
+    blobs so identical texts are never embedded twice, not even across restarts. On the event loop, use aget() and
+    aput(): the disk is read in a worker thread, and the new vectors are written in batches, one commit each, by a
+    worker thread too. get() and put() are for the llama_index embedding path, which runs in executor threads.
+    """
+
+    def __init__(self, path=None, max_memory_items=None):
+        self.max_memory_items = (
+            EnvService.get_embedding_cache_memory_items()
+            if max_memory_items is None
+            else max_memory_items
+        )
+        self.memory = OrderedDict()
+        # The llama_index embedding path runs in executor threads
+        self.lock = threading.Lock()
+
+        try:
+            self.db = SqliteDict(
+                path or f"{EnvService.save_path()}/embedding_cache.sqlite",
+                tablename="embeddings",
+            )
+        except Exception:
+            print(
+                "Failed to open the embedding cache DB, embeddings will only be cached in memory"
+            )
+            traceback.print_exc()
+            self.db = None
+
+        # The vectors put but not written to the DB yet, and whether a flush() will write them
+        self.unwritten = {}
+        self.flush_scheduled = False
+        self.flush_task = None
+
+        # Statistics
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(model, text):
+        return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _remember(self, key, vector):
+        with self.lock:
+            self.memory[key] = vector
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_items:
+                self.memory.popitem(last=False)
+
+    def _recall(self, key):
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return list(vector)
+        return None
+
+    def _load(self, key):
+        """Read a vector from the DB, blocking, so off the event loop"""
+        with self.lock:
+            blob = self.unwritten.get(key)
+        if blob is None and self.db is not None:
+            try:
+                blob = self.db.get(key)
+            except Exception:
+                traceback.print_exc()
+        if blob is None:
+            self.misses += 1
+            return None
+
+        vector = array("f")
+        vector.frombytes(blob)
+        self._remember(key, vector)
+        self.disk_hits += 1
+        return list(vector)
+
+    def _stage(self, model, text, embedding):
+        key = self.get_key(model, text)
+        vector = array("f", embedding)
+        self._remember(key, vector)
+        if self.db is None:
+            return False
+        with self.lock:
+            self.unwritten[key] = vector.tobytes()
+            scheduled = self.flush_scheduled
+            self.flush_scheduled = True
+        return not scheduled
+
+    def get(self, model, text):
+        """Get the cached embedding of a text, or None if it has never been embedded with this model"""
+        key = self.get_key(model, text)
+        vector = self._recall(key)
+        if vector is not None:
+            return vector
+        return self._load(key)
+
+    async def aget(self, model, text):
+        key = self.get_key(model, text)
+        vector = self._recall(key)
+        if vector is not None:
+            return vector
+        if self.db is None:
+            self.misses += 1
+            return None
+        return await asyncio.to_thread(self._load, key)
+
+    def put(self, model, text, embedding):
+        if embedding is None:
+            return
+        if self._stage(model, text, embedding):
+            self.flush()
+
+    async def aput(self, model, text, embedding):
+        """Cache an embedding, it is written to the DB by a worker thread along with the others put meanwhile"""
+        if embedding is None:
+            return
+        if self._stage(model, text, embedding):
+            self.flush_task = asyncio.create_task(asyncio.to_thread(self.flush))
+
+    def flush(self):
+        """Write the unwritten vectors to the DB, blocking, so off the event loop"""
+        while True:
+            with self.lock:
+                writes = self.unwritten
+                self.unwritten = {}
+                if not writes:
+                    self.flush_scheduled = False
+                    return
+            try:
+                for key, blob in writes.items():
+                    self.db[key] = blob
+                self.db.commit()
+            except Exception:
+                traceback.print_exc()
+
+    def get_stats(self):
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": (
+                round((self.memory_hits + self.disk_hits) / lookups, 3)
+                if lookups
+                else 0.0
+            ),
+            "vectors_in_memory": len(self.memory),
+            "unwritten": len(self.unwritten),
+        }
+
+
+# Shared by the conversation embeddings and the llama_index embedding model of the index and search cogs
+EMBEDDING_CACHE = EmbeddingCache()
@@ -549,3 +549,309 @@ class EnvService:
             return google_cloud_project_id
         except Exception:
             return None
+
+    @staticmethod
+    def get_http_pool_limit():
+        try:
+            pool_limit = int(os.getenv("HTTP_POOL_LIMIT"))
+            return pool_limit
+        except Exception:
+            return 100
+
+    @staticmethod
+    def get_http_pool_limit_per_host():
+        try:
+            pool_limit_per_host = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST"))
+            return pool_limit_per_host
+        except Exception:
+            return 30
+
+    @staticmethod
+    def get_http_dns_cache_ttl():
+        try:
+            dns_cache_ttl = int(os.getenv("HTTP_DNS_CACHE_TTL"))
+            return dns_cache_ttl
+        except Exception:
+            return 300
+
+    @staticmethod
+    def get_http_keepalive_timeout():
+        try:
+            keepalive_timeout = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT"))
+            return keepalive_timeout
+        except Exception:
+            return 60.0
+
+    @staticmethod
+    def get_rate_limit_max_wait():
+        try:
+            max_wait = float(os.getenv("RATE_LIMIT_MAX_WAIT"))
+            return max_wait
+        except Exception:
+            return 30.0
+
+    @staticmethod
+    def get_embedding_batch_window():
+        try:
+            window = float(os.getenv("EMBEDDING_BATCH_WINDOW"))
+            return window
+        except Exception:
+            return 0.005
+
+    @staticmethod
+    def get_embedding_batch_size():
+        try:
+            batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE"))
+            return batch_size
+        except Exception:
+            return 64
+
+    @staticmethod
+    def get_embedding_batch_tokens():
+        try:
+            batch_tokens = int(os.getenv("EMBEDDING_BATCH_TOKENS"))
+            return batch_tokens
+        except Exception:
+            return 8000
+
+    @staticmethod
+    def get_embedding_cache_memory_items():
+        try:
+            memory_items = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS"))
+            return memory_items
+        except Exception:
+            return 10000
+
+    @staticmethod
+    def get_response_cache_ttl():
+        try:
+            ttl = float(os.getenv("RESPONSE_CACHE_TTL"))
+            return ttl
+        except Exception:
+            return 3600.0
+
+    @staticmethod
+    def get_response_cache_size():
+        try:
+            size = int(os.getenv("RESPONSE_CACHE_SIZE"))
+            return size
+        except Exception:
+            return 500
+
+    @staticmethod
+    def get_scheduler_max_concurrency():
+        try:
+            max_concurrency = int(os.getenv("SCHEDULER_MAX_CONCURRENCY"))
+            return max_concurrency
+        except Exception:
+            return 32
+
+    @staticmethod
+    def get_scheduler_interactive_reserve():
+        try:
+            interactive_reserve = int(os.getenv("SCHEDULER_INTERACTIVE_RESERVE"))
+            return interactive_reserve
+        except Exception:
+            return 4
+
+    @staticmethod
+    def get_scheduler_moderation_limit():
+        try:
+            moderation_limit = int(os.getenv("SCHEDULER_MODERATION_LIMIT"))
+            return moderation_limit
+        except Exception:
+            return 8
+
+    @staticmethod
+    def get_scheduler_summarization_limit():
+        try:
+            summarization_limit = int(os.getenv("SCHEDULER_SUMMARIZATION_LIMIT"))
+            return summarization_limit
+        except Exception:
+            return 4
+
+    @staticmethod
+    def get_scheduler_bulk_limit():
+        try:
+            bulk_limit = int(os.getenv("SCHEDULER_BULK_LIMIT"))
+            return bulk_limit
+        except Exception:
+            return 2
+
+    @staticmethod
+    def get_scheduler_aging_interval():
+        try:
+            aging_interval = float(os.getenv("SCHEDULER_AGING_INTERVAL"))
+            return aging_interval
+        except Exception:
+            return 10.0
+
+    @staticmethod
+    def get_log_level(subsystem):
+        level = os.getenv(f"LOG_LEVEL_{subsystem.upper()}") or os.getenv("LOG_LEVEL")
+        if level and level.strip().upper() in (
+            "DEBUG",
+            "INFO",
+            "WARNING",
+            "ERROR",
+            "CRITICAL",
+        ):
+            return level.strip().upper()
+        return "INFO"
+
+    @staticmethod
+    def get_payload_log_sample_rate():
+        try:
+            sample_rate = int(os.getenv("PAYLOAD_LOG_SAMPLE_RATE"))
+            return sample_rate
+        except Exception:
+            return 10
+
+    @staticmethod
+    def get_payload_log_max_length():
+        try:
+            max_length = int(os.getenv("PAYLOAD_LOG_MAX_LENGTH"))
+            return max_length
+        except Exception:
+            return 2000
+
+    @staticmethod
+    def get_openai_api_base():
+        api_base = os.getenv("OPENAI_API_BASE")
+        if api_base:
+            return api_base.rstrip("/")
+        return "https://api.openai.com/v1"
+
+    @staticmethod
+    def get_tokenizer_threads():
+        try:
+            threads = int(os.getenv("TOKENIZER_THREADS"))
+            return threads
+        except Exception:
+            return 4
+
+    @staticmethod
+    def get_tokenizer_offload_characters():
+        try:
+            characters = int(os.getenv("TOKENIZER_OFFLOAD_CHARACTERS"))
+            return characters
+        except Exception:
+            return 20000
+
+    @staticmethod
+    def get_context_recent_items():
+        try:
+            recent_items = int(os.getenv("CONTEXT_RECENT_ITEMS"))
+            return recent_items
+        except Exception:
+            return 6
+
+    @staticmethod
+    def get_context_compressed_tokens():
+        try:
+            compressed_tokens = int(os.getenv("CONTEXT_COMPRESSED_TOKENS"))
+            return compressed_tokens
+        except Exception:
+            return 200
+
+    @staticmethod
+    def get_context_reserved_tokens():
+        try:
+            reserved_tokens = int(os.getenv("CONTEXT_RESERVED_TOKENS"))
+            return reserved_tokens
+        except Exception:
+            return 1024
+
+    @staticmethod
+    def get_follow_up_queue_size():
+        try:
+            queue_size = int(os.getenv("FOLLOW_UP_QUEUE_SIZE"))
+            return queue_size
+        except Exception:
+            return 10
+
+    @staticmethod
+    def get_journal_flush_interval():
+        try:
+            flush_interval = float(os.getenv("JOURNAL_FLUSH_INTERVAL"))
+            return flush_interval
+        except Exception:
+            return 0.25
+
+    @staticmethod
+    def get_journal_compact_records():
+        try:
+            compact_records = int(os.getenv("JOURNAL_COMPACT_RECORDS"))
+            return compact_records
+        except Exception:
+            return 5000
+
+    @staticmethod
+    def get_conversation_idle_seconds():
+        try:
+            idle_seconds = int(os.getenv("CONVERSATION_IDLE_SECONDS"))
+            return idle_seconds
+        except Exception:
+            return 1800
+
+    @staticmethod
+    def get_snapshot_compression():
+        compression = os.getenv("SNAPSHOT_COMPRESSION")
+        if compression and compression.strip().lower() in ("zlib", "lzma", "zstd"):
+            return compression.strip().lower()
+        return "none"
+
+    @staticmethod
+    def get_full_history_thread_bytes():
+        try:
+            thread_bytes = int(os.getenv("FULL_HISTORY_THREAD_BYTES"))
+            return thread_bytes
+        except Exception:
+            return 262144
+
+    @staticmethod
+    def get_full_history_memory_bytes():
+        try:
+            memory_bytes = int(os.getenv("FULL_HISTORY_MEMORY_BYTES"))
+            return memory_bytes
+        except Exception:
+            return 33554432
+
+    @staticmethod
+    def get_conversation_ttl_seconds():
+        try:
+            ttl_seconds = int(os.getenv("CONVERSATION_TTL_SECONDS"))
+            return ttl_seconds
+        except Exception:
+            return 604800
+
+    @staticmethod
+    def get_conversation_archived_ttl_seconds():
+        try:
+            ttl_seconds = int(os.getenv("CONVERSATION_ARCHIVED_TTL_SECONDS"))
+            return ttl_seconds
+        except Exception:
+            return 86400
+
+    @staticmethod
+    def get_conversation_sweep_interval():
+        try:
+            sweep_interval = int(os.getenv("CONVERSATION_SWEEP_INTERVAL"))
+            return sweep_interval
+        except Exception:
+            return 300
+
+    @staticmethod
+    def get_debug_queue_size():
+        try:
+            queue_size = int(os.getenv("DEBUG_QUEUE_SIZE"))
+            return queue_size
+        except Exception:
+            return 500
+
+    @staticmethod
+    def get_debug_overflow_policy():
+        policy = os.getenv("DEBUG_OVERFLOW_POLICY")
+        if policy and policy.strip().lower() in ("drop_newest", "sample"):
+            return policy.strip().lower()
+        return "drop_oldest"
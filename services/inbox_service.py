@@ -0,0 +1,87 @@
+from services.environment_service import EnvService
+
+
+class FollowUp:
+    """A message held back because the conversation thread it was sent in was busy"""
+
+    __slots__ = ("message", "content", "files")
+
+    def __init__(self, message, content, files=None):
+        self.message = message
+        self.content = content
+        self.files = files
+
+
+class ConversationInbox:
+    """
+    Holds the messages sent to a conversation thread while a response in it is still being generated, so they
+    don't have to be turned away. Once the thread frees up, the held messages of one author are taken out
+    together and answered as a single message, a burst of quick messages costs one completion.
+    """
+
+    def __init__(self, max_messages=None):
+        self.max_messages = (
+            EnvService.get_follow_up_queue_size()
+            if max_messages is None
+            else max_messages
+        )
+        self.queues = {}
+
+        # Statistics
+        self.held = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def __contains__(self, thread_id):
+        return thread_id in self.queues
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def put(self, thread_id, message, content, files=None):
+        """Hold a message for the thread, returns False if the thread already has too many messages held"""
+        queue = self.queues.setdefault(thread_id, [])
+        if len(queue) >= self.max_messages:
+            self.rejected += 1
+            return False
+        queue.append(FollowUp(message, content, files))
+        self.held += 1
+        return True
+
+    def take(self, thread_id):
+        """
+        Take the messages the first waiting author sent to the thread, as one FollowUp. The message is the last
+        one they sent, the content and files those of all of them. Messages of other authors stay held.
+        """
+        queue = self.queues.get(thread_id)
+        if not queue:
+            self.queues.pop(thread_id, None)
+            return None
+
+        author_id = queue[0].message.author.id
+        taken = [item for item in queue if item.message.author.id == author_id]
+        remaining = [item for item in queue if item.message.author.id != author_id]
+        if remaining:
+            self.queues[thread_id] = remaining
+        else:
+            del self.queues[thread_id]
+
+        self.coalesced += len(taken) - 1
+        files = [file for item in taken for file in (item.files or [])]
+        return FollowUp(
+            taken[-1].message,
+            "\n".join(item.content for item in taken),
+            files or None,
+        )
+
+    def discard(self, thread_id):
+        self.queues.pop(thread_id, None)
+
+    def get_stats(self):
+        return {
+            "threads": len(self.queues),
+            "waiting": len(self),
+            "held": self.held,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+        }
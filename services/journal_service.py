@@ -0,0 +1,146 @@
+import pickle
+import struct
+import traceback
+
+import aiofiles
+
+from services.environment_service import EnvService
+from services.pickle_service import Pickler
+
+# Each batch of records is written as its length followed by the pickled batch, a batch cut short by a crash is
+# recognized and ignored when replaying
+HEADER = struct.Struct(">I")
+
+
+class ConversationJournal:
+    """
+    Persists the conversation data of the text cog that isn't kept in SQLite (conversation_thread_owners and
+    instructions, the threads and their full texts are in the conversation store and archive) as an append-only
+    journal of changes next to the pickled snapshots, instead of re-pickling everything every few seconds.
+
+    Every flush, the journal finds what changed since the last flush and appends just that: an instruction or an
+    owner list that was set. Once enough records are written,
+    the journal is compacted: the snapshots are written anew and the journal is started over. On startup the
+    journal is replayed on top of the snapshots. Replaying a record twice, or on a snapshot that already has it,
+    does no harm.
+    """
+
+    def __init__(self, path=None, compact_records=None):
+        self.path = (
+            EnvService.save_path() / "pickles" / "conversation_journal.log"
+            if path is None
+            else path
+        )
+        self.compact_records = (
+            EnvService.get_journal_compact_records()
+            if compact_records is None
+            else compact_records
+        )
+
+        # What has been journaled so far, the ownership index tracks its own changes
+        self.instructions = {}
+        self.records_since_snapshot = 0
+
+    def collect(self, converser_cog):
+        """The records of everything that changed since the last call, which is from then on taken as journaled"""
+        records = []
+        changes = converser_cog.conversation_thread_owners.take_changes()
+        for user_id, thread_ids in changes.items():
+            records.append(("owners", user_id, thread_ids))
+
+        instructions = converser_cog.instructions
+        for set_id, instruction in instructions.items():
+            if self.instructions.get(set_id) is not instruction:
+                records.append(("instruction", set_id, instruction))
+                self.instructions[set_id] = instruction
+        for set_id in self.instructions.keys() - instructions.keys():
+            records.append(("instruction", set_id, None))
+            del self.instructions[set_id]
+
+        return records
+
+    async def write(self, records):
+        # Pickled right away, before anything else gets to change the conversations
+        payload = pickle.dumps(records)
+        try:
+            async with aiofiles.open(self.path, "ab") as f:
+                await f.write(HEADER.pack(len(payload)) + payload)
+            self.records_since_snapshot += len(records)
+        except Exception:
+            traceback.print_exc()
+            # These changes are only in memory now, have the next snapshot save them
+            self.records_since_snapshot = self.compact_records
+
+    async def flush(self, converser_cog):
+        """Append what changed since the last flush to the journal, compacting it when it has grown enough"""
+        records = self.collect(converser_cog)
+        if records:
+            await self.write(records)
+        if self.records_since_snapshot >= self.compact_records:
+            await self.compact(converser_cog)
+
+    async def compact(self, converser_cog):
+        """Write new snapshots and start the journal over"""
+        # The journal is brought up to date first, if the journal can't be started over after the snapshots are
+        # written, replaying all of it on top of them still ends up at the right state. Anything changing while
+        # the snapshots are written is journaled by the next flush.
+        records = self.collect(converser_cog)
+        if records:
+            await self.write(records)
+        try:
+            await Pickler(
+                None,
+                None,
+                converser_cog.conversation_thread_owners.snapshot(),
+                converser_cog.instructions,
+            ).save()
+            async with aiofiles.open(self.path, "wb"):
+                pass
+            self.records_since_snapshot = 0
+        except Exception:
+            traceback.print_exc()
+
+    def read(self):
+        """The batches of records in the journal, up to the first one that is incomplete or unreadable"""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        position = 0
+        while position + HEADER.size <= len(data):
+            (size,) = HEADER.unpack_from(data, position)
+            position += HEADER.size
+            if position + size > len(data):
+                print(
+                    "The conversation journal ends in an incomplete batch, skipped it"
+                )
+                return
+            try:
+                yield pickle.loads(data[position : position + size])
+            except Exception:
+                traceback.print_exc()
+                return
+            position += size
+
+    def replay(self, converser_cog):
+        """Apply the journal to the conversations loaded from the snapshots, returns the number of records"""
+        replayed = 0
+        for records in self.read():
+            for record in records:
+                self.apply(converser_cog, record)
+                replayed += 1
+        return replayed
+
+    @staticmethod
+    def apply(converser_cog, record):
+        """Apply one of the records collect() writes"""
+        kind, key = record[0], record[1]
+        if kind == "owners":
+            converser_cog.conversation_thread_owners.set_threads(key, record[2])
+        elif kind == "instruction":
+            if record[2] is None:
+                converser_cog.instructions.pop(key, None)
+            else:
+                converser_cog.instructions[key] = record[2]
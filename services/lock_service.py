@@ -0,0 +1,95 @@
+import asyncio
+import contextlib
+from collections import deque
+
+
+class KeyedLockManager:
+    """
+    A lock per key (a user id, a thread id), created when it is first taken and gone again once it is released
+    with nobody waiting on it, so it costs nothing for the users and threads that aren't busy.
+
+    A lock can be taken without waiting with try_acquire(), to turn away work for a busy key, or waited on with
+    acquire() / hold(). It isn't tied to the task that took it, it can be released from wherever the work for
+    the key ends. Checking whether a key is locked (`key in locks`) is O(1).
+    """
+
+    def __init__(self):
+        self.held = set()
+        self.waiters = {}
+
+    def locked(self, key):
+        return key in self.held
+
+    def __contains__(self, key):
+        return key in self.held
+
+    def __len__(self):
+        return len(self.held)
+
+    def __iter__(self):
+        return iter(list(self.held))
+
+    def try_acquire(self, key):
+        """Take the lock of the key if it is free, returns whether it was taken"""
+        if key in self.held:
+            return False
+        self.held.add(key)
+        return True
+
+    async def acquire(self, key):
+        """Wait until the lock of the key is free and take it"""
+        if self.try_acquire(key):
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The lock was handed to us just as we were cancelled, hand it on
+                self.release(key)
+            else:
+                self._remove_waiter(key, future)
+            raise
+
+    def _remove_waiter(self, key, future):
+        waiters = self.waiters.get(key)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self.waiters[key]
+
+    def release(self, key):
+        """Release the lock of the key, handing it to the next waiter if there is one. Releasing a free key does nothing"""
+        if key not in self.held:
+            return
+        waiters = self.waiters.get(key)
+        while waiters:
+            future = waiters.popleft()
+            if not future.done():
+                # The key stays held, it now belongs to the waiter
+                future.set_result(None)
+                if not waiters:
+                    del self.waiters[key]
+                return
+        self.waiters.pop(key, None)
+        self.held.discard(key)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        """Hold the lock of the key for a block of work, waiting for it if needed"""
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key)
+
+    def get_stats(self):
+        return {
+            "held": len(self.held),
+            "waiting": sum(len(waiters) for waiters in self.waiters.values()),
+        }
@@ -0,0 +1,119 @@
+import hashlib
+import itertools
+import json
+import logging
+import sys
+
+from services.environment_service import EnvService
+
+LOGGER_NAME = "gptdiscord"
+
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(
+    logging.Formatter("%(asctime)s [%(name)s] %(levelname)s %(message)s")
+)
+_root_logger = logging.getLogger(LOGGER_NAME)
+_root_logger.addHandler(_handler)
+_root_logger.propagate = False
+
+
+def serialize(payload):
+    if isinstance(payload, str):
+        return payload
+    try:
+        return json.dumps(payload, default=str, ensure_ascii=False)
+    except Exception:
+        return repr(payload)
+
+
+class LazySummary:
+    """A one line description of a payload, only worked out if the log record is actually emitted"""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        payload = self.payload
+        if isinstance(payload, dict):
+            parts = []
+            if "model" in payload:
+                parts.append(f"model={payload['model']}")
+            if isinstance(payload.get("usage"), dict):
+                parts.append(f"tokens={payload['usage'].get('total_tokens')}")
+            for key in ("choices", "data", "messages", "results", "translations"):
+                if isinstance(payload.get(key), list):
+                    parts.append(f"{key}={len(payload[key])}")
+            if "error" in payload:
+                parts.append(f"error={payload['error']}")
+            return ", ".join(parts) or f"{len(payload)} fields"
+        if isinstance(payload, (list, tuple)):
+            return f"{len(payload)} items"
+        return f"{len(str(payload))} characters"
+
+
+class LazyDigest:
+    """The size and a short hash of a payload, identical payloads can be correlated without logging them"""
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        serialized = serialize(self.payload)
+        digest = hashlib.sha256(serialized.encode("utf-8")).hexdigest()[:12]
+        return f"{len(serialized)} characters, sha256 {digest}"
+
+
+class LazyTruncated:
+    """The payload itself, cut off at a maximum length"""
+
+    def __init__(self, payload, max_length):
+        self.payload = payload
+        self.max_length = max_length
+
+    def __str__(self):
+        serialized = serialize(self.payload)
+        if len(serialized) <= self.max_length:
+            return serialized
+        return (
+            f"{serialized[:self.max_length]}... "
+            f"({len(serialized) - self.max_length} more characters)"
+        )
+
+
+class PayloadLogger:
+    """
+    A logger for one subsystem (e.g. "openai" or "images"), with its own level from EnvService.
+
+    Payloads are never formatted unless they are logged. At INFO a payload is logged as a one line summary, at
+    DEBUG one in every N payloads is logged in full (up to a maximum length) and the others as a hash.
+    """
+
+    def __init__(self, subsystem):
+        self.logger = logging.getLogger(f"{LOGGER_NAME}.{subsystem}")
+        self.logger.setLevel(EnvService.get_log_level(subsystem))
+        self.sample_rate = max(1, EnvService.get_payload_log_sample_rate())
+        self.max_length = EnvService.get_payload_log_max_length()
+        self.counter = itertools.count()
+
+    def payload(self, label, payload):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            if next(self.counter) % self.sample_rate == 0:
+                self.logger.debug(
+                    "%s -> %s", label, LazyTruncated(payload, self.max_length)
+                )
+            else:
+                self.logger.debug("%s -> %s", label, LazyDigest(payload))
+        elif self.logger.isEnabledFor(logging.INFO):
+            self.logger.info("%s -> %s", label, LazySummary(payload))
+
+    def debug(self, message, *args):
+        self.logger.debug(message, *args)
+
+    def info(self, message, *args):
+        self.logger.info(message, *args)
+
+    def warning(self, message, *args):
+        self.logger.warning(message, *args)
+
+    def error(self, message, *args):
+        self.logger.error(message, *args)
@@ -1,4 +1,21 @@
 import asyncio
+import io
+import random
+import time
+import traceback
+from collections import deque
+
+import discord
+
+from services.environment_service import EnvService
+
+# Discord's limits on a message, and on messages sent to one channel (5 every 5 seconds)
+MESSAGE_LIMIT = 2000
+FILE_LIMIT = 7 * 1024 * 1024
+CHANNEL_RATE = 5
+CHANNEL_RATE_WINDOW = 5
+# A backlog that would take more messages than this is sent as a file instead
+MAX_MESSAGES_PER_BATCH = 3
 
 
 class Message:
@@ -6,25 +23,186 @@ class Message:
         self.content = content
         self.channel = channel
 
-    # This function will be called by the bot to process the message queue
-    @staticmethod
-    async def process_message_queue(message_queue, PROCESS_WAIT_TIME, EMPTY_WAIT_TIME):
-        while True:
-            await asyncio.sleep(PROCESS_WAIT_TIME)
-            # If the queue is empty, sleep for a short time before checking again
-            if message_queue.empty():
-                await asyncio.sleep(EMPTY_WAIT_TIME)
-                continue
 
-            # Get the next message from the queue
-            message = await message_queue.get()
+class MessageDispatcher:
+    """
+    Sends the messages put in it (the debug messages) to their channels, in place of the message queue that sent
+    one message every 1.5 seconds. The messages waiting for a channel are merged into as few Discord messages as
+    the 2000 character limit allows, or into a file when that would take more than a few messages. Each channel is
+    sent at most as many messages as its rate limit allows, the dispatcher sleeps until a message is put or a
+    channel can be sent to again.
+
+    At most max_messages wait per channel, what happens to the messages beyond that is set by the overflow policy:
+    the oldest are dropped (drop_oldest), the new ones are (drop_newest), or a random sample of all of them is kept
+    (sample). How many were dropped is noted in the next message sent to the channel.
+    """
+
+    def __init__(self, max_messages=None, overflow_policy=None):
+        self.max_messages = (
+            EnvService.get_debug_queue_size() if max_messages is None else max_messages
+        )
+        self.overflow_policy = (
+            EnvService.get_debug_overflow_policy()
+            if overflow_policy is None
+            else overflow_policy
+        )
+        # Per channel id: the channel, its waiting contents, and how many were put since it was last empty
+        self.channels = {}
+        self.pending = {}
+        self.seen = {}
+        self.dropped_since = {}
+        # When the last messages were sent to each channel, and until when a channel is rate limited
+        self.sent_at = {}
+        self.blocked_until = {}
+        self.wakeup = asyncio.Event()
+
+        # Statistics
+        self.put_count = 0
+        self.sent_messages = 0
+        self.sent_files = 0
+        self.dropped = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+    def empty(self):
+        return not self.pending
+
+    def qsize(self):
+        return len(self)
 
-            # Send the message
+    async def put(self, message):
+        self.put_nowait(message)
+
+    def put_nowait(self, message):
+        # The debug channel may not have been found
+        if message.channel is None:
+            self.failed += 1
+            return
+        channel_id = message.channel.id
+        self.channels[channel_id] = message.channel
+        queue = self.pending.setdefault(channel_id, deque())
+        self.seen[channel_id] = self.seen.get(channel_id, 0) + 1
+        self.put_count += 1
+
+        if len(queue) >= self.max_messages:
+            self.dropped_since[channel_id] = self.dropped_since.get(channel_id, 0) + 1
+            self.dropped += 1
+            if self.overflow_policy == "drop_newest":
+                return
+            if self.overflow_policy == "sample":
+                # Reservoir sampling, every message put keeps an equal chance of being sent
+                position = random.randrange(self.seen[channel_id])
+                if position < len(queue):
+                    queue[position] = message.content
+                return
+            queue.popleft()
+        queue.append(message.content)
+        self.wakeup.set()
+
+    def rate_wait(self, channel_id, now):
+        """Seconds until a message can be sent to the channel, 0 if it can be now"""
+        wait = self.blocked_until.get(channel_id, 0) - now
+        sent_at = self.sent_at.get(channel_id)
+        if sent_at and len(sent_at) >= CHANNEL_RATE:
+            wait = max(wait, sent_at[0] + CHANNEL_RATE_WINDOW - now)
+        return max(0, wait)
+
+    def take_batch(self, channel_id):
+        """
+        Take the contents to send as the next message to the channel, returns them with whether to send them as a
+        file
+        """
+        queue = self.pending[channel_id]
+        dropped = self.dropped_since.pop(channel_id, 0)
+        if dropped:
+            queue.appendleft(f"({dropped} debug messages were dropped)")
+
+        total = sum(len(content) for content in queue) + len(queue) - 1
+        as_file = (
+            len(queue[0]) > MESSAGE_LIMIT
+            or total > MESSAGE_LIMIT * MAX_MESSAGES_PER_BATCH
+        )
+        limit = FILE_LIMIT if as_file else MESSAGE_LIMIT
+        batch = [queue.popleft()]
+        size = len(batch[0])
+        while queue and size + 1 + len(queue[0]) <= limit:
+            size += 1 + len(queue[0])
+            batch.append(queue.popleft())
+        if not queue:
+            del self.pending[channel_id]
+            self.seen.pop(channel_id, None)
+        return batch, as_file
+
+    async def send_batch(self, channel_id):
+        batch, as_file = self.take_batch(channel_id)
+        channel = self.channels[channel_id]
+        self.sent_at.setdefault(channel_id, deque(maxlen=CHANNEL_RATE)).append(
+            time.monotonic()
+        )
+        try:
+            if as_file:
+                data = "\n\n".join(batch).encode("utf-8")[:FILE_LIMIT]
+                await channel.send(
+                    f"{len(batch)} debug messages",
+                    file=discord.File(io.BytesIO(data), filename="debug.txt"),
+                )
+                self.sent_files += 1
+            else:
+                await channel.send("\n".join(batch))
+                self.sent_messages += 1
+        except discord.HTTPException as e:
+            if e.status == 429:
+                # Put back to be sent once the channel can be sent to again
+                self.rate_limited += 1
+                self.pending.setdefault(channel_id, deque()).extendleft(reversed(batch))
+                retry_after = getattr(e, "retry_after", None) or CHANNEL_RATE_WINDOW
+                self.blocked_until[channel_id] = time.monotonic() + retry_after
+            else:
+                self.failed += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            traceback.print_exc()
+
+    async def dispatch(self):
+        """Send what can be sent now, returns the seconds until more can be, None if nothing is waiting"""
+        delays = []
+        for channel_id in list(self.pending):
+            wait = self.rate_wait(channel_id, time.monotonic())
+            if wait == 0:
+                await self.send_batch(channel_id)
+                if channel_id not in self.pending:
+                    continue
+                wait = self.rate_wait(channel_id, time.monotonic())
+            delays.append(wait)
+        return min(delays) if delays else None
+
+    # This function will be called by the bot to send the messages
+    async def run(self):
+        while True:
             try:
-                await message.channel.send(message.content)
+                # Cleared first, a message put while sending wakes the next wait right away
+                self.wakeup.clear()
+                delay = await self.dispatch()
+                if delay == 0:
+                    continue
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
             except Exception:
-                pass
+                traceback.print_exc()
+                await asyncio.sleep(1)
 
-            # Sleep for a short time before processing the next message
-            # This will prevent the bot from spamming messages too quickly
-            await asyncio.sleep(PROCESS_WAIT_TIME)
+    def get_stats(self):
+        return {
+            "pending": len(self),
+            "put": self.put_count,
+            "sent_messages": self.sent_messages,
+            "sent_files": self.sent_files,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+        }
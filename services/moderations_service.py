@@ -1,18 +1,15 @@
 import asyncio
-import os
 import random
 import traceback
 from datetime import datetime, timedelta
-from pathlib import Path
 
 import discord
 
-from models.openai_model import Model
 from services.environment_service import EnvService
-from services.usage_service import UsageService
+from services.logging_service import PayloadLogger
+from services.scheduler_service import SCHEDULER, Priority
 
-usage_service = UsageService(Path(os.environ.get("DATA_DIR", os.getcwd())))
-model = Model(usage_service)
+logger = PayloadLogger("moderation")
 
 
 class ModerationResult:
@@ -80,6 +77,9 @@ class ThresholdSet:
 
 
 class Moderation:
+    # The bot's model, set by the moderations cog so its connection pool is shared
+    model = None
+
     # Moderation service data
     moderation_queues = {}
     moderation_alerts_channel = EnvService.get_moderations_alert_channel()
@@ -138,7 +138,7 @@ class Moderation:
 
     @staticmethod
     async def force_english_and_respond(text, pretext, ctx):
-        response = await model.send_language_detect_request(text, pretext)
+        response = await Moderation.model.send_language_detect_request(text, pretext)
         response_text = response["choices"][0]["text"]
 
         if "false" in response_text.lower().strip():
@@ -151,14 +151,14 @@ class Moderation:
 
     @staticmethod
     async def simple_moderate(text):
-        return await model.send_moderations_request(text)
+        return await Moderation.model.send_moderations_request(text)
 
     @staticmethod
     async def simple_moderate_and_respond(text, ctx):
         pre_mod_set = ThresholdSet(0.26, 0.26, 0.1, 0.95, 0.03, 0.95, 0.4)
 
         response = await Moderation.simple_moderate(text)
-        print(response)
+        logger.payload("Response", response)
         flagged = (
             True
             if Moderation.determine_moderation_result(
@@ -257,9 +257,10 @@ class Moderation:
 
                 # Check if the current timestamp is greater than the deletion timestamp
                 if datetime.now().timestamp() > to_moderate.timestamp:
-                    response = await model.send_moderations_request(
-                        to_moderate.message.content
-                    )
+                    with SCHEDULER.priority(Priority.MODERATION):
+                        response = await Moderation.model.send_moderations_request(
+                            to_moderate.message.content
+                        )
                     moderation_result = Moderation.determine_moderation_result(
                         to_moderate.message.content, response, warn_set, delete_set
                     )
@@ -0,0 +1,74 @@
+class OwnershipIndex:
+    """
+    Who owns which conversation thread, indexed both ways: the owner of each thread, and the threads of each
+    owner. Both are changed together by add() and remove() only, so finding, checking or removing the owner of a
+    thread takes the same time however many conversations are open.
+
+    It is persisted in the format of the user id to list of thread ids dict it replaces: snapshot() gives that dict,
+    and an index is built from one. take_changes() gives the owners whose threads changed since it was last called,
+    for the conversation journal.
+    """
+
+    def __init__(self, threads=None):
+        self.owners = {}
+        self.threads = {}
+        self.changed = set()
+        for user_id, thread_ids in (threads or {}).items():
+            for thread_id in thread_ids:
+                self.add(user_id, thread_id)
+        self.changed.clear()
+
+    def __contains__(self, thread_id):
+        return thread_id in self.owners
+
+    def __len__(self):
+        return len(self.owners)
+
+    def __iter__(self):
+        return iter(list(self.owners))
+
+    def owner(self, thread_id):
+        return self.owners.get(thread_id)
+
+    def owns(self, user_id, thread_id):
+        return thread_id in self.owners and self.owners[thread_id] == user_id
+
+    def threads_of(self, user_id):
+        return frozenset(self.threads.get(user_id, ()))
+
+    def add(self, user_id, thread_id):
+        """Make the user the owner of the thread, in place of its previous owner if it had one"""
+        self.remove(thread_id)
+        self.owners[thread_id] = user_id
+        self.threads.setdefault(user_id, set()).add(thread_id)
+        self.changed.add(user_id)
+
+    def remove(self, thread_id):
+        """Remove the thread from its owner, returns who that was (None if nobody owned it)"""
+        user_id = self.owners.pop(thread_id, None)
+        if user_id is not None:
+            threads = self.threads[user_id]
+            threads.discard(thread_id)
+            if not threads:
+                del self.threads[user_id]
+            self.changed.add(user_id)
+        return user_id
+
+    def set_threads(self, user_id, thread_ids):
+        """Make the given threads all the user owns"""
+        for thread_id in self.threads_of(user_id) - set(thread_ids):
+            self.remove(thread_id)
+        for thread_id in thread_ids:
+            self.add(user_id, thread_id)
+
+    def take_changes(self):
+        """The threads of each owner whose threads changed since the last call, as a sorted tuple"""
+        changes = {
+            user_id: tuple(sorted(self.threads.get(user_id, ())))
+            for user_id in self.changed
+        }
+        self.changed = set()
+        return changes
+
+    def snapshot(self):
+        return {user_id: sorted(threads) for user_id, threads in self.threads.items()}
@@ -1,15 +1,61 @@
 import asyncio
+import hashlib
+import lzma
+import os
 import pickle
-import traceback
+import time
+import zlib
 from datetime import datetime
 
-import aiofiles
 import discord
 
 from services.environment_service import EnvService
+from services.logging_service import PayloadLogger
+
+# zstd is optional, snapshots fall back to zlib without it
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+LOGGER = PayloadLogger("persistence")
+
+SNAPSHOT_COMPRESSION = EnvService.get_snapshot_compression()
+if SNAPSHOT_COMPRESSION == "zstd" and zstandard is None:
+    print("zstandard isn't installed, compressing the pickles with zlib instead")
+    SNAPSHOT_COMPRESSION = "zlib"
+
+# A snapshot is read back by its first bytes, whatever compression it was written with
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+LZMA_MAGIC = b"\xfd7zXZ"
+ZLIB_MAGIC = b"\x78"
+
+
+def compress(data, compression):
+    if compression == "zlib":
+        return zlib.compress(data)
+    if compression == "lzma":
+        return lzma.compress(data)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data):
+    if data.startswith(ZSTD_MAGIC):
+        return zstandard.ZstdDecompressor().decompress(data)
+    if data.startswith(LZMA_MAGIC):
+        return lzma.decompress(data)
+    if data.startswith(ZLIB_MAGIC):
+        return zlib.decompress(data)
+    # An uncompressed pickle, which starts with the PROTO opcode
+    return data
 
 
 class Pickler:
+    # The hash of each pickle as it was last written, a pickle that hasn't changed isn't written again
+    hashes = {}
+
     def __init__(
         self,
         full_conversation_history,
@@ -22,47 +68,83 @@ class Pickler:
         self.conversation_thread_owners = conversation_thread_owners
         self.instructions = instructions
 
-    # This function will be called by the bot to process the message queue
     @staticmethod
-    async def process_pickle_queue(pickle_queue, PROCESS_WAIT_TIME, EMPTY_WAIT_TIME):
-        while True:
-            try:
-                # If the queue is empty, sleep for a short time before checking again
-                if pickle_queue.empty():
-                    await asyncio.sleep(EMPTY_WAIT_TIME)
-                    continue
-
-                # Get the next object to pickle from the queue
-                to_pickle = await pickle_queue.get()
-
-                # Pickle all the objects inside to_pickle using aiofiles
-                async with aiofiles.open(
-                    EnvService.save_path()
-                    / "pickles"
-                    / "full_conversation_history.pickle",
-                    "wb",
-                ) as f:
-                    await f.write(pickle.dumps(to_pickle.full_conversation_history))
-
-                async with aiofiles.open(
-                    EnvService.save_path() / "pickles" / "conversation_threads.pickle",
-                    "wb",
-                ) as f:
-                    await f.write(pickle.dumps(to_pickle.conversation_threads))
-
-                async with aiofiles.open(
-                    EnvService.save_path()
-                    / "pickles"
-                    / "conversation_thread_owners.pickle",
-                    "wb",
-                ) as f:
-                    await f.write(pickle.dumps(to_pickle.conversation_thread_owners))
-
-                async with aiofiles.open(
-                    EnvService.save_path() / "pickles" / "instructions.pickle", "wb"
-                ) as f:
-                    await f.write(pickle.dumps(to_pickle.instructions))
-
-                await asyncio.sleep(PROCESS_WAIT_TIME)
-            except Exception:
-                traceback.print_exc()
+    def detach(obj):
+        """
+        A copy of a dict that can be pickled in another thread while the original keeps changing on the event loop.
+        Its lists are copied too, which is much cheaper than pickling them.
+        """
+        if not isinstance(obj, dict):
+            return obj
+        copy = obj.copy()
+        for key, value in copy.items():
+            if isinstance(value, list):
+                copy[key] = list(value)
+        return copy
+
+    @staticmethod
+    def dump(name, obj, compression=None):
+        """
+        Pickle obj to the pickles folder, through a temporary file so a crash never leaves a torn pickle. Blocking,
+        run in a worker thread. Returns the timings and sizes of the snapshot.
+        """
+        compression = SNAPSHOT_COMPRESSION if compression is None else compression
+        started = time.perf_counter()
+        data = pickle.dumps(obj)
+        serialized = time.perf_counter()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        stats = {
+            "bytes": len(data),
+            "serialize_ms": round((serialized - started) * 1000, 1),
+        }
+        if Pickler.hashes.get(name) == digest:
+            stats["skipped"] = True
+            return stats
+
+        data = compress(data, compression)
+        compressed = time.perf_counter()
+        path = EnvService.save_path() / "pickles" / f"{name}.pickle"
+        temporary_path = path.with_suffix(".pickle.tmp")
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+        Pickler.hashes[name] = digest
+
+        stats["written_bytes"] = len(data)
+        stats["compress_ms"] = round((compressed - serialized) * 1000, 1)
+        stats["write_ms"] = round((time.perf_counter() - compressed) * 1000, 1)
+        return stats
+
+    @staticmethod
+    async def write(name, obj):
+        started = time.perf_counter()
+        stats = await asyncio.to_thread(Pickler.dump, name, Pickler.detach(obj))
+        stats["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        LOGGER.info(
+            "Snapshot of %s: %s",
+            name,
+            ", ".join(f"{key}={value}" for key, value in stats.items()),
+        )
+        return stats
+
+    async def save(self):
+        # Anything given as None is saved somewhere else
+        for name in (
+            "full_conversation_history",
+            "conversation_threads",
+            "conversation_thread_owners",
+            "instructions",
+        ):
+            if getattr(self, name) is not None:
+                await self.write(name, getattr(self, name))
+
+    @staticmethod
+    def read(path):
+        """Unpickle an object from a file, compressed or not, blocking, best run in a thread"""
+        with open(path, "rb") as f:
+            return pickle.loads(decompress(f.read()))
+
+    @staticmethod
+    def load(name):
+        """Unpickle an object from the pickles folder, compressed or not, blocking, best run in a thread"""
+        return Pickler.read(EnvService.save_path() / "pickles" / f"{name}.pickle")
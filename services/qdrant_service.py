@@ -1,5 +1,5 @@
 import asyncio
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 
 class QdrantService:
     def __init__(self, client, collection_name):
@@ -29,10 +29,8 @@ class QdrantService:
         if len(text) > 500:
             # Split the text into chunks
             chunks = [text[i : i + 500] for i in range(0, len(text), 500)]
-            embeddings = []
-            for chunk in chunks:
-                embedding = await model.send_embedding_request(chunk, custom_api_key=custom_api_key)
-                embeddings.append(embedding)
+            # Requested together so the chunks are embedded in a single batched call
+            embeddings = await model.send_embedding_requests(chunks, custom_api_key=custom_api_key)
             # Upsert embeddings
             await self.upsert_basic(chunks, embeddings, [conversation_id]*len(chunks))
         else:
@@ -113,4 +111,32 @@ class QdrantService:
 
         # Sort on timestamp (consider if your payload does include 'timestamp' and it's relevant for sorting)
         phrases.sort(key=lambda x: x[1])
-        return [phrase[0] for phrase in phrases]
\ No newline at end of file
+        return [phrase[0] for phrase in phrases]
+
+    async def delete_conversation(self, conversation_id: int):
+        # The points are upserted with the conversation id as their id, points that carry it in their payload
+        # instead are matched by a filter
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            lambda: self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.PointIdsList(points=[conversation_id]),
+            ),
+        )
+        await loop.run_in_executor(
+            None,
+            lambda: self.client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.FilterSelector(
+                    filter=models.Filter(
+                        must=[
+                            models.FieldCondition(
+                                key="conversation_id",
+                                match=models.MatchValue(value=conversation_id),
+                            )
+                        ]
+                    )
+                ),
+            ),
+        )
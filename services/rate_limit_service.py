@@ -0,0 +1,227 @@
+import asyncio
+import re
+import time
+import traceback
+
+from services.environment_service import EnvService
+from services.usage_service import UsageService
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value):
+    """Parse the x-ratelimit-reset-* header format, e.g. "20ms", "1s" or "6m0s", into seconds"""
+    if value is None:
+        return None
+    matches = DURATION_PATTERN.findall(str(value))
+    if not matches:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in matches)
+
+
+class TokenBucket:
+    """
+    A bucket that refills continuously at `limit` units per minute, like the OpenAI rate limits do.
+    The limit is unknown until the API tells us about it, until then the bucket never blocks.
+    """
+
+    def __init__(self):
+        self.limit = None
+        self.remaining = None
+        self.updated_at = time.monotonic()
+
+    @property
+    def known(self):
+        return self.limit is not None and self.remaining is not None
+
+    def refill(self, now):
+        if not self.known:
+            return
+        rate = self.limit / 60
+        self.remaining = min(
+            self.limit, self.remaining + (now - self.updated_at) * rate
+        )
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available, 0 if they are available now"""
+        if not self.known:
+            return 0
+        # A single request bigger than the whole budget can only ever go through on a full bucket
+        amount = min(amount, self.limit)
+        if self.remaining >= amount:
+            return 0
+        return (amount - self.remaining) / (self.limit / 60)
+
+    def charge(self, amount):
+        if self.known:
+            self.remaining -= amount
+
+    def update(self, limit, remaining, reset_seconds, now):
+        if limit is not None:
+            self.limit = limit
+        if remaining is None:
+            return
+        if self.limit is None:
+            self.limit = remaining
+        self.remaining = remaining
+        self.updated_at = now
+        # If the API says the bucket is exhausted, don't let the continuous refill get ahead of the reset time
+        if remaining <= 0 and reset_seconds:
+            self.updated_at = now + reset_seconds - 60 / max(self.limit, 1)
+
+
+class ModelRateLimit:
+    """The request and token budgets of one API key for one model"""
+
+    def __init__(self):
+        self.requests = TokenBucket()
+        self.tokens = TokenBucket()
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.waits = 0
+        self.total_wait_time = 0.0
+
+    @property
+    def known(self):
+        return self.requests.known or self.tokens.known
+
+
+class RateLimiter:
+    """
+    Per API key and per model limiter for the requests-per-minute and tokens-per-minute budgets.
+
+    The budgets are learned from the x-ratelimit-* response headers. Before a request is sent its estimated
+    tokens are charged against the budget, and if there isn't enough left, the request queues until the
+    bucket has refilled instead of being sent into a 429.
+    """
+
+    def __init__(self, token_counter=None, max_wait=None):
+        self.token_counter = (
+            token_counter
+            if token_counter is not None
+            else UsageService.count_tokens_static
+        )
+        self.max_wait = (
+            EnvService.get_rate_limit_max_wait() if max_wait is None else max_wait
+        )
+        self.limits = {}
+
+    def get_limit(self, api_key, model) -> ModelRateLimit:
+        key = (api_key, model)
+        if key not in self.limits:
+            self.limits[key] = ModelRateLimit()
+        return self.limits[key]
+
+    def is_limited(self, api_key, model):
+        """Whether we know the budget for this key and model yet, there's no need to estimate tokens otherwise"""
+        key = (api_key, model)
+        return key in self.limits and self.limits[key].known
+
+    def estimate_tokens(self, payload):
+        """Estimate the tokens a request payload will consume, the prompt plus the requested completion"""
+        texts = []
+        if "messages" in payload:
+            for message in payload["messages"]:
+                content = message.get("content")
+                if isinstance(content, str):
+                    texts.append(content)
+                elif isinstance(content, list):
+                    texts.extend(part.get("text", "") for part in content)
+        for field in ("prompt", "input", "instruction"):
+            value = payload.get(field)
+            if isinstance(value, str):
+                texts.append(value)
+            elif isinstance(value, list):
+                texts.extend(item for item in value if isinstance(item, str))
+        return self.token_counter("".join(texts)) + int(payload.get("max_tokens") or 0)
+
+    async def acquire(self, api_key, model, tokens=0):
+        """Wait until the budget allows a request of `tokens` tokens, then charge it"""
+        limit = self.get_limit(api_key, model)
+        if not limit.known:
+            return 0
+
+        waited = 0.0
+        limit.waiting += 1
+        try:
+            # Requests for the same key and model queue up in order behind this lock
+            async with limit.lock:
+                while True:
+                    now = time.monotonic()
+                    limit.requests.refill(now)
+                    limit.tokens.refill(now)
+                    wait = max(
+                        limit.requests.wait_time(1), limit.tokens.wait_time(tokens)
+                    )
+                    if wait <= 0 or waited >= self.max_wait:
+                        break
+                    wait = min(wait, self.max_wait - waited)
+                    await asyncio.sleep(wait)
+                    waited += wait
+
+                limit.requests.charge(1)
+                limit.tokens.charge(tokens)
+        finally:
+            limit.waiting -= 1
+
+        if waited > 0:
+            limit.waits += 1
+            limit.total_wait_time += waited
+            print(
+                f"Rate limiter held a {model} request for {waited:0.2f} seconds ({tokens} tokens estimated)"
+            )
+        return waited
+
+    def update_from_headers(self, api_key, model, headers):
+        """Update the budgets from the x-ratelimit-* headers of an API response"""
+        if headers is None or "x-ratelimit-remaining-requests" not in headers:
+            return
+        try:
+            now = time.monotonic()
+            limit = self.get_limit(api_key, model)
+            limit.requests.update(
+                self._int_header(headers, "x-ratelimit-limit-requests"),
+                self._int_header(headers, "x-ratelimit-remaining-requests"),
+                parse_reset_duration(headers.get("x-ratelimit-reset-requests")),
+                now,
+            )
+            limit.tokens.update(
+                self._int_header(headers, "x-ratelimit-limit-tokens"),
+                self._int_header(headers, "x-ratelimit-remaining-tokens"),
+                parse_reset_duration(headers.get("x-ratelimit-reset-tokens")),
+                now,
+            )
+        except Exception:
+            traceback.print_exc()
+
+    @staticmethod
+    def _int_header(headers, name):
+        value = headers.get(name)
+        return int(value) if value is not None else None
+
+    def get_stats(self):
+        stats = {}
+        for (api_key, model), limit in self.limits.items():
+            label = f"{model} (key ...{str(api_key)[-4:]})"
+            stats[label] = (
+                f"requests left {self._format(limit.requests)}, "
+                f"tokens left {self._format(limit.tokens)}, "
+                f"queued {limit.waiting}, held {limit.waits} times for {limit.total_wait_time:0.1f}s"
+            )
+        return stats
+
+    @staticmethod
+    def _format(bucket):
+        if not bucket.known:
+            return "unknown"
+        bucket.refill(time.monotonic())
+        return f"{int(bucket.remaining)}/{bucket.limit}"
+
+
+# Budgets are per API key, so every model instance in the process shares one limiter
+RATE_LIMITER = RateLimiter()
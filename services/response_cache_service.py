@@ -0,0 +1,93 @@
+import copy
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+from services.environment_service import EnvService
+
+
+class ResponseCache:
+    """
+    An LRU cache of API responses with a time to live, keyed by a fingerprint of the request.
+
+    Only meant for requests whose answer doesn't change between calls, e.g. ones sent with a temperature of 0.
+    """
+
+    # Fields of a request payload that decide what the response will be
+    FINGERPRINT_FIELDS = (
+        "model",
+        "messages",
+        "prompt",
+        "stop",
+        "temperature",
+        "top_p",
+        "presence_penalty",
+        "frequency_penalty",
+        "max_tokens",
+        "best_of",
+    )
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = EnvService.get_response_cache_ttl() if ttl is None else ttl
+        self.max_entries = (
+            EnvService.get_response_cache_size() if max_entries is None else max_entries
+        )
+        self.entries = OrderedDict()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def normalize(value):
+        if isinstance(value, str):
+            return " ".join(value.split())
+        if isinstance(value, list):
+            return [ResponseCache.normalize(item) for item in value]
+        if isinstance(value, dict):
+            return {key: ResponseCache.normalize(item) for key, item in value.items()}
+        return value
+
+    def fingerprint(self, payload):
+        """A stable hash of the parts of the request that determine the response"""
+        request = {
+            field: self.normalize(payload.get(field))
+            for field in self.FINGERPRINT_FIELDS
+            if payload.get(field) is not None
+        }
+        encoded = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, response = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        # Callers are free to modify what they get back
+        return copy.deepcopy(response)
+
+    def put(self, key, response):
+        self.entries[key] = (time.monotonic() + self.ttl, copy.deepcopy(response))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": len(self.entries),
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
+import time
+
+from services.environment_service import EnvService
+
+
+class Priority:
+    """Classes of outbound API work, a lower value is more important"""
+
+    INTERACTIVE = 0
+    MODERATION = 1
+    SUMMARIZATION = 2
+    BULK = 3
+
+    NAMES = {
+        INTERACTIVE: "interactive",
+        MODERATION: "moderation",
+        SUMMARIZATION: "summarization",
+        BULK: "indexing/bulk",
+    }
+
+
+# The class of the work the current task is doing, requests made without one are someone waiting on a reply
+current_priority = contextvars.ContextVar(
+    "current_priority", default=Priority.INTERACTIVE
+)
+# Whether the current task already runs inside a slot, nested requests then don't need one of their own
+holding_slot = contextvars.ContextVar("holding_slot", default=False)
+
+
+class Waiter:
+    def __init__(self, priority, sequence, future):
+        self.priority = priority
+        self.sequence = sequence
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class ClassStats:
+    def __init__(self):
+        self.running = 0
+        self.queued = 0
+        self.served = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class PriorityScheduler:
+    """
+    Hands out slots for outbound API work by priority class.
+
+    The most important waiting work goes first, each class is capped in how much of it can run at the same time,
+    and the last few slots are reserved for interactive work so replies to users stay fast when the bot is busy.
+    Waiting work gains one level of priority per aging interval, so background work can't starve.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=None,
+        class_limits=None,
+        interactive_reserve=None,
+        aging_interval=None,
+    ):
+        self.max_concurrency = (
+            EnvService.get_scheduler_max_concurrency()
+            if max_concurrency is None
+            else max_concurrency
+        )
+        self.class_limits = (
+            {
+                Priority.INTERACTIVE: self.max_concurrency,
+                Priority.MODERATION: EnvService.get_scheduler_moderation_limit(),
+                Priority.SUMMARIZATION: EnvService.get_scheduler_summarization_limit(),
+                Priority.BULK: EnvService.get_scheduler_bulk_limit(),
+            }
+            if class_limits is None
+            else class_limits
+        )
+        self.interactive_reserve = (
+            EnvService.get_scheduler_interactive_reserve()
+            if interactive_reserve is None
+            else interactive_reserve
+        )
+        self.aging_interval = (
+            EnvService.get_scheduler_aging_interval()
+            if aging_interval is None
+            else aging_interval
+        )
+
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.stats = {priority: ClassStats() for priority in Priority.NAMES}
+
+    @property
+    def running(self):
+        return sum(stats.running for stats in self.stats.values())
+
+    def _has_capacity(self, priority):
+        limit = self.max_concurrency
+        if priority != Priority.INTERACTIVE:
+            limit -= self.interactive_reserve
+        return (
+            self.running < limit
+            and self.stats[priority].running < self.class_limits[priority]
+        )
+
+    def _effective_priority(self, waiter, now):
+        return waiter.priority - (now - waiter.enqueued_at) / self.aging_interval
+
+    def _grant(self, priority, waited):
+        stats = self.stats[priority]
+        stats.running += 1
+        stats.served += 1
+        stats.total_wait += waited
+        stats.max_wait = max(stats.max_wait, waited)
+
+    def _dispatch(self):
+        """Start waiting work for as long as there are free slots, most important (after aging) first"""
+        while self.waiters:
+            now = time.monotonic()
+            eligible = [
+                waiter
+                for waiter in self.waiters
+                if not waiter.future.done() and self._has_capacity(waiter.priority)
+            ]
+            if not eligible:
+                return
+            waiter = min(
+                eligible,
+                key=lambda w: (self._effective_priority(w, now), w.sequence),
+            )
+            self.waiters.remove(waiter)
+            self.stats[waiter.priority].queued -= 1
+            self._grant(waiter.priority, now - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    async def acquire(self, priority=None):
+        """
+        Wait for a slot, returns the class the slot was taken for, to be given back to release().
+        Returns None without waiting if the current task already holds a slot.
+        """
+        if holding_slot.get():
+            return None
+        if priority is None:
+            priority = current_priority.get()
+
+        if not self.waiters and self._has_capacity(priority):
+            self._grant(priority, 0.0)
+            return priority
+
+        waiter = Waiter(
+            priority, next(self.sequence), asyncio.get_running_loop().create_future()
+        )
+        self.waiters.append(waiter)
+        self.stats[priority].queued += 1
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                self.stats[priority].queued -= 1
+            elif not waiter.future.cancelled():
+                # The slot was granted just as we were cancelled, hand it on
+                self.release(priority)
+            raise
+        return priority
+
+    def release(self, priority):
+        if priority is None:
+            return
+        self.stats[priority].running -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=None):
+        """Hold a slot for a block of work, requests made inside it don't need a slot of their own"""
+        granted = await self.acquire(priority)
+        token = holding_slot.set(True)
+        try:
+            yield
+        finally:
+            holding_slot.reset(token)
+            self.release(granted)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def priority(priority):
+        """Run the requests made inside this block, and tasks started from it, as the given class of work"""
+        token = current_priority.set(priority)
+        try:
+            yield
+        finally:
+            current_priority.reset(token)
+
+    def get_stats(self):
+        stats = {}
+        for priority, name in Priority.NAMES.items():
+            class_stats = self.stats[priority]
+            average_wait = (
+                class_stats.total_wait / class_stats.served
+                if class_stats.served
+                else 0.0
+            )
+            stats[name] = (
+                f"running {class_stats.running}/{self.class_limits[priority]}, "
+                f"queued {class_stats.queued}, served {class_stats.served}, "
+                f"wait avg {average_wait:0.2f}s max {class_stats.max_wait:0.2f}s"
+            )
+        return stats
+
+
+def scheduled(priority):
+    """Decorator running a coroutine as one slot of the given class of work"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            with SCHEDULER.priority(priority):
+                async with SCHEDULER.slot(priority):
+                    return await function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# One scheduler for the whole process, since all of its work shares the same API quota
+SCHEDULER = PriorityScheduler()
@@ -0,0 +1,68 @@
+import asyncio
+import copy
+import functools
+
+
+class SingleFlight:
+    """
+    Makes concurrent identical calls share one execution. The first caller starts the call, everyone who asks
+    for the same key while it is in flight waits on it and gets (a copy of) the same result or exception.
+    """
+
+    def __init__(self):
+        self.in_flight = {}
+        self.followers = {}
+
+        # Statistics
+        self.calls = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _retrieve_exception(task):
+        # Nobody may be left waiting on the call, don't let asyncio complain about an unretrieved exception
+        if not task.cancelled():
+            task.exception()
+
+    async def run(self, key, factory):
+        """Run factory() for this key, unless a call for the same key is already in flight"""
+        task = self.in_flight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            self.followers[task] = self.followers.get(task, 0) + 1
+            return copy.deepcopy(await asyncio.shield(task))
+
+        self.calls += 1
+        task = asyncio.ensure_future(factory())
+        self.in_flight[key] = task
+        task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        task.add_done_callback(self._retrieve_exception)
+        try:
+            # A caller that is cancelled must not cancel the call for the others waiting on it
+            result = await asyncio.shield(task)
+        finally:
+            followers = self.followers.pop(task, 0)
+        # Everyone gets their own copy of a shared result, they may modify what they get back
+        return copy.deepcopy(result) if followers else result
+
+    def get_stats(self):
+        return {
+            "calls_sent": self.calls,
+            "calls_coalesced": self.coalesced,
+            "in_flight": len(self.in_flight),
+        }
+
+
+def single_flight(method):
+    """
+    Decorator for the API request methods of the Model, identical requests that are in flight at the same time
+    are only sent (and their usage charged) once. The request is identified by the method and its arguments.
+    """
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        key = repr((method.__name__, args, sorted(kwargs.items())))
+        return await self.single_flight.run(
+            key, functools.partial(method, self, *args, **kwargs)
+        )
+
+    return wrapper
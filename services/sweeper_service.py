@@ -0,0 +1,166 @@
+import asyncio
+import time
+import traceback
+
+from services.environment_service import EnvService
+from services.logging_service import PayloadLogger
+
+LOGGER = PayloadLogger("conversations")
+
+
+class ConversationSweeper:
+    """
+    Expires the conversations of the text cog that were never ended, which would otherwise be kept (and stored)
+    forever: a conversation whose thread was deleted or locked is expired right away, one whose thread has been
+    archived for a while, or that hasn't been used for a long time, by the next sweep. Threads are archived by
+    Discord after an hour without messages, so an archived thread gets some time to be picked up again first.
+
+    Expiring a conversation removes everything the text cog keeps for it: the thread and its full texts, the
+    thread's owner, the redo state and button interactions of the responses in it and its Qdrant points.
+    """
+
+    def __init__(self, ttl=None, archived_ttl=None, interval=None):
+        self.ttl = EnvService.get_conversation_ttl_seconds() if ttl is None else ttl
+        self.archived_ttl = (
+            EnvService.get_conversation_archived_ttl_seconds()
+            if archived_ttl is None
+            else archived_ttl
+        )
+        self.interval = (
+            EnvService.get_conversation_sweep_interval()
+            if interval is None
+            else interval
+        )
+
+        # When each conversation thread that is archived was archived
+        self.archived = {}
+        # The conversations to expire once the response being generated in them is sent, and why
+        self.deferred = {}
+        # The threads owned without a conversation at the last sweep
+        self.orphans = set()
+
+        # Statistics
+        self.expired = {"idle": 0, "archived": 0, "locked": 0, "deleted": 0}
+        self.reclaimed_bytes = 0
+        self.orphaned_owners = 0
+
+    def thread_archived(self, thread_id):
+        self.archived.setdefault(thread_id, time.time())
+
+    def thread_unarchived(self, thread_id):
+        self.archived.pop(thread_id, None)
+
+    async def expire(self, converser_cog, thread_id, reason):
+        """End a conversation without a word in its thread, returns whether it was expired"""
+        reclaimed_bytes = 0
+        if (
+            thread_id in converser_cog.conversation_threads
+            and thread_id not in converser_cog.awaiting_thread_responses
+        ):
+            # Measured before anything is checked, the conversation may be used again meanwhile
+            reclaimed_bytes = await self.stored_bytes(converser_cog, thread_id)
+        if thread_id in converser_cog.awaiting_thread_responses:
+            # An idle or archived conversation that is in use again is looked at anew by the next sweep
+            if reason in ("locked", "deleted"):
+                self.deferred[thread_id] = reason
+            return False
+        self.deferred.pop(thread_id, None)
+        self.archived.pop(thread_id, None)
+        if thread_id not in converser_cog.conversation_threads:
+            return False
+
+        del converser_cog.conversation_threads[thread_id]
+        converser_cog.conversation_inbox.discard(thread_id)
+        converser_cog.full_conversation_history.discard(thread_id)
+        converser_cog.conversation_thread_owners.remove(thread_id)
+        self.forget_interactions(converser_cog, thread_id)
+
+        if converser_cog.qdrant_service:
+            try:
+                await converser_cog.qdrant_service.delete_conversation(thread_id)
+            except Exception:
+                traceback.print_exc()
+
+        self.expired[reason] += 1
+        self.reclaimed_bytes += reclaimed_bytes
+        LOGGER.info(
+            "Expired conversation %s (%s), reclaimed %d bytes",
+            thread_id,
+            reason,
+            reclaimed_bytes,
+        )
+        return True
+
+    @staticmethod
+    async def stored_bytes(converser_cog, thread_id):
+        """The size of a conversation in the DB, measured in a worker thread"""
+        return await asyncio.to_thread(
+            lambda: converser_cog.conversation_threads.stored_bytes(thread_id)
+            + converser_cog.full_conversation_history.stored_bytes(thread_id)
+        )
+
+    @staticmethod
+    def forget_interactions(converser_cog, thread_id):
+        """Drop the redo state of the responses in a thread, and the interactions of their buttons"""
+        for user_id, redo_user in list(converser_cog.redo_users.items()):
+            channel = getattr(redo_user.ctx, "channel", None)
+            if getattr(channel, "id", None) != thread_id:
+                continue
+            del converser_cog.redo_users[user_id]
+            interactions = converser_cog.users_to_interactions.get(user_id)
+            if interactions:
+                interactions[:] = [
+                    interaction
+                    for interaction in interactions
+                    if interaction not in redo_user.interactions
+                ]
+                if not interactions:
+                    del converser_cog.users_to_interactions[user_id]
+
+    async def sweep(self, converser_cog):
+        """Expire the conversations that are due, returns how many were"""
+        now = time.time()
+        expired = 0
+        for thread_id, reason in list(self.deferred.items()):
+            expired += await self.expire(converser_cog, thread_id, reason)
+        for thread_id, archived_at in list(self.archived.items()):
+            if archived_at <= now - self.archived_ttl:
+                expired += await self.expire(converser_cog, thread_id, "archived")
+        if self.ttl > 0:
+            last_active = converser_cog.conversation_threads.last_active
+            for thread_id, active_at in list(last_active.items()):
+                if active_at <= now - self.ttl:
+                    expired += await self.expire(converser_cog, thread_id, "idle")
+
+        # Owners of conversations that no longer exist, e.g. left behind by a failed start. Only those seen at the
+        # last sweep too, a conversation being ended is briefly owned without existing
+        threads = converser_cog.conversation_threads
+        orphans = {
+            thread_id
+            for thread_id in converser_cog.conversation_thread_owners
+            if thread_id not in threads
+        }
+        for thread_id in orphans & self.orphans:
+            converser_cog.conversation_thread_owners.remove(thread_id)
+            self.orphaned_owners += 1
+        self.orphans = orphans - self.orphans
+        return expired
+
+    async def run(self, converser_cog):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                expired = await self.sweep(converser_cog)
+                if expired:
+                    print(f"Expired {expired} abandoned conversations")
+            except Exception:
+                traceback.print_exc()
+
+    def get_stats(self):
+        return {
+            **{f"expired_{reason}": count for reason, count in self.expired.items()},
+            "reclaimed_bytes": self.reclaimed_bytes,
+            "orphaned_owners": self.orphaned_owners,
+            "archived_threads": len(self.archived),
+            "deferred": len(self.deferred),
+        }
@@ -16,16 +16,96 @@ from models.embed_statics_model import EmbedStatics
 from models.image_understanding_model import ImageUnderstandingModel
 from services.deletion_service import Deletion
 from models.openai_model import Model, Override, Models
-from models.user_model import EmbeddedConversationItem, RedoUser
+from models.user_model import EmbeddedConversationItem, RedoUser, render_prompt
 from services.environment_service import EnvService
 from services.moderations_service import Moderation
+from services.tokenizer_service import TOKENIZERS
+from services.context_builder_service import CONTEXT_BUILDER, ContextBuilder
 
 BOT_NAME = EnvService.get_custom_bot_name()
 PRE_MODERATE = EnvService.get_premoderate()
 image_understanding_model = ImageUnderstandingModel()
 
+# Discord allows roughly 5 edits per 5 seconds on a channel, stay comfortably below that while streaming.
+STREAM_EDIT_INTERVAL = 1.5
+
+
+class StreamedReply:
+    """
+    Posts a reply as soon as the first tokens of a streamed completion arrive and keeps editing it as more come
+    in. When the text crosses the cutoff, the current message is left as is and the rest continues in a new message.
+    """
+
+    def __init__(self, ctx, text_cutoff, cleanse, edit_interval=STREAM_EDIT_INTERVAL):
+        self.ctx = ctx
+        self.text_cutoff = text_cutoff
+        self.cleanse = cleanse
+        self.edit_interval = edit_interval
+        self.messages = []
+        self.sent_chunks = []
+        self.last_edit = 0
+
+    def render(self, text):
+        text = discord.utils.escape_mentions(self.cleanse(text))
+        return [
+            text[i : i + self.text_cutoff]
+            for i in range(0, len(text), self.text_cutoff)
+        ] or ["..."]
+
+    async def show(self, chunks, view=None):
+        for number, chunk in enumerate(chunks):
+            # The conversation buttons only go on the last message
+            extra = {"view": view} if view and number == len(chunks) - 1 else {}
+            if number >= len(self.messages):
+                if number == 0:
+                    message = await self.ctx.reply(chunk, **extra)
+                else:
+                    message = await self.ctx.channel.send(chunk, **extra)
+                self.messages.append(message)
+                self.sent_chunks.append(chunk)
+            elif self.sent_chunks[number] != chunk or extra:
+                await self.messages[number].edit(content=chunk, **extra)
+                self.sent_chunks[number] = chunk
+
+    async def consume(self, stream):
+        """Relay the stream to discord, returns the response once the stream is exhausted"""
+        loop = asyncio.get_running_loop()
+        async for _ in stream:
+            if loop.time() - self.last_edit < self.edit_interval:
+                continue
+            try:
+                await self.show(self.render(stream.text))
+            except discord.HTTPException:
+                # Hit a rate limit or a transient error, the next edit or the final one will catch up
+                traceback.print_exc()
+            self.last_edit = loop.time()
+        return stream.response
+
+    async def finalize(self, response_text, view=None):
+        """Make the posted messages match the final response text, returns the last message"""
+        chunks = [
+            response_text[i : i + self.text_cutoff]
+            for i in range(0, len(response_text), self.text_cutoff)
+        ] or ["..."]
+        await self.show(chunks, view=view)
+
+        # The cleaned up final text can be shorter than what was streamed, drop any leftover messages
+        for message in self.messages[len(chunks) :]:
+            try:
+                await message.delete()
+            except discord.HTTPException:
+                pass
+        del self.messages[len(chunks) :], self.sent_chunks[len(chunks) :]
+        return self.messages[-1]
+
 
 class TextService:
+    # Why a message sent to a conversation is turned away
+    USER_BUSY = (
+        "You are already waiting for a response, please wait and speak afterwards."
+    )
+    THREAD_BUSY = "This thread is already waiting for a response, please wait and speak afterwards."
+
     def __init__(self):
         pass
 
@@ -56,6 +136,45 @@ class TextService:
         except:
             pass
 
+    @staticmethod
+    async def hold_follow_up(converser_cog, message, content, files=None):
+        """Hold a message sent to a busy thread to answer it later, returns False if it can't be held"""
+        if not converser_cog.model.queue_follow_ups:
+            return False
+        if not converser_cog.conversation_inbox.put(
+            message.channel.id, message, content, files
+        ):
+            return False
+        try:
+            await message.add_reaction("📥")
+        except Exception:
+            pass
+        return True
+
+    @staticmethod
+    async def turn_away(converser_cog, message, title):
+        """Tell the author of a message sent to a busy conversation to wait, then delete both messages"""
+        resp_message = await message.reply(
+            embed=discord.Embed(
+                title=title,
+                color=0x808080,
+            )
+        )
+        try:
+            await resp_message.channel.trigger_typing()
+        except:
+            pass
+
+        # get the current date, add 10 seconds to it, and then turn it into a timestamp.
+        # we need to use our deletion service because this isn't an interaction, it's a regular message.
+        deletion_time = datetime.datetime.now() + datetime.timedelta(seconds=5)
+        deletion_time = deletion_time.timestamp()
+
+        deletion_message = Deletion(resp_message, deletion_time)
+        deletion_original_message = Deletion(message, deletion_time)
+        await converser_cog.deletion_queue.put(deletion_message)
+        await converser_cog.deletion_queue.put(deletion_original_message)
+
     @staticmethod
     async def encapsulated_send(
         converser_cog,
@@ -109,12 +228,16 @@ class TextService:
 
         from_context = isinstance(ctx, discord.ApplicationContext)
 
-        if not instruction:
-            tokens = converser_cog.usage_service.count_tokens(new_prompt)
+        # A conversation prompt is the thread's history, whose token count is kept up to date as it grows
+        await converser_cog.conversation_threads.ensure_loaded(id)
+        if id in converser_cog.conversation_threads:
+            tokens = converser_cog.conversation_threads[id].get_prompt_tokens(
+                new_prompt, BOT_NAME
+            )
         else:
-            tokens = converser_cog.usage_service.count_tokens(
-                new_prompt
-            ) + converser_cog.usage_service.count_tokens(instruction)
+            tokens = await TOKENIZERS.count_async(new_prompt)
+        if instruction:
+            tokens += await TOKENIZERS.count_async(instruction)
 
         try:
             user_displayname = (
@@ -157,29 +280,26 @@ class TextService:
                     )
 
                 if edited_request:
-                    new_prompt = "".join(
-                        [
-                            item.text
-                            for item in converser_cog.conversation_threads[
-                                ctx.channel.id
-                            ].history
-                        ]
+                    new_prompt = render_prompt(
+                        converser_cog.conversation_threads[ctx.channel.id].history
                     )
                     converser_cog.redo_users[ctx.author.id].prompt = new_prompt
                 else:
-                    # Create and upsert the embedding for  the conversation id, prompt, timestamp
-                    await converser_cog.qdrant_service.upsert_conversation_embedding(
-                        converser_cog.model,
-                        conversation_id,
-                        new_prompt,
-                        timestamp,
-                        custom_api_key=custom_api_key,
+                    # Create and upsert the embedding for  the conversation id, prompt, timestamp, and embed the
+                    # version of the prompt without the author's name for better clarity on retrieval. Both are
+                    # requested together so that their embeddings go out in one batched API call.
+                    _, embedding_prompt_less_author = await asyncio.gather(
+                        converser_cog.qdrant_service.upsert_conversation_embedding(
+                            converser_cog.model,
+                            conversation_id,
+                            new_prompt,
+                            timestamp,
+                            custom_api_key=custom_api_key,
+                        ),
+                        converser_cog.model.send_embedding_request(
+                            prompt_less_author, custom_api_key=custom_api_key
+                        ),
                     )
-                    # Print all phrases
-
-                    embedding_prompt_less_author = await converser_cog.model.send_embedding_request(
-                        prompt_less_author, custom_api_key=custom_api_key
-                    )  # Use the version of the prompt without the author's name for better clarity on retrieval.
 
                     # Now, build the new prompt by getting the X most similar with qdrant
                     similar_prompts = await converser_cog.qdrant_service.get_n_similar(
@@ -248,13 +368,11 @@ class TextService:
                             pass
                         _prompt_with_history.append(new_prompt_item)
 
-                    prompt_with_history = "".join(
-                        [item.text for item in _prompt_with_history]
-                    )
+                    prompt_with_history = render_prompt(_prompt_with_history)
 
                     new_prompt = prompt_with_history + "\n" + BOT_NAME
 
-                tokens = converser_cog.usage_service.count_tokens(new_prompt)
+                tokens = await TOKENIZERS.count_async(new_prompt)
 
             # No Qdrant, we do conversation summarization for long term memory instead
             elif (
@@ -265,9 +383,28 @@ class TextService:
                 and not converser_cog.qdrant_service
                 # This should only happen if we are not doing summarizations.
             ):
+                # First try to make room by trimming the oldest turns, this needs no request to the model
+                selection = None
+                if converser_cog.model.trim_conversations:
+                    thread = converser_cog.conversation_threads[id]
+                    selection = CONTEXT_BUILDER.trim(
+                        thread,
+                        ContextBuilder.get_budget(
+                            model or converser_cog.model.model,
+                            limit=converser_cog.model.summarize_threshold,
+                        ),
+                        extra_tokens=max(0, tokens - thread.token_count),
+                    )
+                    print(
+                        f"Trimmed the context of conversation {id}: {selection.describe()}"
+                    )
+
                 # We don't need to worry about the differences between interactions and messages in this block,
                 # because if we are in this block, we can only be using a message object for ctx
-                if converser_cog.model.summarize_conversations:
+                if selection is not None and selection.fits:
+                    new_prompt = render_prompt(thread.history, BOT_NAME)
+                    tokens = selection.tokens
+                elif converser_cog.model.summarize_conversations:
                     summarizing_message = await ctx.reply(
                         "I'm currently summarizing our current conversation so we can keep chatting, "
                         "give me one moment!"
@@ -281,20 +418,16 @@ class TextService:
                         pass
 
                     # Check again if the prompt is about to go past the token limit
-                    new_prompt = (
-                        "".join(
-                            [
-                                item.text
-                                for item in converser_cog.conversation_threads[
-                                    id
-                                ].history
-                            ]
-                        )
-                        + "\n"
-                        + BOT_NAME
+                    new_prompt = render_prompt(
+                        converser_cog.conversation_threads[id].history,
+                        "\n" + BOT_NAME,
                     )
 
-                    tokens = converser_cog.usage_service.count_tokens(new_prompt)
+                    tokens = converser_cog.conversation_threads[
+                        id
+                    ].token_count + converser_cog.usage_service.count_tokens(
+                        "\n" + BOT_NAME
+                    )
 
                     if (
                         tokens > converser_cog.model.summarize_threshold
@@ -343,16 +476,47 @@ class TextService:
             if ctx.author.id in converser_cog.instructions:
                 system_instruction = converser_cog.instructions[ctx.author.id].prompt
                 usage_message = "***Added user instruction to prompt***"
-                tokens += converser_cog.usage_service.count_tokens(system_instruction)
+                tokens += converser_cog.instructions[ctx.author.id].token_count()
             elif ctx.channel.id in converser_cog.instructions:
                 system_instruction = converser_cog.instructions[ctx.channel.id].prompt
                 usage_message = "***Added channel instruction to prompt***"
-                tokens += converser_cog.usage_service.count_tokens(system_instruction)
+                tokens += converser_cog.instructions[ctx.channel.id].token_count()
             else:
                 system_instruction = None
                 usage_message = None
 
-            if is_chatgpt_conversation:
+            streamed_reply = None
+            if (
+                is_chatgpt_conversation
+                and converser_cog.model.stream_responses
+                and not from_context
+                and not response_message
+            ):
+                # Stream the response, posting it early and editing it as the tokens arrive
+                _prompt_with_history = converser_cog.conversation_threads[
+                    ctx.channel.id
+                ].history
+                stream = await converser_cog.model.send_chatgpt_chat_request_stream(
+                    _prompt_with_history,
+                    model=model,
+                    bot_name=BOT_NAME,
+                    user_displayname=user_displayname,
+                    temp_override=overrides.temperature,
+                    top_p_override=overrides.top_p,
+                    frequency_penalty_override=overrides.frequency_penalty,
+                    presence_penalty_override=overrides.presence_penalty,
+                    stop=stop,
+                    custom_api_key=custom_api_key,
+                    message_cache=converser_cog.conversation_threads[
+                        ctx.channel.id
+                    ].get_chat_messages(),
+                )
+                streamed_reply = StreamedReply(
+                    ctx, converser_cog.TEXT_CUTOFF, converser_cog.cleanse_response
+                )
+                response = await streamed_reply.consume(stream)
+
+            elif is_chatgpt_conversation:
                 _prompt_with_history = converser_cog.conversation_threads[
                     ctx.channel.id
                 ].history
@@ -367,6 +531,9 @@ class TextService:
                     presence_penalty_override=overrides.presence_penalty,
                     stop=stop if not from_ask_command else None,
                     custom_api_key=custom_api_key,
+                    message_cache=converser_cog.conversation_threads[
+                        ctx.channel.id
+                    ].get_chat_messages(),
                 )
 
             elif from_edit_command:
@@ -390,6 +557,8 @@ class TextService:
                     custom_api_key=custom_api_key,
                     is_chatgpt_request=is_chatgpt_request,
                     system_instruction=system_instruction,
+                    use_cache=from_ask_command,
+                    refresh_cache=redo_request,
                 )
 
             # Clean the request response
@@ -447,12 +616,8 @@ class TextService:
             ):
                 if not redo_request:
                     converser_cog.conversation_threads[ctx.channel.id].history.append(
-                        EmbeddedConversationItem(
-                            "\n"
-                            + BOT_NAME
-                            + str(response_text)
-                            + "<|endofstatement|>\n",
-                            0,
+                        EmbeddedConversationItem.from_response(
+                            BOT_NAME, str(response_text), 0
                         )
                     )
 
@@ -498,8 +663,9 @@ class TextService:
             # Cleanse again
             response_text = converser_cog.cleanse_response(response_text)
 
-            converser_cog.full_conversation_history[ctx.channel.id].append(
-                response_text
+            await converser_cog.full_conversation_history.ensure_length(ctx.channel.id)
+            converser_cog.full_conversation_history.append(
+                ctx.channel.id, response_text
             )
 
             # escape any other mentions like @here or @everyone
@@ -507,7 +673,20 @@ class TextService:
 
             # If we don't have a response message, we are not doing a redo, send as a new message(s)
             if not response_message:
-                if len(response_text) > converser_cog.TEXT_CUTOFF:
+                if streamed_reply:
+                    # The reply was already posted while streaming, bring it up to date with the final text
+                    paginator = None
+                    response_message = await streamed_reply.finalize(
+                        response_text,
+                        view=ConversationView(
+                            ctx,
+                            converser_cog,
+                            ctx.channel.id,
+                            model,
+                            custom_api_key=custom_api_key,
+                        ),
+                    )
+                elif len(response_text) > converser_cog.TEXT_CUTOFF:
                     if not from_context:
                         paginator = None
                         response_message = await converser_cog.paginate_and_send(
@@ -691,6 +870,7 @@ class TextService:
             message.content.strip() if not amended_message else amended_message.strip()
         )
         conversing = converser_cog.check_conversing(message.channel.id, content)
+        await converser_cog.conversation_threads.ensure_loaded(message.channel.id)
 
         # If the user is conversing and they want to end it, end it immediately before we continue any further.
         if conversing and message.content.lower() in converser_cog.END_PROMPTS:
@@ -722,56 +902,27 @@ class TextService:
             # If the user is in a conversation thread
             if message.channel.id in converser_cog.conversation_threads:
                 # Since this is async, we don't want to allow the user to send another prompt while a conversation
-                # prompt is processing, that'll mess up the conversation history!
-                if message.author.id in converser_cog.awaiting_responses:
-                    resp_message = await message.reply(
-                        embed=discord.Embed(
-                            title=f"You are already waiting for a response, please wait and speak afterwards.",
-                            color=0x808080,
-                        )
+                # prompt is processing, that'll mess up the conversation history! The message is either held until
+                # the thread is free again or turned away.
+                if (
+                    message.channel.id in converser_cog.awaiting_thread_responses
+                    and await TextService.hold_follow_up(
+                        converser_cog, message, content, files
                     )
-                    try:
-                        await resp_message.channel.trigger_typing()
-                    except:
-                        pass
+                ):
+                    return True
 
-                    # get the current date, add 10 seconds to it, and then turn it into a timestamp.
-                    # we need to use our deletion service because this isn't an interaction, it's a regular message.
-                    deletion_time = datetime.datetime.now() + datetime.timedelta(
-                        seconds=5
+                if message.author.id in converser_cog.awaiting_responses:
+                    await TextService.turn_away(
+                        converser_cog, message, TextService.USER_BUSY
                     )
-                    deletion_time = deletion_time.timestamp()
-
-                    deletion_message = Deletion(resp_message, deletion_time)
-                    deletion_original_message = Deletion(message, deletion_time)
-                    await converser_cog.deletion_queue.put(deletion_message)
-                    await converser_cog.deletion_queue.put(deletion_original_message)
 
                     return
 
                 if message.channel.id in converser_cog.awaiting_thread_responses:
-                    resp_message = await message.reply(
-                        embed=discord.Embed(
-                            title=f"This thread is already waiting for a response, please wait and speak afterwards.",
-                            color=0x808080,
-                        )
+                    await TextService.turn_away(
+                        converser_cog, message, TextService.THREAD_BUSY
                     )
-                    try:
-                        await resp_message.channel.trigger_typing()
-                    except:
-                        pass
-
-                    # get the current date, add 10 seconds to it, and then turn it into a timestamp.
-                    # we need to use our deletion service because this isn't an interaction, it's a regular message.
-                    deletion_time = datetime.datetime.now() + datetime.timedelta(
-                        seconds=5
-                    )
-                    deletion_time = deletion_time.timestamp()
-
-                    deletion_message = Deletion(resp_message, deletion_time)
-                    deletion_original_message = Deletion(message, deletion_time)
-                    await converser_cog.deletion_queue.put(deletion_message)
-                    await converser_cog.deletion_queue.put(deletion_original_message)
 
                     return
 
@@ -856,16 +1007,33 @@ class TextService:
                         file_urls = [file.url for file in files]
                         print("The file URLs were found to be" + str(file_urls))
 
-                converser_cog.awaiting_responses.append(message.author.id)
-                converser_cog.awaiting_thread_responses.append(message.channel.id)
+                # Claim the user and the thread, another message may have claimed them since the checks above
+                if not converser_cog.awaiting_responses.try_acquire(message.author.id):
+                    await TextService.turn_away(
+                        converser_cog, message, TextService.USER_BUSY
+                    )
+                    return
+                if not converser_cog.awaiting_thread_responses.try_acquire(
+                    message.channel.id
+                ):
+                    converser_cog.awaiting_responses.release(message.author.id)
+                    if not await TextService.hold_follow_up(
+                        converser_cog, message, content, files
+                    ):
+                        await TextService.turn_away(
+                            converser_cog, message, TextService.THREAD_BUSY
+                        )
+                    return
 
                 if not converser_cog.qdrant_service:
                     converser_cog.conversation_threads[
                         message.channel.id
                     ].history.append(
-                        EmbeddedConversationItem(
-                            f"\n{message.author.display_name}: {prompt} <|endofstatement|>\n",
+                        EmbeddedConversationItem.from_message(
+                            message.author.display_name,
+                            prompt,
                             0,
+                            author_id=message.author.id,
                             image_urls=file_urls,
                         )
                     )
@@ -996,19 +1164,15 @@ class TextService:
 
             # Send the request to the model
             # If conversing, the prompt to send is the history, otherwise, it's just the prompt
-            if (
-                converser_cog.qdrant_service
-                or message.channel.id not in converser_cog.conversation_threads
-            ):
+            if converser_cog.qdrant_service:
                 primary_prompt = prompt
+            elif message.channel.id not in converser_cog.conversation_threads:
+                primary_prompt = prompt + BOT_NAME
             else:
-                primary_prompt = "".join(
-                    [
-                        item.text
-                        for item in converser_cog.conversation_threads[
-                            message.channel.id
-                        ].history
-                    ]
+                # Rendered with the suffix, so encapsulated_send recognizes it as the history
+                primary_prompt = render_prompt(
+                    converser_cog.conversation_threads[message.channel.id].history,
+                    BOT_NAME,
                 )
 
             # set conversation overrides
@@ -1024,10 +1188,10 @@ class TextService:
 
             # Send an embed that tells the user that the bot is thinking
             thinking_message = await TextService.trigger_thinking(message)
-            converser_cog.full_conversation_history[message.channel.id].append(prompt)
-
-            if not converser_cog.qdrant_service:
-                primary_prompt += BOT_NAME
+            await converser_cog.full_conversation_history.ensure_length(
+                message.channel.id
+            )
+            converser_cog.full_conversation_history.append(message.channel.id, prompt)
 
             await TextService.encapsulated_send(
                 converser_cog,
@@ -1075,6 +1239,7 @@ class TextService:
                     after, after.content
                 )
 
+                await converser_cog.conversation_threads.ensure_loaded(after.channel.id)
                 if after.channel.id in converser_cog.conversation_threads:
                     # Remove the last two elements from the history array and add the new <username>: prompt
                     converser_cog.conversation_threads[after.channel.id].history = (
@@ -1191,10 +1356,8 @@ class EndConvoButton(discord.ui.Button["ConversationView"]):
     async def callback(self, interaction: discord.Interaction):
         # Get the user
         user_id = interaction.user.id
-        if (
-            user_id in self.converser_cog.conversation_thread_owners
-            and interaction.channel.id
-            in self.converser_cog.conversation_thread_owners[user_id]
+        if self.converser_cog.conversation_thread_owners.owns(
+            user_id, interaction.channel.id
         ):
             try:
                 await self.converser_cog.end_conversation(
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+
+from services.environment_service import EnvService
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+class TokenizerRegistry:
+    """
+    Creates each tiktoken encoding once for the whole process and knows which encoding a model uses, so token
+    counting never builds an encoder per call. Large inputs can be counted or encoded in a thread pool (tiktoken
+    releases the GIL while encoding) instead of on the event loop.
+    """
+
+    # Checked in order, the first prefix a model name starts with decides its encoding
+    MODEL_PREFIX_ENCODINGS = [
+        ("gpt-4", "cl100k_base"),
+        ("gpt-3.5-turbo", "cl100k_base"),
+        ("text-embedding-ada-002", "cl100k_base"),
+        ("text-davinci-003", "p50k_base"),
+        ("text-davinci-002", "p50k_base"),
+        ("code-davinci", "p50k_base"),
+        ("text-davinci-edit", "p50k_edit"),
+        ("code-davinci-edit", "p50k_edit"),
+        ("text-davinci-001", "r50k_base"),
+        ("text-curie", "r50k_base"),
+        ("text-babbage", "r50k_base"),
+        ("text-ada", "r50k_base"),
+        ("davinci", "r50k_base"),
+        ("curie", "r50k_base"),
+    ]
+
+    def __init__(self, max_workers=None, offload_characters=None):
+        self.max_workers = (
+            EnvService.get_tokenizer_threads() if max_workers is None else max_workers
+        )
+        # Inputs shorter than this (in total) are encoded right away, the thread pool hand off isn't worth it
+        self.offload_characters = (
+            EnvService.get_tokenizer_offload_characters()
+            if offload_characters is None
+            else offload_characters
+        )
+        self.encodings = {}
+        self.model_encodings = {}
+        self.lock = threading.Lock()
+        self._executor = None
+
+        # Statistics
+        self.offloaded = 0
+        self.inline = 0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="tokenizer"
+            )
+        return self._executor
+
+    def get_encoding(self, name=DEFAULT_ENCODING):
+        encoding = self.encodings.get(name)
+        if encoding is None:
+            with self.lock:
+                encoding = self.encodings.get(name)
+                if encoding is None:
+                    encoding = self.encodings[name] = tiktoken.get_encoding(name)
+        return encoding
+
+    def encoding_name_for_model(self, model):
+        name = self.model_encodings.get(model)
+        if name is not None:
+            return name
+        for prefix, encoding_name in self.MODEL_PREFIX_ENCODINGS:
+            if model.startswith(prefix):
+                name = encoding_name
+                break
+        else:
+            try:
+                name = tiktoken.encoding_for_model(model).name
+            except KeyError:
+                name = DEFAULT_ENCODING
+        self.model_encodings[model] = name
+        return name
+
+    def for_model(self, model=None):
+        """The encoding of a model, or the default (chat model) encoding if no model is given"""
+        if model is None:
+            return self.get_encoding(DEFAULT_ENCODING)
+        return self.get_encoding(self.encoding_name_for_model(model))
+
+    def encode(self, text, model=None):
+        return self.for_model(model).encode(text)
+
+    def count(self, text, model=None):
+        return len(self.for_model(model).encode(text))
+
+    async def _run(self, function, texts):
+        if sum(len(text) for text in texts) < self.offload_characters:
+            self.inline += 1
+            return function(texts)
+        self.offloaded += 1
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, function, texts
+        )
+
+    async def encode_batch(self, texts, model=None):
+        """The tokens of each of the texts, encoded in the thread pool if they are large"""
+        encoding = self.for_model(model)
+        texts = list(texts)
+        return await self._run(
+            lambda texts: [encoding.encode(text) for text in texts], texts
+        )
+
+    async def count_many(self, texts, model=None):
+        """The token count of each of the texts, counted in the thread pool if they are large"""
+        encoding = self.for_model(model)
+        texts = list(texts)
+        return await self._run(
+            lambda texts: [len(encoding.encode(text)) for text in texts], texts
+        )
+
+    async def count_async(self, text, model=None):
+        return (await self.count_many([text], model))[0]
+
+    def get_stats(self):
+        return {
+            "encodings_loaded": ", ".join(sorted(self.encodings)) or "none",
+            "models_mapped": len(self.model_encodings),
+            "batches_offloaded": self.offloaded,
+            "batches_inline": self.inline,
+        }
+
+
+# One registry for the whole process, the encodings are large and safe to share between threads
+TOKENIZERS = TokenizerRegistry()
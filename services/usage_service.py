@@ -3,7 +3,8 @@ from pathlib import Path
 
 import aiofiles
 from typing import Literal
-import tiktoken
+
+from services.tokenizer_service import TOKENIZERS
 
 
 class UsageService:
@@ -14,7 +15,7 @@ class UsageService:
             with self.usage_file_path.open("w") as f:
                 f.write("0.00")
                 f.close()
-        self.tokenizer = tiktoken.get_encoding("cl100k_base")
+        self.tokenizer = TOKENIZERS.get_encoding()
         self.usage = defaultdict()
 
     COST_MAPPING = {
@@ -93,8 +94,7 @@ class UsageService:
         return usage
 
     def count_tokens(self, text):
-        res = self.tokenizer.encode(text)
-        return len(res)
+        return TOKENIZERS.count(text)
 
     async def update_usage_image(self, image_size):
         image_size = image_size.split(" ")[0]
@@ -134,6 +134,4 @@ class UsageService:
 
     @staticmethod
     def count_tokens_static(text):
-        tokenizer = tiktoken.get_encoding("cl100k_base")
-        res = tokenizer.encode(text)
-        return len(res)
+        return TOKENIZERS.count(text)
@@ -0,0 +1,236 @@
+"""
+Drives N concurrent simulated conversations through TextService.encapsulated_send, against the mock server in
+tests/mock_openai_server.py (started in process) or any other OpenAI compatible server given with --base-url,
+and reports the latency percentiles and throughput of the conversation turns.
+
+    python -m tests.load_driver --conversations 50 --turns 5 --latency lognormal:0.8:0.5
+
+Discord itself is faked, so this measures the bot's own request path (prompt building, token counting, rate
+limiting, scheduling, pooling and the API round trip) and nothing else.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from tests.mock_openai_server import add_server_arguments, server_from_arguments
+
+ids = itertools.count(10**17)
+
+
+class FakeUser:
+    def __init__(self, name):
+        self.id = next(ids)
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{self.id}>"
+
+
+class FakeMessage:
+    def __init__(self, channel, author, content=""):
+        self.id = next(ids)
+        self.channel = channel
+        self.author = author
+        self.guild = channel.guild
+        self.content = content
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def edit(self, content=None, **kwargs):
+        if content is not None:
+            self.content = content
+        return self
+
+    async def delete(self, **kwargs):
+        pass
+
+
+class FakeGuild:
+    def __init__(self):
+        self.id = next(ids)
+        self.name = "Load test"
+
+
+class FakeChannel:
+    def __init__(self, guild):
+        self.id = next(ids)
+        self.guild = guild
+        self.sent = []
+        self.errors = []
+
+    async def send(self, content=None, embed=None, **kwargs):
+        if embed is not None:
+            self.errors.append(embed.title or embed.description)
+        message = FakeMessage(self, None, content or "")
+        self.sent.append(message)
+        return message
+
+
+class FakeBot:
+    user = FakeUser("GPTie")
+
+    def get_channel(self, _id):
+        return None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, round(fraction * len(values)) - 1))
+    return values[index]
+
+
+async def drain(queue):
+    while True:
+        await queue.get()
+
+
+async def run_conversation(cog, number, turns, think_time, model, latencies, errors):
+    from models.user_model import EmbeddedConversationItem, Thread, render_prompt
+    from models.openai_model import Override
+    from services.text_service import BOT_NAME, TextService
+
+    channel = FakeChannel(FakeGuild())
+    author = FakeUser(f"User{number}")
+    thread = Thread(channel.id)
+    thread.history.append(
+        EmbeddedConversationItem(cog.CONVERSATION_STARTER_TEXT_MINIMAL, 0)
+    )
+    cog.conversation_threads[channel.id] = thread
+
+    for turn in range(turns):
+        text = f"This is message {turn} of conversation {number}, tell me something"
+        message = FakeMessage(channel, author, text)
+        thread.history.append(
+            EmbeddedConversationItem.from_message(
+                author.display_name, text, 0, author_id=author.id
+            )
+        )
+        prompt = render_prompt(thread.history, BOT_NAME)
+
+        errors_before = len(channel.errors)
+        started = time.perf_counter()
+        await TextService.encapsulated_send(
+            cog,
+            channel.id,
+            prompt,
+            message,
+            overrides=Override(None, None, None, None),
+            model=model,
+        )
+        latencies.append(time.perf_counter() - started)
+        errors.extend(channel.errors[errors_before:])
+        thread.count += 1
+
+        if think_time:
+            await asyncio.sleep(random.uniform(0, think_time))
+
+
+async def main(args):
+    server = None
+    if args.base_url:
+        os.environ["OPENAI_API_BASE"] = args.base_url
+    else:
+        server = server_from_arguments(args)
+        await server.start()
+        os.environ["OPENAI_API_BASE"] = server.base_url
+    os.environ.setdefault("OPENAI_TOKEN", "sk-load-test")
+    # Everything the bot stores (the conversation store, archive and journal, the pickles, the caches) goes to a
+    # temporary directory instead of the bot's own
+    data_path = Path(tempfile.mkdtemp(prefix="gptdiscord-load-"))
+    (data_path / "pickles").mkdir()
+    os.environ["SHARE_DIR"] = str(data_path)
+
+    # Imported only now, the model picks the API base up from the environment when it is created, and the paths
+    # of what is stored are taken when the modules are imported
+    from cogs.text_service_cog import GPT3ComCon
+    from models.openai_model import Model
+    from services.deletion_service import DeletionScheduler
+    from services.usage_service import UsageService
+
+    model = Model(UsageService(data_path))
+    message_queue = asyncio.Queue()
+    cog = GPT3ComCon(
+        FakeBot(),
+        model.usage_service,
+        model,
+        message_queue,
+        DeletionScheduler(),
+        0,
+        0,
+        data_path,
+        None,
+    )
+    drainer = asyncio.create_task(drain(message_queue))
+
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(
+            *[
+                run_conversation(
+                    cog,
+                    number,
+                    args.turns,
+                    args.think_time,
+                    args.model,
+                    latencies,
+                    errors,
+                )
+                for number in range(args.conversations)
+            ]
+        )
+    finally:
+        elapsed = time.perf_counter() - started
+        drainer.cancel()
+        await model.connection_pool.close()
+        if server:
+            await server.stop()
+
+    print(
+        f"{args.conversations} conversations x {args.turns} turns, "
+        f"{len(latencies)} turns in {elapsed:0.2f}s ({len(latencies) / elapsed:0.2f} requests/s)"
+    )
+    if latencies:
+        print(
+            f"latency p50 {percentile(latencies, 0.50):0.3f}s, "
+            f"p95 {percentile(latencies, 0.95):0.3f}s, "
+            f"p99 {percentile(latencies, 0.99):0.3f}s, "
+            f"mean {statistics.mean(latencies):0.3f}s, max {max(latencies):0.3f}s"
+        )
+    print(f"errors: {len(errors)}")
+    if server:
+        print(f"mock server: {server.get_stats()}")
+    for section, stats in model.get_performance_stats().items():
+        print(f"{section}: {stats}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=0.0,
+        help="Maximum random pause in seconds between the turns of a conversation",
+    )
+    parser.add_argument("--model", default=None, help="Defaults to the bot's model")
+    parser.add_argument(
+        "--base-url",
+        default=None,
+        help="Use this OpenAI compatible server instead of starting the mock server",
+    )
+    add_server_arguments(parser)
+    sys.exit(asyncio.run(main(parser.parse_args())))
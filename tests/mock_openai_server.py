@@ -0,0 +1,473 @@
+"""
+A local, OpenAI compatible mock server for load testing the bot without spending API credit.
+
+It speaks the chat/completions, completions, edits, embeddings, moderations, images and audio endpoints with
+made up content, simulates a configurable latency distribution, supports streaming, sends the x-ratelimit-*
+headers for per key request and token budgets (answering with a 429 once they are used up) and can inject
+random 429s.
+
+Run it standalone and point the bot at it with OPENAI_API_BASE=http://127.0.0.1:8089/v1:
+
+    python -m tests.mock_openai_server --latency lognormal:0.8:0.5 --rpm 3500 --tpm 90000 --error-rate 0.01
+
+or start it in process with MockOpenAIServer(...).start(), as tests/load_driver.py does.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+EMBEDDING_DIMENSIONS = 1536
+MODERATION_CATEGORIES = [
+    "hate",
+    "hate/threatening",
+    "harassment",
+    "self-harm",
+    "sexual",
+    "sexual/minors",
+    "violence",
+    "violence/graphic",
+]
+WORDS = (
+    "the quick brown fox jumps over the lazy dog while a mock server pretends to be "
+    "a very large language model and answers every question with plausible filler text"
+).split()
+
+
+class LatencyDistribution:
+    """
+    Parses a latency spec into a sampler, in seconds:
+    constant:0.5, uniform:0.2:1.0, normal:0.8:0.2, lognormal:0.8:0.5 (median, sigma) or exponential:0.8 (mean)
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        name, *params = spec.split(":")
+        params = [float(param) for param in params]
+        if name == "constant":
+            self.sample = lambda: params[0]
+        elif name == "uniform":
+            self.sample = lambda: random.uniform(params[0], params[1])
+        elif name == "normal":
+            self.sample = lambda: max(0.0, random.gauss(params[0], params[1]))
+        elif name == "lognormal":
+            self.sample = lambda: params[0] * random.lognormvariate(0, params[1])
+        elif name == "exponential":
+            self.sample = lambda: random.expovariate(1 / params[0])
+        else:
+            raise ValueError(f"Unknown latency distribution {spec}")
+
+
+def format_reset(seconds):
+    """Format a duration the way the x-ratelimit-reset-* headers do, e.g. 20ms, 1s or 6m0s"""
+    if seconds < 1:
+        return f"{int(seconds * 1000)}ms"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes:
+        return f"{int(minutes)}m{int(seconds)}s"
+    return f"{seconds:0.3g}s"
+
+
+class Budget:
+    """A per minute budget that refills continuously, like the OpenAI rate limits"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.remaining = float(limit)
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.remaining = min(
+            self.limit, self.remaining + (now - self.updated_at) * self.limit / 60
+        )
+        self.updated_at = now
+
+    def reset_seconds(self):
+        return (self.limit - self.remaining) / (self.limit / 60)
+
+
+class MockOpenAIServer:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8089,
+        latency="constant:0.3",
+        stream_chunk_delay=0.02,
+        error_rate=0.0,
+        rpm=3500,
+        tpm=90000,
+        enforce_limits=True,
+        reply_words=40,
+    ):
+        self.host = host
+        self.port = port
+        self.latency = LatencyDistribution(latency)
+        self.stream_chunk_delay = stream_chunk_delay
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        self.enforce_limits = enforce_limits
+        self.reply_words = reply_words
+
+        self.budgets = {}
+        self.requests = Counter()
+        self.rate_limited = 0
+        self.runner = None
+        self.image = self.make_image()
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    @staticmethod
+    def make_image():
+        try:
+            from PIL import Image
+
+            buffer = io.BytesIO()
+            Image.new("RGB", (1024, 1024), (114, 137, 218)).save(buffer, "PNG")
+            return buffer.getvalue()
+        except ImportError:
+            return b""
+
+    @staticmethod
+    def count_tokens(text):
+        # Close enough to tiktoken for English text, without its cost
+        return max(1, len(text) // 4)
+
+    def make_text(self, seed):
+        rng = random.Random(seed)
+        return " ".join(rng.choice(WORDS) for _ in range(self.reply_words))
+
+    # Rate limits
+
+    def get_budgets(self, request):
+        key = request.headers.get("Authorization", "")
+        if key not in self.budgets:
+            self.budgets[key] = (Budget(self.rpm), Budget(self.tpm))
+        return self.budgets[key]
+
+    def rate_limit_headers(self, requests, tokens):
+        return {
+            "x-ratelimit-limit-requests": str(requests.limit),
+            "x-ratelimit-limit-tokens": str(tokens.limit),
+            "x-ratelimit-remaining-requests": str(max(0, int(requests.remaining))),
+            "x-ratelimit-remaining-tokens": str(max(0, int(tokens.remaining))),
+            "x-ratelimit-reset-requests": format_reset(requests.reset_seconds()),
+            "x-ratelimit-reset-tokens": format_reset(tokens.reset_seconds()),
+        }
+
+    def too_many_requests(self, headers, message):
+        self.rate_limited += 1
+        return web.json_response(
+            {
+                "error": {
+                    "message": message,
+                    "type": "requests",
+                    "code": "rate_limit_exceeded",
+                }
+            },
+            status=429,
+            headers=headers,
+        )
+
+    async def admit(self, request, prompt_tokens):
+        """Charge the request against its key's budget, returns (rate limit headers, 429 response or None)"""
+        self.requests[request.path] += 1
+        requests, tokens = self.get_budgets(request)
+        requests.refill()
+        tokens.refill()
+        over_budget = requests.remaining < 1 or tokens.remaining < prompt_tokens
+        if not over_budget or not self.enforce_limits:
+            requests.remaining -= 1
+            tokens.remaining -= prompt_tokens
+        headers = self.rate_limit_headers(requests, tokens)
+
+        if over_budget and self.enforce_limits:
+            return headers, self.too_many_requests(
+                headers, "Rate limit reached (mock server budget)"
+            )
+        if random.random() < self.error_rate:
+            return headers, self.too_many_requests(
+                headers, "Rate limit reached (injected by the mock server)"
+            )
+
+        await asyncio.sleep(self.latency.sample())
+        return headers, None
+
+    # Endpoints
+
+    @staticmethod
+    def messages_text(messages):
+        texts = []
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, list):
+                content = " ".join(part.get("text", "") for part in content)
+            texts.append(str(content))
+        return "".join(texts)
+
+    async def chat_completions(self, request):
+        body = await request.json()
+        prompt = self.messages_text(body.get("messages", []))
+        prompt_tokens = self.count_tokens(prompt)
+        headers, error = await self.admit(request, prompt_tokens)
+        if error:
+            return error
+
+        text = self.make_text(prompt)
+        completion_tokens = self.count_tokens(text)
+        model = body.get("model", "gpt-3.5-turbo")
+        if not body.get("stream"):
+            return web.json_response(
+                {
+                    "id": f"chatcmpl-mock-{sum(self.requests.values())}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                    },
+                },
+                headers=headers,
+            )
+
+        response = web.StreamResponse(
+            headers={**headers, "Content-Type": "text/event-stream"}
+        )
+        await response.prepare(request)
+        words = text.split(" ")
+        for index, word in enumerate(words):
+            delta = {"content": word if index == 0 else f" {word}"}
+            chunk = {
+                "object": "chat.completion.chunk",
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            await asyncio.sleep(self.stream_chunk_delay)
+        final = {
+            "object": "chat.completion.chunk",
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        await response.write(f"data: {json.dumps(final)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def completions(self, request):
+        body = await request.json()
+        prompt = str(body.get("prompt") or body.get("input") or "")
+        prompt_tokens = self.count_tokens(prompt)
+        headers, error = await self.admit(request, prompt_tokens)
+        if error:
+            return error
+
+        text = self.make_text(prompt)
+        completion_tokens = self.count_tokens(text)
+        return web.json_response(
+            {
+                "object": "text_completion",
+                "created": int(time.time()),
+                "model": body.get("model", "text-davinci-003"),
+                "choices": [{"index": 0, "text": text, "finish_reason": "stop"}],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+            headers=headers,
+        )
+
+    async def embeddings(self, request):
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        prompt_tokens = sum(self.count_tokens(text) for text in inputs)
+        headers, error = await self.admit(request, prompt_tokens)
+        if error:
+            return error
+
+        data = []
+        for index, text in enumerate(inputs):
+            # The same text always gets the same vector
+            rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+            embedding = [rng.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        return web.json_response(
+            {
+                "object": "list",
+                "data": data,
+                "model": body.get("model", "text-embedding-ada-002"),
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "total_tokens": prompt_tokens,
+                },
+            },
+            headers=headers,
+        )
+
+    async def moderations(self, request):
+        body = await request.json()
+        text = str(body.get("input", ""))
+        headers, error = await self.admit(request, self.count_tokens(text))
+        if error:
+            return error
+
+        return web.json_response(
+            {
+                "id": "modr-mock",
+                "model": "text-moderation-latest",
+                "results": [
+                    {
+                        "flagged": False,
+                        "categories": {
+                            category: False for category in MODERATION_CATEGORIES
+                        },
+                        "category_scores": {
+                            category: 0.0001 for category in MODERATION_CATEGORIES
+                        },
+                    }
+                ],
+            },
+            headers=headers,
+        )
+
+    async def images(self, request):
+        if request.content_type == "application/json":
+            body = await request.json()
+        else:
+            body = dict(await request.post())
+        headers, error = await self.admit(request, 0)
+        if error:
+            return error
+
+        image_url = f"http://{self.host}:{self.port}/files/mock.png"
+        return web.json_response(
+            {
+                "created": int(time.time()),
+                "data": [{"url": image_url} for _ in range(int(body.get("n", 1)))],
+            },
+            headers=headers,
+        )
+
+    async def transcriptions(self, request):
+        await request.post()
+        headers, error = await self.admit(request, 0)
+        if error:
+            return error
+        return web.json_response(
+            {"text": self.make_text(sum(self.requests.values()))}, headers=headers
+        )
+
+    async def image_file(self, request):
+        return web.Response(body=self.image, content_type="image/png")
+
+    def make_app(self):
+        app = web.Application(client_max_size=32 * 1024**2)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/v1/completions", self.completions)
+        app.router.add_post("/v1/edits", self.completions)
+        app.router.add_post("/v1/embeddings", self.embeddings)
+        app.router.add_post("/v1/moderations", self.moderations)
+        app.router.add_post("/v1/images/generations", self.images)
+        app.router.add_post("/v1/images/variations", self.images)
+        app.router.add_post("/v1/images/edits", self.images)
+        app.router.add_post("/v1/audio/transcriptions", self.transcriptions)
+        app.router.add_get("/files/mock.png", self.image_file)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.make_app(), access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def get_stats(self):
+        return {
+            "requests": dict(self.requests),
+            "rate_limited": self.rate_limited,
+        }
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument(
+        "--latency",
+        default="constant:0.3",
+        help="Response latency in seconds: constant:S, uniform:MIN:MAX, normal:MEAN:STD, "
+        "lognormal:MEDIAN:SIGMA or exponential:MEAN",
+    )
+    parser.add_argument(
+        "--stream-chunk-delay",
+        type=float,
+        default=0.02,
+        help="Seconds between streamed words",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with an injected 429",
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=3500, help="Requests per minute per key"
+    )
+    parser.add_argument(
+        "--tpm", type=int, default=90000, help="Tokens per minute per key"
+    )
+    parser.add_argument(
+        "--no-enforce-limits",
+        action="store_true",
+        help="Only report the rate limit headers, never answer with a 429 for going over them",
+    )
+    parser.add_argument(
+        "--reply-words", type=int, default=40, help="Words in every generated reply"
+    )
+
+
+def server_from_arguments(args):
+    return MockOpenAIServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        stream_chunk_delay=args.stream_chunk_delay,
+        error_rate=args.error_rate,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        enforce_limits=not args.no_enforce_limits,
+        reply_words=args.reply_words,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    add_server_arguments(parser)
+    server = server_from_arguments(parser.parse_args())
+    print(f"Mock OpenAI server listening on {server.base_url}")
+    web.run_app(server.make_app(), host=server.host, port=server.port, access_log=None)
@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, Mock
+
+import discord
+import pytest
+
+from services.deletion_service import Deletion, DeletionScheduler
+
+
+def make_channel(channel_id=1):
+    channel = Mock()
+    channel.id = channel_id
+    channel.delete_messages = AsyncMock()
+    return channel
+
+
+# Keeps the ids of messages made at the same time apart
+SEQUENCE = itertools.count()
+
+
+def make_message(channel, age=timedelta(0)):
+    sent_at = datetime.now(timezone.utc) - age
+    message = Mock(spec=discord.Message)
+    message.id = discord.utils.time_snowflake(sent_at) + next(SEQUENCE)
+    message.channel = channel
+    message.delete = AsyncMock()
+    return message
+
+
+def in_seconds(seconds):
+    return datetime.now().timestamp() + seconds
+
+
+def test_due_deletions_are_taken_in_order():
+    scheduler = DeletionScheduler()
+    channel = make_channel()
+    later, first, second = (make_message(channel) for _ in range(3))
+    scheduler.put_nowait(Deletion(later, in_seconds(60)))
+    scheduler.put_nowait(Deletion(second, in_seconds(-1)))
+    scheduler.put_nowait(Deletion(first, in_seconds(-2)))
+
+    assert [deletion.message for deletion in scheduler.take_due()] == [first, second]
+    assert len(scheduler) == 1
+    assert scheduler.take_due() == []
+
+
+def test_rescheduling_a_message_replaces_its_deletion():
+    scheduler = DeletionScheduler()
+    message = make_message(make_channel())
+    scheduler.put_nowait(Deletion(message, in_seconds(-1)))
+    scheduler.put_nowait(Deletion(message, in_seconds(60)))
+
+    assert len(scheduler) == 1
+    # The earlier entry left in the heap is skipped
+    assert scheduler.take_due() == []
+    assert scheduler.heap[0][2].message is message
+
+    scheduler.put_nowait(Deletion(message, in_seconds(-1)))
+    assert [deletion.message for deletion in scheduler.take_due()] == [message]
+    assert scheduler.empty()
+
+
+def test_cancelled_deletions_are_not_taken():
+    scheduler = DeletionScheduler()
+    message = make_message(make_channel())
+    scheduler.put_nowait(Deletion(message, in_seconds(-1)))
+
+    assert scheduler.cancel(message.id)
+    assert not scheduler.cancel(message.id)
+    assert scheduler.take_due() == []
+    assert scheduler.get_stats()["cancelled"] == 1
+
+
+def test_interaction_responses_are_keyed_by_the_interaction():
+    interaction = object()
+    deletion = Deletion(interaction, in_seconds(0))
+    assert deletion.key == ("interaction", id(interaction))
+
+
+@pytest.mark.asyncio
+async def test_an_earlier_deletion_wakes_the_scheduler():
+    scheduler = DeletionScheduler()
+    channel = make_channel()
+    scheduler.put_nowait(Deletion(make_message(channel), in_seconds(60)))
+
+    waiting = asyncio.create_task(scheduler.wait())
+    await asyncio.sleep(0)
+    assert not waiting.done()
+
+    scheduler.put_nowait(Deletion(make_message(channel), in_seconds(-1)))
+    await asyncio.wait_for(waiting, 1)
+
+
+@pytest.mark.asyncio
+async def test_messages_of_a_channel_are_deleted_in_bulk():
+    scheduler = DeletionScheduler()
+    channel = make_channel()
+    recent = [make_message(channel) for _ in range(3)]
+    old = make_message(channel, age=timedelta(days=20))
+
+    await scheduler.delete(
+        [Deletion(message, in_seconds(-1)) for message in recent + [old]]
+    )
+
+    channel.delete_messages.assert_awaited_once_with(recent)
+    # Too old to be bulk deleted
+    old.delete.assert_awaited_once()
+    stats = scheduler.get_stats()
+    assert (stats["deleted"], stats["bulk_deletes"]) == (4, 1)
+
+
+@pytest.mark.asyncio
+async def test_messages_that_are_gone_already_are_skipped():
+    scheduler = DeletionScheduler()
+    message = make_message(make_channel())
+    message.delete.side_effect = discord.NotFound(
+        Mock(status=404, reason="Not Found"), "Unknown Message"
+    )
+
+    await scheduler.delete([Deletion(message, in_seconds(-1))])
+
+    stats = scheduler.get_stats()
+    assert (stats["deleted"], stats["already_gone"], stats["failed"]) == (0, 1, 0)
+
+
+def test_snapshot_only_holds_messages():
+    scheduler = DeletionScheduler()
+    channel = make_channel(7)
+    message = make_message(channel)
+    timestamp = in_seconds(60)
+    scheduler.put_nowait(Deletion(message, timestamp))
+    scheduler.put_nowait(Deletion(object(), timestamp))
+
+    assert scheduler.snapshot() == [(7, message.id, timestamp)]
@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from services.embedding_batch_service import EmbeddingBatcher
+
+
+class FakeEmbeddingAPI:
+    """Records the batches it is sent, and embeds a text as [its length]"""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    async def send_batch(self, texts, api_key, estimated_tokens):
+        self.batches.append((list(texts), api_key, estimated_tokens))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("embedding request failed")
+        return [[len(text)] for text in texts]
+
+
+def make_batcher(api, **kwargs):
+    options = {"window": 0.01, "max_batch_size": 100, "max_batch_tokens": 1000}
+    options.update(kwargs)
+    return EmbeddingBatcher(api.send_batch, len, **options)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_texts_are_sent_in_one_batch():
+    api = FakeEmbeddingAPI()
+    batcher = make_batcher(api)
+
+    embeddings = await asyncio.gather(
+        batcher.embed("a"), batcher.embed("bb"), batcher.embed("ccc")
+    )
+
+    # Each caller gets its own vector back
+    assert embeddings == [[1], [2], [3]]
+    assert api.batches == [(["a", "bb", "ccc"], None, 6)]
+    assert batcher.get_stats()["batches_sent"] == 1
+    assert batcher.get_stats()["largest_batch"] == 3
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_sent_before_the_window_ends():
+    api = FakeEmbeddingAPI()
+    batcher = make_batcher(api, window=60, max_batch_size=2)
+
+    embeddings = await asyncio.wait_for(
+        asyncio.gather(batcher.embed("a"), batcher.embed("bb")), 1
+    )
+
+    assert embeddings == [[1], [2]]
+    assert len(api.batches) == 1
+
+
+@pytest.mark.asyncio
+async def test_token_cap_starts_a_new_batch():
+    api = FakeEmbeddingAPI()
+    batcher = make_batcher(api, max_batch_tokens=5)
+
+    await asyncio.gather(batcher.embed("aaa"), batcher.embed("bbb"))
+
+    assert [batch[0] for batch in api.batches] == [["aaa"], ["bbb"]]
+
+
+@pytest.mark.asyncio
+async def test_batches_are_kept_per_api_key():
+    api = FakeEmbeddingAPI()
+    batcher = make_batcher(api)
+
+    await asyncio.gather(
+        batcher.embed("a", "key 1"),
+        batcher.embed("b", "key 2"),
+        batcher.embed("c", "key 1"),
+    )
+
+    assert sorted((batch[1], batch[0]) for batch in api.batches) == [
+        ("key 1", ["a", "c"]),
+        ("key 2", ["b"]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_a_failed_batch_fails_every_caller():
+    api = FakeEmbeddingAPI(fail=True)
+    batcher = make_batcher(api)
+
+    results = await asyncio.gather(
+        batcher.embed("a"), batcher.embed("b"), return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert batcher.get_stats()["pending_batches"] == 0
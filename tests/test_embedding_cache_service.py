@@ -0,0 +1,82 @@
+import pytest
+
+from services.embedding_cache_service import EmbeddingCache
+
+
+def make_cache(tmp_path, max_memory_items=10):
+    return EmbeddingCache(
+        path=str(tmp_path / "embedding_cache.sqlite"),
+        max_memory_items=max_memory_items,
+    )
+
+
+def test_keys_depend_on_the_model_and_the_text():
+    key = EmbeddingCache.get_key("ada", "hello")
+    assert key == EmbeddingCache.get_key("ada", "hello")
+    assert key != EmbeddingCache.get_key("ada", "hello!")
+    assert key != EmbeddingCache.get_key("babbage", "hello")
+
+
+def test_put_and_get(tmp_path):
+    cache = make_cache(tmp_path)
+    assert cache.get("ada", "hello") is None
+
+    cache.put("ada", "hello", [0.5, 0.25])
+    assert cache.get("ada", "hello") == [0.5, 0.25]
+    assert cache.get("babbage", "hello") is None
+
+    stats = cache.get_stats()
+    assert (stats["memory_hits"], stats["misses"]) == (1, 2)
+    assert stats["unwritten"] == 0
+
+
+def test_evicted_vectors_are_read_back_from_disk(tmp_path):
+    cache = make_cache(tmp_path, max_memory_items=1)
+    cache.put("ada", "one", [1.0])
+    cache.put("ada", "two", [2.0])
+    assert cache.get_stats()["vectors_in_memory"] == 1
+
+    assert cache.get("ada", "one") == [1.0]
+    assert cache.get_stats()["disk_hits"] == 1
+
+
+def test_vectors_survive_a_restart(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("ada", "hello", [0.5])
+    cache.db.close()
+
+    assert make_cache(tmp_path).get("ada", "hello") == [0.5]
+
+
+@pytest.mark.asyncio
+async def test_writes_put_on_the_event_loop_are_batched(tmp_path):
+    cache = make_cache(tmp_path, max_memory_items=1)
+    await cache.aput("ada", "one", [1.0])
+    await cache.aput("ada", "two", [2.0])
+    # Both are written by the flush started by the first
+    assert cache.flush_scheduled
+    await cache.flush_task
+    assert cache.get_stats()["unwritten"] == 0
+    assert not cache.flush_scheduled
+
+    assert await cache.aget("ada", "one") == [1.0]
+    assert await cache.aget("ada", "two") == [2.0]
+    assert await cache.aget("ada", "three") is None
+    stats = cache.get_stats()
+    assert (stats["disk_hits"], stats["misses"]) == (2, 1)
+
+
+@pytest.mark.asyncio
+async def test_unwritten_vectors_can_be_read(tmp_path):
+    cache = make_cache(tmp_path, max_memory_items=1)
+    await cache.aput("ada", "one", [1.0])
+    await cache.aput("ada", "two", [2.0])
+
+    assert await cache.aget("ada", "one") == [1.0]
+    await cache.flush_task
+
+
+def test_put_without_an_embedding_is_ignored(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("ada", "hello", None)
+    assert cache.get("ada", "hello") is None
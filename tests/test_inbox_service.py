@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+from services.inbox_service import ConversationInbox
+
+
+def message(author_id, message_id):
+    return SimpleNamespace(id=message_id, author=SimpleNamespace(id=author_id))
+
+
+def test_messages_of_one_author_are_taken_together():
+    inbox = ConversationInbox(max_messages=10)
+    inbox.put("thread", message("alice", 1), "hi", ["a.png"])
+    inbox.put("thread", message("alice", 2), "are you there?")
+    assert "thread" in inbox
+    assert len(inbox) == 2
+
+    follow_up = inbox.take("thread")
+    # Answered as the last message, with the content and files of all of them
+    assert follow_up.message.id == 2
+    assert follow_up.content == "hi\nare you there?"
+    assert follow_up.files == ["a.png"]
+    assert "thread" not in inbox
+    assert inbox.get_stats()["coalesced"] == 1
+
+
+def test_other_authors_stay_held_in_order():
+    inbox = ConversationInbox(max_messages=10)
+    inbox.put("thread", message("alice", 1), "one")
+    inbox.put("thread", message("bob", 2), "two")
+    inbox.put("thread", message("alice", 3), "three")
+    inbox.put("thread", message("carol", 4), "four")
+
+    assert inbox.take("thread").content == "one\nthree"
+    assert inbox.take("thread").content == "two"
+    assert inbox.take("thread").content == "four"
+    assert inbox.take("thread") is None
+    assert inbox.get_stats()["waiting"] == 0
+
+
+def test_messages_beyond_the_limit_are_rejected():
+    inbox = ConversationInbox(max_messages=2)
+    assert inbox.put("thread", message("alice", 1), "one")
+    assert inbox.put("thread", message("alice", 2), "two")
+    assert not inbox.put("thread", message("alice", 3), "three")
+    # The limit is per thread
+    assert inbox.put("other thread", message("alice", 4), "four")
+
+    stats = inbox.get_stats()
+    assert (stats["held"], stats["rejected"], stats["threads"]) == (3, 1, 2)
+
+
+def test_discarding_a_thread_drops_its_messages():
+    inbox = ConversationInbox(max_messages=10)
+    inbox.put("thread", message("alice", 1), "one")
+    inbox.discard("thread")
+    inbox.discard("unknown thread")
+
+    assert "thread" not in inbox
+    assert inbox.take("thread") is None
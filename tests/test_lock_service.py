@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from services.lock_service import KeyedLockManager
+
+
+def test_try_acquire_turns_away_a_busy_key():
+    locks = KeyedLockManager()
+    assert locks.try_acquire("user")
+    assert not locks.try_acquire("user")
+    assert locks.try_acquire("other user")
+    assert "user" in locks
+    assert len(locks) == 2
+
+    locks.release("user")
+    assert "user" not in locks
+    assert locks.try_acquire("user")
+
+
+def test_releasing_a_free_key_does_nothing():
+    locks = KeyedLockManager()
+    locks.release("user")
+    assert len(locks) == 0
+    assert locks.get_stats() == {"held": 0, "waiting": 0}
+
+
+@pytest.mark.asyncio
+async def test_waiters_get_the_lock_in_order():
+    locks = KeyedLockManager()
+    order = []
+
+    async def work(name):
+        async with locks.hold("thread"):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    locks.try_acquire("thread")
+    tasks = [asyncio.create_task(work(name)) for name in ("first", "second")]
+    await asyncio.sleep(0)
+    assert locks.get_stats() == {"held": 1, "waiting": 2}
+
+    locks.release("thread")
+    await asyncio.gather(*tasks)
+
+    assert order == ["first", "second"]
+    # Nothing is kept for a key nobody holds or waits on
+    assert locks.get_stats() == {"held": 0, "waiting": 0}
+    assert not locks.waiters
+
+
+@pytest.mark.asyncio
+async def test_the_lock_stays_held_while_it_is_handed_on():
+    locks = KeyedLockManager()
+    locks.try_acquire("thread")
+    waiter = asyncio.create_task(locks.acquire("thread"))
+    await asyncio.sleep(0)
+
+    locks.release("thread")
+    # Taken by the waiter, nobody else can slip in before it runs
+    assert not locks.try_acquire("thread")
+    await waiter
+    assert "thread" in locks
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_waiter_is_skipped():
+    locks = KeyedLockManager()
+    locks.try_acquire("thread")
+    cancelled = asyncio.create_task(locks.acquire("thread"))
+    waiter = asyncio.create_task(locks.acquire("thread"))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    locks.release("thread")
+
+    await asyncio.wait_for(waiter, 1)
+    assert cancelled.cancelled()
+    assert locks.get_stats() == {"held": 1, "waiting": 0}
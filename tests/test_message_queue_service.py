@@ -0,0 +1,153 @@
+from unittest.mock import AsyncMock, Mock
+
+import discord
+import pytest
+
+from services.message_queue_service import (
+    CHANNEL_RATE,
+    MESSAGE_LIMIT,
+    Message,
+    MessageDispatcher,
+)
+
+
+def make_channel(channel_id=1):
+    channel = Mock()
+    channel.id = channel_id
+    channel.send = AsyncMock()
+    return channel
+
+
+def make_dispatcher(max_messages=100, overflow_policy="drop_oldest"):
+    return MessageDispatcher(max_messages=max_messages, overflow_policy=overflow_policy)
+
+
+def sent_contents(channel):
+    return [call.args[0] for call in channel.send.await_args_list]
+
+
+@pytest.mark.asyncio
+async def test_messages_to_a_channel_are_merged():
+    dispatcher = make_dispatcher()
+    channel, other_channel = make_channel(1), make_channel(2)
+    for content in ("one", "two", "three"):
+        dispatcher.put_nowait(Message(content, channel))
+    dispatcher.put_nowait(Message("other", other_channel))
+
+    assert await dispatcher.dispatch() is None
+
+    assert sent_contents(channel) == ["one\ntwo\nthree"]
+    assert sent_contents(other_channel) == ["other"]
+    assert dispatcher.empty()
+
+
+@pytest.mark.asyncio
+async def test_merged_messages_stay_within_the_message_limit():
+    dispatcher = make_dispatcher()
+    channel = make_channel()
+    for letter in "abc":
+        dispatcher.put_nowait(Message(letter * (MESSAGE_LIMIT // 2 - 1), channel))
+
+    await dispatcher.dispatch()
+    await dispatcher.dispatch()
+
+    # Two fit in one message with the line break between them, the third doesn't
+    sent = sent_contents(channel)
+    assert [len(content) for content in sent] == [
+        MESSAGE_LIMIT - 1,
+        MESSAGE_LIMIT // 2 - 1,
+    ]
+    assert dispatcher.get_stats()["sent_messages"] == 2
+
+
+@pytest.mark.asyncio
+async def test_a_long_backlog_is_sent_as_a_file():
+    dispatcher = make_dispatcher()
+    channel = make_channel()
+    for _ in range(5):
+        dispatcher.put_nowait(Message("x" * MESSAGE_LIMIT, channel))
+
+    await dispatcher.dispatch()
+
+    channel.send.assert_awaited_once()
+    assert channel.send.await_args.args[0] == "5 debug messages"
+    assert channel.send.await_args.kwargs["file"].filename == "debug.txt"
+    assert dispatcher.get_stats()["sent_files"] == 1
+
+
+@pytest.mark.asyncio
+async def test_a_channel_is_not_sent_more_than_its_rate_limit():
+    dispatcher = make_dispatcher()
+    channel = make_channel()
+    for number in range(CHANNEL_RATE):
+        dispatcher.put_nowait(Message(str(number), channel))
+        assert await dispatcher.dispatch() is None
+
+    dispatcher.put_nowait(Message("one too many", channel))
+    delay = await dispatcher.dispatch()
+
+    assert delay > 0
+    assert channel.send.await_count == CHANNEL_RATE
+    assert len(dispatcher) == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_messages_are_put_back():
+    dispatcher = make_dispatcher()
+    channel = make_channel()
+    error = discord.HTTPException(
+        Mock(status=429, reason="Too Many Requests"), "rate limited"
+    )
+    error.retry_after = 30
+    channel.send.side_effect = error
+    dispatcher.put_nowait(Message("one", channel))
+    dispatcher.put_nowait(Message("two", channel))
+
+    delay = await dispatcher.dispatch()
+
+    assert delay == pytest.approx(30, abs=1)
+    assert list(dispatcher.pending[channel.id]) == ["one", "two"]
+    assert dispatcher.get_stats()["rate_limited"] == 1
+
+
+@pytest.mark.asyncio
+async def test_the_oldest_messages_are_dropped_when_full():
+    dispatcher = make_dispatcher(max_messages=2, overflow_policy="drop_oldest")
+    channel = make_channel()
+    for content in ("one", "two", "three"):
+        dispatcher.put_nowait(Message(content, channel))
+
+    await dispatcher.dispatch()
+
+    assert sent_contents(channel) == ["(1 debug messages were dropped)\ntwo\nthree"]
+    assert dispatcher.get_stats()["dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_the_newest_messages_are_dropped_when_full():
+    dispatcher = make_dispatcher(max_messages=2, overflow_policy="drop_newest")
+    channel = make_channel()
+    for content in ("one", "two", "three"):
+        dispatcher.put_nowait(Message(content, channel))
+
+    await dispatcher.dispatch()
+
+    assert sent_contents(channel) == ["(1 debug messages were dropped)\none\ntwo"]
+
+
+def test_sampling_keeps_the_queue_bounded():
+    dispatcher = make_dispatcher(max_messages=3, overflow_policy="sample")
+    channel = make_channel()
+    for number in range(50):
+        dispatcher.put_nowait(Message(str(number), channel))
+
+    assert len(dispatcher) == 3
+    assert dispatcher.get_stats()["dropped"] == 47
+
+
+def test_messages_without_a_channel_fail():
+    dispatcher = make_dispatcher()
+    dispatcher.put_nowait(Message("lost", None))
+
+    assert dispatcher.empty()
+    assert dispatcher.get_stats()["failed"] == 1
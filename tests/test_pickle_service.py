@@ -0,0 +1,76 @@
+import pickle
+
+import pytest
+
+from services.pickle_service import Pickler, compress, decompress
+
+
+@pytest.fixture
+def pickles(tmp_path, monkeypatch):
+    (tmp_path / "pickles").mkdir()
+    monkeypatch.setenv("SHARE_DIR", str(tmp_path))
+    monkeypatch.setattr(Pickler, "hashes", {})
+    return tmp_path / "pickles"
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma", "none"])
+def test_decompress_recognizes_the_compression(compression):
+    data = pickle.dumps({"thread": ["hello"] * 100})
+    assert decompress(compress(data, compression)) == data
+
+
+def test_dump_and_load(pickles):
+    threads = {1: ["hello", "there"] * 100, 2: []}
+    stats = Pickler.dump("conversation_threads", threads, compression="zlib")
+
+    assert Pickler.load("conversation_threads") == threads
+    assert stats["written_bytes"] < stats["bytes"]
+    # Written through a temporary file that is renamed into place
+    assert [path.name for path in pickles.iterdir()] == ["conversation_threads.pickle"]
+
+
+def test_unchanged_snapshots_are_not_written_again(pickles):
+    Pickler.dump("instructions", {"user": "be brief"}, compression="zlib")
+    path = pickles / "instructions.pickle"
+    path.write_bytes(pickle.dumps("left alone"))
+
+    stats = Pickler.dump("instructions", {"user": "be brief"}, compression="zlib")
+    assert stats["skipped"]
+    assert Pickler.load("instructions") == "left alone"
+
+    stats = Pickler.dump("instructions", {"user": "be long"}, compression="zlib")
+    assert "skipped" not in stats
+    assert Pickler.load("instructions") == {"user": "be long"}
+
+
+def test_uncompressed_pickles_can_still_be_loaded(pickles):
+    (pickles / "instructions.pickle").write_bytes(pickle.dumps({"user": "be brief"}))
+    assert Pickler.load("instructions") == {"user": "be brief"}
+
+
+def test_read_unpickles_a_compressed_file_anywhere(tmp_path):
+    path = tmp_path / "conversation_threads.pickle"
+    path.write_bytes(compress(pickle.dumps({1: ["hello"]}), "lzma"))
+    assert Pickler.read(path) == {1: ["hello"]}
+
+
+def test_detach_copies_the_lists_of_a_dict():
+    original = {1: ["hello"], 2: "not a list"}
+    detached = Pickler.detach(original)
+    original[1].append("there")
+    original[3] = []
+
+    assert detached == {1: ["hello"], 2: "not a list"}
+    assert Pickler.detach(["not a dict"]) == ["not a dict"]
+
+
+@pytest.mark.asyncio
+async def test_save_writes_what_is_not_saved_elsewhere(pickles):
+    pickler = Pickler({1: ["hello"]}, None, {"user": [1]}, None)
+    await pickler.save()
+
+    assert sorted(path.name for path in pickles.iterdir()) == [
+        "conversation_thread_owners.pickle",
+        "full_conversation_history.pickle",
+    ]
+    assert Pickler.load("full_conversation_history") == {1: ["hello"]}
@@ -0,0 +1,132 @@
+import pytest
+
+from services.rate_limit_service import (
+    RateLimiter,
+    TokenBucket,
+    parse_reset_duration,
+)
+
+
+def test_parse_reset_duration():
+    assert parse_reset_duration("20ms") == pytest.approx(0.02)
+    assert parse_reset_duration("1s") == 1
+    assert parse_reset_duration("6m0s") == 360
+    assert parse_reset_duration("1.5") == 1.5
+    assert parse_reset_duration(None) is None
+    assert parse_reset_duration("soon") is None
+
+
+def test_unknown_bucket_never_blocks():
+    bucket = TokenBucket()
+    bucket.charge(1000)
+    assert bucket.wait_time(1000) == 0
+
+
+def test_bucket_refills_at_the_per_minute_rate():
+    bucket = TokenBucket()
+    bucket.update(60, 0, None, now=100)
+    assert bucket.wait_time(10) == pytest.approx(10)
+
+    bucket.refill(130)
+    assert bucket.remaining == pytest.approx(30)
+    assert bucket.wait_time(10) == 0
+
+    # Never more than the limit
+    bucket.refill(1000)
+    assert bucket.remaining == 60
+
+
+def test_request_bigger_than_the_budget_waits_for_a_full_bucket():
+    bucket = TokenBucket()
+    bucket.update(60, 30, None, now=0)
+    assert bucket.wait_time(600) == pytest.approx(30)
+
+
+def test_exhausted_bucket_waits_for_the_reset():
+    # What a 429 response says: nothing left until the reset
+    bucket = TokenBucket()
+    bucket.update(60, 0, 6, now=100)
+    bucket.refill(100)
+    assert bucket.wait_time(1) == pytest.approx(6)
+    bucket.refill(106)
+    assert bucket.wait_time(1) == pytest.approx(0)
+
+
+def test_limits_are_learned_from_the_headers():
+    limiter = RateLimiter(token_counter=len, max_wait=1)
+    assert not limiter.is_limited("key", "gpt-4")
+
+    limiter.update_from_headers("key", "gpt-4", {"x-ratelimit-limit-tokens": "100"})
+    assert not limiter.is_limited("key", "gpt-4")
+
+    limiter.update_from_headers(
+        "key",
+        "gpt-4",
+        {
+            "x-ratelimit-limit-requests": "3",
+            "x-ratelimit-remaining-requests": "2",
+            "x-ratelimit-reset-requests": "20s",
+            "x-ratelimit-limit-tokens": "100",
+            "x-ratelimit-remaining-tokens": "40",
+            "x-ratelimit-reset-tokens": "36s",
+        },
+    )
+    assert limiter.is_limited("key", "gpt-4")
+    assert not limiter.is_limited("other key", "gpt-4")
+    limit = limiter.get_limit("key", "gpt-4")
+    assert (limit.requests.limit, limit.requests.remaining) == (3, 2)
+    assert (limit.tokens.limit, limit.tokens.remaining) == (100, 40)
+
+
+def test_estimate_tokens_counts_the_prompt_and_the_completion():
+    limiter = RateLimiter(token_counter=len, max_wait=1)
+    payload = {
+        "messages": [
+            {"role": "system", "content": "abc"},
+            {"role": "user", "content": [{"type": "text", "text": "de"}]},
+        ],
+        "max_tokens": 10,
+    }
+    assert limiter.estimate_tokens(payload) == 15
+    assert limiter.estimate_tokens({"input": ["ab", "cd"]}) == 4
+
+
+@pytest.mark.asyncio
+async def test_acquire_charges_the_budget():
+    limiter = RateLimiter(token_counter=len, max_wait=1)
+    assert await limiter.acquire("key", "gpt-4", 50) == 0
+
+    limiter.update_from_headers(
+        "key",
+        "gpt-4",
+        {
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "60",
+            "x-ratelimit-limit-tokens": "6000",
+            "x-ratelimit-remaining-tokens": "6000",
+        },
+    )
+    assert await limiter.acquire("key", "gpt-4", 50) == 0
+    limit = limiter.get_limit("key", "gpt-4")
+    assert limit.requests.remaining == pytest.approx(59, abs=0.1)
+    assert limit.tokens.remaining == pytest.approx(5950, abs=1)
+
+
+@pytest.mark.asyncio
+async def test_acquire_holds_requests_after_a_429():
+    limiter = RateLimiter(token_counter=len, max_wait=0.05)
+    limiter.update_from_headers(
+        "key",
+        "gpt-4",
+        {
+            "x-ratelimit-limit-requests": "60",
+            "x-ratelimit-remaining-requests": "0",
+            "x-ratelimit-reset-requests": "10s",
+        },
+    )
+    # Held for at most max_wait, then sent anyway
+    waited = await limiter.acquire("key", "gpt-4", 1)
+    assert waited == pytest.approx(0.05)
+    limit = limiter.get_limit("key", "gpt-4")
+    assert limit.waits == 1
+    assert limit.waiting == 0
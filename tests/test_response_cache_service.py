@@ -0,0 +1,64 @@
+import time
+
+from services.response_cache_service import ResponseCache
+
+
+def test_fingerprint_ignores_whitespace_and_unrelated_fields():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    payload = {"model": "gpt-4", "prompt": "how many  hours\nare in a day?"}
+    same = {
+        "model": "gpt-4",
+        "prompt": "how many hours are in a day? ",
+        "user": "someone",
+        "stream": False,
+    }
+    other = {"model": "gpt-4", "prompt": "how many minutes are in a day?"}
+
+    assert cache.fingerprint(payload) == cache.fingerprint(same)
+    assert cache.fingerprint(payload) != cache.fingerprint(other)
+    assert cache.fingerprint(payload) != cache.fingerprint(
+        {**payload, "temperature": 0.5}
+    )
+
+
+def test_hits_and_misses_are_counted():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    assert cache.get("key") is None
+    cache.put("key", {"choices": [{"text": "24"}]})
+    assert cache.get("key") == {"choices": [{"text": "24"}]}
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+
+def test_callers_get_their_own_copy():
+    cache = ResponseCache(ttl=60, max_entries=10)
+    response = {"choices": [{"text": "24"}]}
+    cache.put("key", response)
+    response["choices"][0]["text"] = "changed"
+
+    cached = cache.get("key")
+    cached["choices"].clear()
+    assert cache.get("key") == {"choices": [{"text": "24"}]}
+
+
+def test_entries_expire():
+    cache = ResponseCache(ttl=0.01, max_entries=10)
+    cache.put("key", {"text": "24"})
+    time.sleep(0.02)
+
+    assert cache.get("key") is None
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(ttl=60, max_entries=2)
+    cache.put("one", 1)
+    cache.put("two", 2)
+    assert cache.get("one") == 1
+    cache.put("three", 3)
+
+    assert cache.get("two") is None
+    assert cache.get("one") == 1
+    assert cache.get("three") == 3
+    assert cache.get_stats()["evictions"] == 1
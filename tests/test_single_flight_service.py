@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from services.single_flight_service import SingleFlight, single_flight
+
+
+class FakeModel:
+    def __init__(self):
+        self.single_flight = SingleFlight()
+        self.sent = []
+
+    @single_flight
+    async def send_request(self, prompt, model=None):
+        self.sent.append((prompt, model))
+        await asyncio.sleep(0.01)
+        return {"prompt": prompt, "choices": []}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_execution():
+    model = FakeModel()
+
+    results = await asyncio.gather(
+        model.send_request("hello"), model.send_request("hello")
+    )
+
+    assert model.sent == [("hello", None)]
+    assert results[0] == results[1]
+    # Each caller can modify what it gets back
+    assert results[0] is not results[1]
+    assert model.single_flight.get_stats() == {
+        "calls_sent": 1,
+        "calls_coalesced": 1,
+        "in_flight": 0,
+    }
+
+
+@pytest.mark.asyncio
+async def test_different_arguments_are_sent_separately():
+    model = FakeModel()
+
+    await asyncio.gather(
+        model.send_request("hello"),
+        model.send_request("hello", model="gpt-4"),
+        model.send_request("goodbye"),
+    )
+
+    assert len(model.sent) == 3
+
+
+@pytest.mark.asyncio
+async def test_calls_after_completion_are_sent_again():
+    model = FakeModel()
+
+    await model.send_request("hello")
+    await model.send_request("hello")
+
+    assert len(model.sent) == 2
+
+
+@pytest.mark.asyncio
+async def test_an_exception_is_shared_by_everyone_waiting():
+    flight = SingleFlight()
+    calls = 0
+
+    async def failing():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("request failed")
+
+    results = await asyncio.gather(
+        flight.run("key", failing),
+        flight.run("key", failing),
+        return_exceptions=True,
+    )
+
+    assert calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_a_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.create_task(flight.run("key", slow))
+    second = asyncio.create_task(flight.run("key", slow))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    assert await second == "done"
+    with pytest.raises(asyncio.CancelledError):
+        await first
@@ -0,0 +1,46 @@
+import pytest
+import tiktoken
+
+from services.tokenizer_service import DEFAULT_ENCODING, TokenizerRegistry
+
+
+def test_encodings_are_created_once():
+    registry = TokenizerRegistry(max_workers=1, offload_characters=10)
+    assert registry.get_encoding() is registry.get_encoding(DEFAULT_ENCODING)
+    assert registry.for_model("gpt-4") is registry.for_model("gpt-3.5-turbo")
+
+
+def test_models_are_mapped_to_their_encoding():
+    registry = TokenizerRegistry(max_workers=1, offload_characters=10)
+    assert registry.encoding_name_for_model("gpt-4-1106-preview") == "cl100k_base"
+    assert registry.encoding_name_for_model("text-davinci-003") == "p50k_base"
+    assert registry.encoding_name_for_model("text-davinci-edit-001") == "p50k_edit"
+    assert registry.encoding_name_for_model("not-a-model") == DEFAULT_ENCODING
+    assert registry.get_stats()["models_mapped"] == 4
+
+
+def test_counts_match_tiktoken():
+    registry = TokenizerRegistry(max_workers=1, offload_characters=10)
+    text = "how many hours are in a day?"
+    tokens = tiktoken.get_encoding(DEFAULT_ENCODING).encode(text)
+
+    assert registry.encode(text) == tokens
+    assert registry.count(text) == len(tokens)
+
+
+@pytest.mark.asyncio
+async def test_large_inputs_are_counted_in_the_thread_pool():
+    registry = TokenizerRegistry(max_workers=1, offload_characters=20)
+    short_texts = ["a day", "an hour"]
+    long_texts = ["how many hours are in a day?", "twenty four"]
+
+    short_counts = await registry.count_many(short_texts)
+    long_counts = await registry.count_many(long_texts)
+
+    assert short_counts == [registry.count(text) for text in short_texts]
+    assert long_counts == [registry.count(text) for text in long_texts]
+    assert await registry.encode_batch(long_texts) == [
+        registry.encode(text) for text in long_texts
+    ]
+    stats = registry.get_stats()
+    assert (stats["batches_inline"], stats["batches_offloaded"]) == (1, 2)